@@ -1,3 +1,9 @@
+# Keep a compressed copy of them first (see rock_server/log_archive.py). As rock, not root, so the
+# server can still write to the archive directory afterwards
+cd ~/rock-server && sudo -u rock /home/rock/rock-server/bin/python -m rock_server.log_archive \
+    rock_server/projects/irregular_reminders/reminders_runner/reminder_runner.log \
+    system.log \
+    app.log
 sudo truncate -s 0 ~/rock-server/rock_server/projects/irregular_reminders/reminders_runner/reminder_runner.log
 sudo truncate -s 0 ~/rock-server/system.log
 sudo truncate -s 0 ~/rock-server/app.log
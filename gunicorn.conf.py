@@ -0,0 +1,55 @@
+""" Gunicorn settings for rock-server.service (gunicorn would pick this up from the working directory
+anyway, but the service passes it with -c to be sure)
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# The same defaults rock_server/app.py uses
+LOG_FILE = "app.log"
+LOG_WRITER_SOCKET = os.environ.get("LOG_WRITER_SOCKET", "app.log.sock")
+# Where the workers keep their metrics (see rock_server/prometheus.py). In memory, if we can
+METRICS_DIR = os.environ.get("METRICS_DIR") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "rock-server-metrics")
+
+# On a reload (HUP, see rock-server.service), how long the old workers get to finish what they're
+# doing before they're killed. Log streams never finish, so they get cut off then, and reconnect to
+# the new workers. Don't use preload_app, or the new workers would get the old code
+graceful_timeout = 30
+
+_log_writer = None
+
+def on_starting(server):
+    """ Start rock_server.log_writer before any workers, so they all send their logs to it instead of
+        each writing (and rotating) app.log themselves. And clear out the metrics from last time
+    """
+    global _log_writer
+    # Start the metrics over, and tell the workers where they are
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+    os.environ["METRICS_DIR"] = METRICS_DIR
+
+    _log_writer = subprocess.Popen([
+        sys.executable, "-m", "rock_server.log_writer",
+        "--socket", LOG_WRITER_SOCKET,
+        "--log-file", LOG_FILE,
+        "--format", os.environ.get("LOG_FORMAT", "text"),
+    ])
+    # The workers only use it if it's listening by the time they start
+    deadline = time.monotonic() + 5
+    while not os.path.exists(LOG_WRITER_SOCKET) and _log_writer.poll() is None and time.monotonic() < deadline:
+        time.sleep(.05)
+    if not os.path.exists(LOG_WRITER_SOCKET):
+        server.log.warning("log_writer didn't start, so the workers will write %s themselves", LOG_FILE)
+
+def on_exit(server):
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    if _log_writer is not None and _log_writer.poll() is None:
+        _log_writer.terminate()
+        try:
+            _log_writer.wait(5)
+        except subprocess.TimeoutExpired:
+            _log_writer.kill()
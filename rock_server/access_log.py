@@ -0,0 +1,65 @@
+""" Sampled access logging, for when logging a Request and Response line for every request is too much.
+Only 1 in sample_rate successful requests gets logged, but errors and slow requests always do. Every
+request gets counted though, and the counts for each route get logged as a single summary line every
+summary_sec seconds. Each worker keeps its own counts, so there's a summary line per worker.
+"""
+import logging
+import os
+import random
+import threading
+from time import sleep
+
+
+class AccessLog:
+    def __init__(self, logger, sample_rate=100, slow_ms=1000, summary_sec=60):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.summary_sec = summary_sec
+        # {(method, route): {"count": ..., "errors": ..., "bytes": ..., "ms": total duration}}
+        self.routes = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def level(self, status, duration_ms):
+        """ The level a request should be logged at, or None if it shouldn't be """
+        if status >= 500 or duration_ms >= self.slow_ms:
+            return logging.WARNING
+        if status >= 400:
+            return logging.INFO
+        if random.random() * self.sample_rate < 1:
+            return logging.DEBUG
+        return None
+
+    def record(self, method, route, status, size, duration_ms):
+        with self.lock:
+            counts = self.routes.setdefault((method, route), {"count": 0, "errors": 0, "bytes": 0, "ms": 0.})
+            counts["count"] += 1
+            counts["errors"] += status >= 400
+            counts["bytes"] += size or 0
+            counts["ms"] += duration_ms
+
+    def flush(self):
+        """ Log a summary of everything since last time, and start counting again """
+        with self.lock:
+            routes, self.routes = self.routes, {}
+        if not routes:
+            return
+        summary = "; ".join(
+            f"{method} {route}: {c['count']} requests, {c['errors']} errors, {c['bytes']} bytes, {c['ms'] / c['count']:.1f} ms avg"
+            for (method, route), c in sorted(routes.items(), key=lambda item: -item[1]["count"])
+        )
+        self.logger.info("Access summary for the last %ds (pid %d): %s", self.summary_sec, os.getpid(), summary)
+
+    def _run(self):
+        while True:
+            sleep(self.summary_sec)
+            try:
+                self.flush()
+            except Exception:
+                self.logger.exception("Failed to log the access summary")
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True, name="access log summary")
+            self.thread.start()
@@ -2,7 +2,12 @@ from flask import Flask
 import os
 import logging
 from logging.handlers import RotatingFileHandler
-from flask import Flask,  request, jsonify, render_template
+from flask import Flask,  request, jsonify, render_template, g
+from time import perf_counter
+from rock_server.log_writer import queue_logging
+from rock_server.access_log import AccessLog
+from rock_server import metrics, prometheus
+from rock_server import host_metrics
 # import sqlite3
 
 app = Flask(__name__)
@@ -34,21 +39,94 @@ app.logger.setLevel(logging.DEBUG)
 
 # Set up file-based logging
 app.LOG_FILE = 'app.log'
-file_handler = RotatingFileHandler(app.LOG_FILE, maxBytes=1024*1024, backupCount=1) # 1MB
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-app.logger.addHandler(file_handler)
+# "text" or "json". JSON lines are quicker for the log viewer to read, and keep the request timings
+app.config['LOG_FORMAT'] = os.environ.get("LOG_FORMAT", "text")
+# Where log_writer listens (gunicorn.conf.py starts it). It's the only thing that writes app.log, so
+# the workers don't fight over rotating it. If it isn't running, each worker writes the file itself
+app.config['LOG_WRITER_SOCKET'] = os.environ.get("LOG_WRITER_SOCKET", "app.log.sock")
+# Rotates at 1MB. Records go on a queue, and get written by a background thread, so requests never
+# wait on the disk
+queue_logging(app.logger, app.LOG_FILE, app.config['LOG_FORMAT'], app.config['LOG_WRITER_SOCKET'])
+
+# "all" logs a Request and a Response line for every request. "sampled" only logs 1 in
+# ACCESS_LOG_SAMPLE_RATE of the successful ones, but always logs errors and anything slower than
+# ACCESS_LOG_SLOW_MS, and logs a summary of every route every ACCESS_LOG_SUMMARY_SEC
+app.config['ACCESS_LOG'] = os.environ.get("ACCESS_LOG", "all")
+app.config['ACCESS_LOG_SAMPLE_RATE'] = int(os.environ.get("ACCESS_LOG_SAMPLE_RATE", 100))
+app.config['ACCESS_LOG_SLOW_MS'] = float(os.environ.get("ACCESS_LOG_SLOW_MS", 1000))
+app.config['ACCESS_LOG_SUMMARY_SEC'] = float(os.environ.get("ACCESS_LOG_SUMMARY_SEC", 60))
+access_log = None
+if app.config['ACCESS_LOG'] == "sampled":
+    access_log = AccessLog(app.logger,
+        sample_rate=app.config['ACCESS_LOG_SAMPLE_RATE'],
+        slow_ms=app.config['ACCESS_LOG_SLOW_MS'],
+        summary_sec=app.config['ACCESS_LOG_SUMMARY_SEC'],
+    )
+    access_log.start()
+
+# How long every request takes, and how much of that is sqlite and requests to other servers, by
+# endpoint (see /metrics/requests/, or /metrics for all the workers). Requests slower than SLOW_REQUEST_MS get a trace of where the time
+# went logged. Only sqlite and requests that go through metrics.connect() and metrics.http count
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get("SLOW_REQUEST_MS", 1000))
+# Where the workers keep the numbers for /metrics, so any of them can add all of them up.
+# gunicorn.conf.py makes a new one every time the server starts
+app.config['METRICS_DIR'] = os.environ.get("METRICS_DIR")
+app.metrics_registry = prometheus.Registry(app.config['METRICS_DIR'])
+app.request_metrics = metrics.RequestMetrics(app.logger, slow_ms=app.config['SLOW_REQUEST_MS'],
+    registry=app.metrics_registry)
+
+# CPU, memory, temperature, etc. every HOST_METRICS_INTERVAL_SEC, for the last HOST_METRICS_HOURS (see
+# /metrics/host/). Every worker runs a sampler, but only one of them at a time actually samples
+app.config['HOST_METRICS_FILE'] = os.environ.get("HOST_METRICS_FILE", host_metrics.DEFAULT_FILE)
+app.config['HOST_METRICS_INTERVAL_SEC'] = float(os.environ.get("HOST_METRICS_INTERVAL_SEC", 5))
+app.config['HOST_METRICS_HOURS'] = float(os.environ.get("HOST_METRICS_HOURS", 24))
+app.host_sampler = host_metrics.HostSampler(app.config['HOST_METRICS_FILE'],
+    interval=app.config['HOST_METRICS_INTERVAL_SEC'],
+    hours=app.config['HOST_METRICS_HOURS'],
+    logger=app.logger,
+)
+app.host_sampler.start()
+
+# Where the log pages get their live streams from. If log_streamer is running (log-streamer.service),
+# set this to wherever it's reachable, otherwise the streams are served by this app
+app.config['LOG_STREAM_URL'] = os.environ.get("LOG_STREAM_URL")
+
+# How far to spread out reminders that would otherwise all go off in the same second (see
+# Reminder.snap_jitter_sec). 0 turns it off
+app.config['REMINDER_SNAP_JITTER_SEC'] = float(os.environ.get("REMINDER_SNAP_JITTER_SEC", 600))
 
 
 with app.app_context():
     @app.before_request
     def log_request_info():
         """ Log all requests """
-        app.logger.debug("Request: %s %s", request.method, request.url)
+        g.start_time = perf_counter()
+        g.metrics_token = app.request_metrics.start()
+        if access_log is None:
+            app.logger.debug("Request: %s %s", request.method, request.url,
+                extra={"method": request.method, "path": request.path})
 
     @app.after_request
     def log_response(response):
-        app.logger.debug("Response: %s %s -> %s", request.method, request.url, response.status)
+        # The extra fields only show up in the JSON log format
+        extra = {"method": request.method, "path": request.path, "status": response.status_code}
+        if 'start_time' in g:
+            extra["duration_ms"] = round((perf_counter() - g.start_time) * 1000, 2)
+        route = request.url_rule.rule if request.url_rule else "<no route>"
+        if 'metrics_token' in g:
+            timings = app.request_metrics.finish(g.pop('metrics_token'), request.method, route, response.status_code)
+            extra["db_ms"] = round(timings.ms["db"], 2)
+            extra["http_ms"] = round(timings.ms["http"], 2)
+
+        if access_log is None:
+            level = logging.DEBUG
+        else:
+            duration_ms = extra.get("duration_ms", 0)
+            access_log.record(request.method, route, response.status_code, response.content_length, duration_ms)
+            level = access_log.level(response.status_code, duration_ms)
+
+        if level is not None:
+            app.logger.log(level, "Response: %s %s -> %s", request.method, request.url, response.status, extra=extra)
         return response
 
     @app.errorhandler(Exception)
@@ -62,8 +140,9 @@ with app.app_context():
         return render_template('error.html', error=e), 404
 
 
-    # from rock_server.projects.irregular_reminders.main_server import bp as reminders_bp
-    # app.register_blueprint(reminders_bp, url_prefix="/irregular-reminders")
+    # The reminders runner tells us which reminders went off through this (see MAIN_SERVER_URL there)
+    from rock_server.projects.irregular_reminders.main_server import bp as reminders_bp
+    app.register_blueprint(reminders_bp, url_prefix="/irregular-reminders")
 
     from rock_server.projects.customized_form import bp as customized_form_bp
     app.register_blueprint(customized_form_bp, url_prefix="/customized-form")
@@ -0,0 +1,214 @@
+"""
+A history of how the pi is doing (CPU, load, memory, each worker's RSS, disk I/O, SoC temperature, open
+file descriptors), every few seconds, so slowdowns can be lined up with what the pi was going through.
+
+Only one process on the host samples at a time: every gunicorn worker runs a HostSampler thread, but
+only the one that holds the flock on <file>.lock takes samples. The rest keep trying, so if that worker
+goes away, another one takes over. Samples go into a fixed-size ring buffer in an mmap'd file (in
+/dev/shm, if there is one), so every worker can read the history, and it survives the server
+restarting (but not the pi rebooting).
+"""
+import fcntl
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from time import time
+
+import psutil
+
+# Where the ring buffer lives. There's a .lock next to it
+DEFAULT_FILE = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "rock-server-host-metrics")
+INTERVAL_SEC = 5
+HISTORY_HOURS = 24
+# How many workers get their own RSS column. The rest get left out
+MAX_WORKERS = 8
+
+# What's in each sample, in order. They're all stored as doubles, with NaN for "couldn't tell"
+FIELDS = (
+    "ts",
+    "cpu_percent",
+    "load1", "load5", "load15",
+    "mem_percent", "mem_available",
+    "swap_percent",
+    "disk_read_per_sec", "disk_write_per_sec",
+    "soc_temp_c",
+    "open_fds",
+    *(f"worker_rss_{i}" for i in range(MAX_WORKERS)),
+)
+
+# magic, how many fields, how many samples it holds, the interval, and how many samples have ever been written
+_HEADER = struct.Struct('<8sIIdQ')
+_MAGIC = b"rockhm1\0"
+_SAMPLE = struct.Struct(f'<{len(FIELDS)}d')
+
+
+class RingBuffer:
+    """ The last capacity samples, in a file any process can open """
+    def __init__(self, path=DEFAULT_FILE, capacity=HISTORY_HOURS * 3600 // INTERVAL_SEC, interval=INTERVAL_SEC):
+        self.path = path
+        size = _HEADER.size + capacity * _SAMPLE.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Start over if it's not one of ours, or it was made with different settings
+            header = os.pread(fd, _HEADER.size, 0)
+            if len(header) < _HEADER.size or _HEADER.unpack(header)[:4] != (_MAGIC, len(FIELDS), capacity, float(interval)):
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, _HEADER.pack(_MAGIC, len(FIELDS), capacity, interval, 0), 0)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.capacity = capacity
+        self.interval = interval
+
+    @property
+    def written(self):
+        return _HEADER.unpack_from(self.map, 0)[4]
+
+    def append(self, sample):
+        """ Add a sample (a value for each of FIELDS). Only the sampler should call this """
+        written = self.written
+        _SAMPLE.pack_into(self.map, _HEADER.size + (written % self.capacity) * _SAMPLE.size, *sample)
+        # Readers only look at it once this says it's there
+        _HEADER.pack_into(self.map, 0, _MAGIC, len(FIELDS), self.capacity, self.interval, written + 1)
+
+    def read(self, since=None):
+        """ {"fields": FIELDS, "interval_sec": ..., field: [values, oldest first], ...} for the samples
+            since since (epoch seconds), or all of them. NaNs come back as None
+        """
+        written = self.written
+        # The oldest one might be getting overwritten right now, so it gets left out
+        count = min(written, self.capacity - 1)
+        columns = [[] for _ in FIELDS]
+        for n in range(written - count, written):
+            sample = _SAMPLE.unpack_from(self.map, _HEADER.size + (n % self.capacity) * _SAMPLE.size)
+            if since is not None and sample[0] < since:
+                continue
+            for column, value in zip(columns, sample):
+                column.append(None if math.isnan(value) else round(value, 2))
+        return {"fields": FIELDS, "interval_sec": self.interval, **dict(zip(FIELDS, columns))}
+
+
+def soc_temperature():
+    """ The SoC's temperature in C, or NaN if we can't tell """
+    try:
+        temperatures = psutil.sensors_temperatures()
+    except (AttributeError, OSError):
+        temperatures = {}
+    for name in ("soc_thermal", "cpu_thermal", "coretemp"):
+        if temperatures.get(name):
+            return temperatures[name][0].current
+    try:
+        with open("/sys/class/thermal/thermal_zone0/temp") as f:
+            return int(f.read()) / 1000
+    except (OSError, ValueError):
+        return math.nan
+
+def server_processes():
+    """ (the gunicorn master, or just us if there isn't one, [its workers]) """
+    me = psutil.Process()
+    try:
+        parent = me.parent()
+        if parent is not None and "gunicorn" in " ".join(parent.cmdline()):
+            return parent, sorted(parent.children(), key=lambda p: p.pid)
+    except psutil.Error:
+        pass
+    return me, [me]
+
+
+class HostSampler:
+    """ Takes a sample every interval seconds, if it can get the lock, and puts it in the ring buffer """
+    def __init__(self, path=DEFAULT_FILE, interval=INTERVAL_SEC, hours=HISTORY_HOURS, logger=None):
+        self.path = path
+        self.logger = logger
+        self.interval = interval
+        self.capacity = int(hours * 3600 // interval)
+        self.buffer = None
+        self.lock_file = None
+        self.last_disk = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def ring(self):
+        if self.buffer is None:
+            self.buffer = RingBuffer(self.path, self.capacity, self.interval)
+        return self.buffer
+
+    def elected(self):
+        """ Whether this is the process that takes samples (trying to become it, if nobody is) """
+        if self.lock_file is None:
+            self.lock_file = open(self.path + ".lock", "a")
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.lock_file.close()
+                self.lock_file = None
+                return False
+            # The first cpu_percent() is always 0
+            psutil.cpu_percent()
+        return True
+
+    def sample(self):
+        now = time()
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_io_counters()
+        read_per_sec = write_per_sec = math.nan
+        if disk is not None and self.last_disk is not None:
+            elapsed = now - self.last_disk[0]
+            read_per_sec = (disk.read_bytes - self.last_disk[1].read_bytes) / elapsed
+            write_per_sec = (disk.write_bytes - self.last_disk[1].write_bytes) / elapsed
+        self.last_disk = (now, disk) if disk is not None else None
+
+        master, workers = server_processes()
+        open_fds = 0
+        for process in {master, *workers}:
+            try:
+                open_fds += process.num_fds()
+            except psutil.Error:
+                pass
+        rss = []
+        for worker in workers[:MAX_WORKERS]:
+            try:
+                rss.append(worker.memory_info().rss)
+            except psutil.Error:
+                rss.append(math.nan)
+        rss += [math.nan] * (MAX_WORKERS - len(rss))
+
+        return (
+            now,
+            psutil.cpu_percent(),
+            *os.getloadavg(),
+            memory.percent, memory.available,
+            psutil.swap_memory().percent,
+            read_per_sec, write_per_sec,
+            soc_temperature(),
+            open_fds,
+            *rss,
+        )
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                if self.elected():
+                    self.ring().append(self.sample())
+            except Exception:
+                # Nothing here is worth taking a worker down for. Try again next time
+                if self.logger is not None:
+                    self.logger.exception("Failed to sample the host metrics")
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True, name="host sampler")
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
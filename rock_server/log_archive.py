@@ -0,0 +1,137 @@
+"""
+Compressed archives of old logs, so we can keep weeks of them without filling up the SD card.
+
+When app.log rotates, the old app.log.1 (which used to just get deleted) gets gzipped into the archive
+directory instead, as app.log.<when it was last written>.gz. Once the archives for a log add up to
+more than the limit, the oldest ones get deleted.
+system.log and the runner's log are written by systemd, so they don't rotate on their own. clear_logs.sh
+archives them (with this) before truncating them.
+
+The log pages and search read the archives by decompressing them as they go (see rock_server.utils).
+
+To archive some logs by hand:
+    python -m rock_server.log_archive system.log app.log
+"""
+import argparse
+import datetime as dt
+import glob
+import gzip
+import os
+import shutil
+import sys
+import traceback
+from logging.handlers import RotatingFileHandler
+
+# Where a log's archives go, relative to the log
+ARCHIVE_DIR = "log_archive"
+# The most all of one log's archives can add up to (compressed)
+ARCHIVE_MAX_BYTES = 50 * 1024 * 1024
+# Part of each archive's name
+TIME_FORMAT = "%Y%m%d-%H%M%S"
+# If a rotated log can't be archived, it gets kept next to the log, as app.log.unarchived-<when>, and
+# archived at the next rollover
+UNARCHIVED_SUFFIX = ".unarchived-"
+
+
+def archive_dir(log_file):
+    return os.path.join(os.path.dirname(os.path.abspath(log_file)), ARCHIVE_DIR)
+
+def archives(log_file):
+    """ [(path, datetime it ends at), ...] for all of log_file's archives, newest first """
+    directory = archive_dir(log_file)
+    prefix = os.path.basename(log_file) + "."
+    found = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name.endswith(".gz"):
+                # app.log.20250101-120000.gz, or app.log.20250101-120000-1.gz if there were two that second
+                rest = name[len(prefix):-len(".gz")]
+                try:
+                    ends = dt.datetime.strptime(rest[:15], TIME_FORMAT)
+                    found.append((int(rest[16:] or 0), os.path.join(directory, name), ends))
+                except ValueError:
+                    continue
+    # The -1s are newer than the ones without
+    return [(path, ends) for n, path, ends in sorted(found, key=lambda item: (item[2], item[0]), reverse=True)]
+
+def prune(log_file, max_bytes=ARCHIVE_MAX_BYTES):
+    """ Delete log_file's oldest archives, until they add up to max_bytes or less """
+    found = archives(log_file)
+    total = sum(os.path.getsize(path) for path, _ in found)
+    for path, _ in reversed(found):
+        if total <= max_bytes:
+            break
+        total -= os.path.getsize(path)
+        os.remove(path)
+
+def archive(path, log_file=None, max_bytes=ARCHIVE_MAX_BYTES):
+    """ Gzip the file at path into log_file's archives (log_file is path itself, unless path is
+        something like a rotated copy of it). Doesn't touch the original. Gives back the archive's path,
+        or None if there was nothing in it
+    """
+    log_file = log_file or path
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    directory = archive_dir(log_file)
+    os.makedirs(directory, exist_ok=True)
+
+    stamp = dt.datetime.fromtimestamp(os.path.getmtime(path)).strftime(TIME_FORMAT)
+    name = os.path.join(directory, f"{os.path.basename(log_file)}.{stamp}")
+    dest, n = f"{name}.gz", 0
+    while os.path.exists(dest):
+        n += 1
+        dest = f"{name}-{n}.gz"
+
+    # Write it somewhere else first, so nothing reading the archives sees half of it
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    with open(path, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp, dest)
+    prune(log_file, max_bytes)
+    return dest
+
+
+class ArchivingRotatingFileHandler(RotatingFileHandler):
+    """ A RotatingFileHandler that archives the oldest backup, instead of deleting it """
+    def __init__(self, *args, archive_max_bytes=ARCHIVE_MAX_BYTES, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.archive_max_bytes = archive_max_bytes
+
+    def doRollover(self):
+        oldest = f"{self.baseFilename}.{self.backupCount}"
+        if self.backupCount > 0 and os.path.exists(oldest):
+            # Any that couldn't be archived before get another go too
+            for path in [oldest, *sorted(glob.glob(glob.escape(self.baseFilename) + UNARCHIVED_SUFFIX + "*"))]:
+                try:
+                    archive(path, self.baseFilename, self.archive_max_bytes)
+                    if path != oldest:
+                        os.remove(path)
+                except Exception:
+                    # Not rotating would be worse, so it still rotates, but the rotation would delete
+                    # the oldest one, so it gets moved out of the way first
+                    sys.stderr.write(f"--- Failed to archive {path} ---\n")
+                    traceback.print_exc(file=sys.stderr)
+                    if path == oldest:
+                        self._keep(oldest)
+        super().doRollover()
+
+    def _keep(self, path):
+        name = f"{self.baseFilename}{UNARCHIVED_SUFFIX}{dt.datetime.now().strftime(TIME_FORMAT)}"
+        kept, n = name, 0
+        while os.path.exists(kept):
+            n += 1
+            kept = f"{name}-{n}"
+        try:
+            os.replace(path, kept)
+            sys.stderr.write(f"Kept it as {kept}\n")
+        except OSError:
+            traceback.print_exc(file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--max-bytes", type=int, default=ARCHIVE_MAX_BYTES)
+    args = parser.parse_args()
+    for log in args.logs:
+        print(archive(log, max_bytes=args.max_bytes) or f"{log} is empty, nothing to archive")
@@ -0,0 +1,45 @@
+""" How app.log gets written. This doesn't touch Flask, so anything can use it """
+import json
+import logging
+
+# The human readable format, which is the default
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Things that get passed in extra= when logging a request, which end up as their own fields
+REQUEST_FIELDS = ('method', 'path', 'status', 'duration_ms', 'db_ms', 'http_ms')
+
+
+class JSONFormatter(logging.Formatter):
+    """ One JSON object per line, with the fields the log viewer needs already picked out, so it
+        doesn't have to parse the message:
+        {"ts": epoch seconds, "levelno": 20, "level": "INFO", "msg": "...",
+         "method": ..., "path": ..., "status": ..., "duration_ms": ..., "db_ms": ..., "http_ms": ...,
+         "exc": "traceback"}
+        The request fields are only there if they were passed as extra=, and exc only if there was
+        an exception. Tracebacks stay on the same line, instead of spilling over several.
+    """
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "levelno": record.levelno,
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        for field in REQUEST_FIELDS:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        # exc_text is already filled in if it came through a queue or the log writer
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+def make_formatter(log_format):
+    """ The formatter for a LOG_FORMAT setting ("text" or "json") """
+    if log_format == "json":
+        return JSONFormatter()
+    if log_format == "text":
+        return logging.Formatter(TEXT_FORMAT)
+    raise ValueError(f"Unknown log format: {log_format}")
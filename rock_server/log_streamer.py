@@ -0,0 +1,168 @@
+"""
+A sidecar that serves the log streams (the /logs/.../stream/ endpoints) with asyncio instead of
+gunicorn, so open log tabs don't hold onto the main server's workers or threads. An idle stream here
+is just a coroutine waiting on a queue, so it can hold thousands of them.
+
+It uses the same LogTailer and format_line as the main server, so the streams look exactly the same.
+Each log file gets a single thread, which takes lines from the file's tailer and hands them to every
+connected client on the event loop. Clients that fall behind lose their oldest lines, same as before.
+
+Run it from the repo root (log-streamer.service does this):
+    python -m rock_server.log_streamer --port 5051
+and set LOG_STREAM_URL for the main server to wherever it's reachable, so the log pages use it.
+"""
+import argparse
+import asyncio
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+from flask import Flask
+
+# utils needs an app context to import, but doesn't need the real app
+with Flask("rock_server").app_context():
+    from rock_server.utils import (get_log_tailer, format_event, parse_event_id, read_missed_lines,
+        LOG_STREAM_QUEUE_SIZE, LOG_STREAM_KEEPALIVE_SEC)
+
+# {path: (log_file, is_system)}. The same streams system_endpoints and the reminders blueprint make,
+# at the same paths. The log pages only send people here for the ones that are in this
+STREAMS = {
+    "/logs/stream/": ("app.log", False),
+    "/logs/system/stream/": ("system.log", True),
+    "/irregular-reminders/logs/stream/": ("rock_server/projects/irregular_reminders/reminders_runner/reminder_runner.log", True),
+}
+
+# How long a client gets to send its request before we hang up
+REQUEST_TIMEOUT_SEC = 10
+
+
+class Fanout:
+    """ Moves lines from a log file's LogTailer onto the event loop, and out to every client """
+    def __init__(self, loop, log_file):
+        self.loop = loop
+        self.log_file = log_file
+        self.clients = set()
+        self.thread = None
+
+    def subscribe(self):
+        q = asyncio.Queue(LOG_STREAM_QUEUE_SIZE)
+        self.clients.add(q)
+        if self.thread is None:
+            # Subscribe now, so nothing written after this returns gets missed
+            lines = get_log_tailer(self.log_file).subscribe()
+            self.thread = threading.Thread(target=self._pump, args=(lines,), daemon=True, name=f"fanout {self.log_file}")
+            self.thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        self.clients.discard(q)
+
+    def _pump(self, lines):
+        while True:
+            self.loop.call_soon_threadsafe(self._broadcast, lines.get())
+
+    def _broadcast(self, item):
+        for q in self.clients:
+            if q.full():
+                # They're too slow, drop their oldest line to make room
+                q.get_nowait()
+            q.put_nowait(item)
+
+
+class LogStreamer:
+    """ A tiny HTTP server that only does SSE log streams """
+    def __init__(self, streams=STREAMS):
+        self.streams = streams
+        self.fanouts = {}
+
+    def fanout(self, log_file):
+        if log_file not in self.fanouts:
+            self.fanouts[log_file] = Fanout(asyncio.get_running_loop(), log_file)
+        return self.fanouts[log_file]
+
+    async def read_request(self, reader):
+        """ (method, path, {query arg: value}, {header: value}) """
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while (line := (await reader.readline()).decode('latin-1').strip()):
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        return method, url.path, {k: v[0] for k, v in parse_qs(url.query).items()}, headers
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                method, path, args, headers = await asyncio.wait_for(self.read_request(reader), REQUEST_TIMEOUT_SEC)
+            except (ValueError, asyncio.TimeoutError):
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            if method != 'GET' or path not in self.streams:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            log_file, is_system = self.streams[path]
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/event-stream\r\n"
+                b"Cache-Control: no-cache\r\n"
+                # The log pages are served by the main server, on a different port
+                b"Access-Control-Allow-Origin: *\r\n"
+                b"Connection: close\r\n"
+                b"\r\n"
+                b": connected\n\n"
+            )
+            await writer.drain()
+
+            # Same as the main server's stream_logs
+            last_event_id = parse_event_id(headers.get('last-event-id') or args.get('last_event_id'))
+            as_json = args.get('format') == 'json'
+            fanout = self.fanout(log_file)
+            # Subscribe before catching up, so nothing falls in between
+            lines = fanout.subscribe()
+            try:
+                caught_up = None
+                if last_event_id:
+                    # It's a bounded amount of reading, but it's still blocking
+                    missed = await asyncio.get_running_loop().run_in_executor(None, list, read_missed_lines(log_file, last_event_id))
+                    if missed:
+                        caught_up = missed[-1][:2]
+                        writer.write("".join(format_event(*event, is_system, as_json) for event in missed).encode())
+                        await writer.drain()
+                while True:
+                    try:
+                        batch = [await asyncio.wait_for(lines.get(), LOG_STREAM_KEEPALIVE_SEC)]
+                    except asyncio.TimeoutError:
+                        # If they've gone away, this is what notices
+                        writer.write(b": keepalive\n\n")
+                        await writer.drain()
+                        continue
+                    # Send everything that's piled up in one write
+                    while not lines.empty():
+                        batch.append(lines.get_nowait())
+                    if caught_up:
+                        # Already sent these while catching up
+                        batch = [event for event in batch if event[0] != caught_up[0] or event[1] > caught_up[1]]
+                    writer.write("".join(format_event(*event, is_system, as_json) for event in batch).encode())
+                    await writer.drain()
+            finally:
+                fanout.unsubscribe(lines)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, started=None):
+        """ Serve forever. If started is given, it gets called with the server once it's listening """
+        server = await asyncio.start_server(self.handle, host, port)
+        if started is not None:
+            started(server)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5051)
+    args = parser.parse_args()
+    asyncio.run(LogStreamer().serve(args.host, args.port))
@@ -0,0 +1,153 @@
+"""
+The only thing that writes to app.log. Every gunicorn worker sends its log records here over a unix
+socket, and this writes them with a single rotating file handler (which archives the old ones, see
+rock_server.log_archive), so the workers don't fight over rotating the file, and none of them have to
+wait on the disk while they're handling a request.
+
+In the workers, logging goes: logger -> QueueHandler -> (a background thread) -> LogWriterHandler -> here
+If this isn't running (like with flask run), the workers' background threads write the file
+themselves instead.
+
+gunicorn.conf.py starts it before the workers, and stops it when gunicorn exits. To run it by hand:
+    python -m rock_server.log_writer --socket app.log.sock --log-file app.log
+"""
+import argparse
+import atexit
+import copy
+import logging
+import os
+import pickle
+import queue
+import signal
+import socketserver
+import struct
+import sys
+from logging.handlers import QueueHandler, QueueListener, SocketHandler
+
+from rock_server.log_archive import ArchivingRotatingFileHandler
+from rock_server.log_format import make_formatter
+
+# Same as app.log has always been
+MAX_BYTES = 1024 * 1024
+BACKUP_COUNT = 1
+
+
+class LogWriterHandler(SocketHandler):
+    """ Sends records to the log writer. If it can't be reached, the record gets handed to fallback
+        instead of being dropped (SocketHandler would just drop it)
+    """
+    def __init__(self, socket_path, fallback):
+        # No port means a unix socket
+        super().__init__(socket_path, None)
+        self.fallback = fallback
+
+    def emit(self, record):
+        try:
+            data = self.makePickle(record)
+            if self.sock is None:
+                self.createSocket()
+            if self.sock is not None:
+                self.send(data)
+            # send() closes the socket if it failed
+            if self.sock is None:
+                self.fallback.handle(record)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        super().close()
+        self.fallback.close()
+
+
+class _QueueHandler(QueueHandler):
+    """ QueueHandler bakes the traceback into the message, which would lose JSONFormatter's exc field.
+        This keeps it separate, as exc_text, which every formatter knows what to do with
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _QueueListener(QueueListener):
+    def stop(self):
+        # It gets stopped at exit, and stopping one that's already stopped is an error
+        if self._thread is not None:
+            super().stop()
+
+
+def queue_logging(logger, log_file, log_format, socket_path=None):
+    """ Make logger send everything to the log writer at socket_path, through a queue and a background
+        thread, so logging never blocks. If the log writer isn't running, the thread writes log_file
+        itself. Gives back the QueueListener (which gets stopped at exit)
+    """
+    file_handler = ArchivingRotatingFileHandler(log_file, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, delay=True)
+    file_handler.setFormatter(make_formatter(log_format))
+    if socket_path and os.path.exists(socket_path):
+        handler = LogWriterHandler(socket_path, file_handler)
+    else:
+        handler = file_handler
+
+    records = queue.SimpleQueue()
+    logger.addHandler(_QueueHandler(records))
+    listener = _QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class _RecordHandler(socketserver.StreamRequestHandler):
+    """ Reads the length-prefixed pickled records SocketHandler sends """
+    def handle(self):
+        while True:
+            size = self.rfile.read(4)
+            if len(size) < 4:
+                return
+            data = self.rfile.read(struct.unpack('>L', size)[0])
+            self.server.file_handler.handle(logging.makeLogRecord(pickle.loads(data)))
+
+
+class LogWriterServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, file_handler):
+        # It's left behind if we didn't get to clean up last time
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        # Handlers have their own lock, so all the connection threads can share one
+        self.file_handler = file_handler
+        super().__init__(socket_path, _RecordHandler)
+        # Only we get to send it things (it unpickles what it gets)
+        os.chmod(socket_path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        self.file_handler.close()
+
+
+def make_server(socket_path, log_file, log_format="text", max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+    file_handler = ArchivingRotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(make_formatter(log_format))
+    return LogWriterServer(socket_path, file_handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default="app.log.sock")
+    parser.add_argument("--log-file", default="app.log")
+    parser.add_argument("--format", default=os.environ.get("LOG_FORMAT", "text"), choices=["text", "json"])
+    args = parser.parse_args()
+
+    server = make_server(args.socket, args.log_file, args.format)
+    # systemd and gunicorn stop us with SIGTERM
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
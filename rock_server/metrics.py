@@ -0,0 +1,263 @@
+""" Per-request timings: how long each request took in total, how much of that was spent in sqlite, and
+how much was spent waiting on other servers. Each endpoint gets
+rolling histograms of all three, and requests slower than slow_ms get a trace of where the time went
+logged.
+
+Only the app's own sqlite connections (made with connect()) and requests (made through http) get
+timed, and they report to whatever request is currently being handled. The histograms here are per
+process, so with gunicorn every worker has its own. Given a rock_server.prometheus registry, it
+counts everything there too, which adds up across workers.
+"""
+import contextvars
+import sqlite3
+import threading
+from bisect import bisect_left
+from time import perf_counter, time
+
+import requests
+
+# Upper bounds of the histogram buckets, in ms. Anything slower goes in the last one
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+# What the buckets are called in snapshots (JSON doesn't have infinity)
+BUCKET_NAMES = tuple("+Inf" if bound == float('inf') else bound for bound in BUCKETS_MS)
+# The histograms cover the last WINDOW_SEC, in SLOTS pieces, so old requests fall off a slot at a time
+WINDOW_SEC = 60 * 60
+SLOTS = 60
+# The most spans one request's trace keeps, so a request that does thousands of queries doesn't
+# keep thousands of them around
+MAX_SPANS = 50
+# What gets timed
+KINDS = ("wall", "db", "http")
+
+# The timings of the request that's being handled on this thread, if there is one
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """ Everything that's been timed so far during one request """
+    def __init__(self):
+        self.start = perf_counter()
+        self.ms = {"db": 0., "http": 0.}
+        self.counts = {"db": 0, "http": 0}
+        # [(kind, what, ms), ...], in the order they happened
+        self.spans = []
+
+    def add(self, kind, what, ms):
+        self.ms[kind] += ms
+        self.counts[kind] += 1
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append((kind, what, ms))
+
+
+def _timed(kind, what, func, *args, **kwargs):
+    """ Call func, and add how long it took to the current request (if there is one) """
+    timings = _current.get()
+    if timings is None:
+        return func(*args, **kwargs)
+    start = perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings.add(kind, what, (perf_counter() - start) * 1000)
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        return _timed("db", sql, super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return _timed("db", sql, super().executemany, sql, *args)
+
+    def executescript(self, sql):
+        return _timed("db", sql, super().executescript, sql)
+
+    # Most of the work for a SELECT happens while fetching
+    def fetchone(self):
+        return _timed("db", "fetchone", super().fetchone)
+
+    def fetchmany(self, *args):
+        return _timed("db", "fetchmany", super().fetchmany, *args)
+
+    def fetchall(self):
+        return _timed("db", "fetchall", super().fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """ A sqlite3 connection whose queries (including con.execute()) count towards the current request """
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # The built in ones make a plain Cursor without going through cursor()
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def executescript(self, sql):
+        return self.cursor().executescript(sql)
+
+    def commit(self):
+        return _timed("db", "commit", super().commit)
+
+
+def connect(*args, **kwargs):
+    """ sqlite3.connect(), but the connection's queries count towards the current request """
+    kwargs.setdefault("factory", TimedConnection)
+    return sqlite3.connect(*args, **kwargs)
+
+
+class TimedSession(requests.Session):
+    """ A requests session whose requests count towards the current request """
+    def send(self, request, **kwargs):
+        return _timed("http", f"{request.method} {request.url}", super().send, request, **kwargs)
+
+
+class TimedRequests:
+    """ requests.get() and friends, timed. Use it as http.get(...) instead of requests.get(...) """
+    def request(self, method, url, **kwargs):
+        # Same as requests.request(), a session of its own every time, so it's safe from any thread
+        with TimedSession() as session:
+            return session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+http = TimedRequests()
+
+
+class RollingHistogram:
+    """ Counts of values in BUCKETS_MS over the last window_sec, kept as slots small histograms, one for
+        each window_sec / slots seconds. Old slots get reused once they're out of the window
+    """
+    def __init__(self, window_sec=WINDOW_SEC, slots=SLOTS):
+        self.slot_sec = window_sec / slots
+        # [(which slot it is, counts, sum), ...]
+        self.slots = [(None, [0] * len(BUCKETS_MS), 0.) for _ in range(slots)]
+
+    def _slot(self, now):
+        n = int(now // self.slot_sec)
+        i = n % len(self.slots)
+        if self.slots[i][0] != n:
+            self.slots[i] = (n, [0] * len(BUCKETS_MS), 0.)
+        return i
+
+    def add(self, ms, now=None):
+        i = self._slot(time() if now is None else now)
+        n, counts, total = self.slots[i]
+        counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.slots[i] = (n, counts, total + ms)
+
+    def snapshot(self, now=None):
+        """ {"count", "sum_ms", "buckets": {upper bound: count}, "p50", "p90", "p99"} for the whole window.
+            The percentiles are the upper bound of the bucket they fall in
+        """
+        oldest = int((time() if now is None else now) // self.slot_sec) - len(self.slots) + 1
+        counts = [0] * len(BUCKETS_MS)
+        total = 0.
+        for n, slot_counts, slot_total in self.slots:
+            if n is not None and n >= oldest:
+                counts = [a + b for a, b in zip(counts, slot_counts)]
+                total += slot_total
+        count = sum(counts)
+        snapshot = {
+            "count": count,
+            "sum_ms": round(total, 3),
+            "buckets": {str(name): c for name, c in zip(BUCKET_NAMES, counts)},
+        }
+        for name, q in (("p50", .5), ("p90", .9), ("p99", .99)):
+            snapshot[name] = None
+            seen = 0
+            for bucket, c in zip(BUCKET_NAMES, counts):
+                seen += c
+                if count and seen >= q * count:
+                    snapshot[name] = bucket
+                    break
+        return snapshot
+
+
+class RequestMetrics:
+    """ Timing for every request, by endpoint. Call start() when a request comes in, and finish() when
+        it's done (app.py does, in before_request and after_request)
+    """
+    def __init__(self, logger, slow_ms=1000, window_sec=WINDOW_SEC, registry=None):
+        """ If registry (a rock_server.prometheus.Registry) is given, everything gets counted there too,
+            so /metrics has it for all the workers
+        """
+        self.logger = logger
+        self.slow_ms = slow_ms
+        self.window_sec = window_sec
+        # {(method, route): {"wall": RollingHistogram, "db": ..., "http": ...}}
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        self.registry = registry
+        if registry is not None:
+            self.requests_total = registry.counter("http_requests_total", "Requests handled", ("method", "route", "status"))
+            self.in_progress = registry.gauge("http_requests_in_progress", "Requests being handled right now")
+            self.seconds = {
+                "wall": registry.histogram("http_request_duration_seconds", "How long requests took", ("method", "route")),
+                "db": registry.histogram("http_request_db_seconds", "Time requests spent in sqlite", ("method", "route")),
+                "http": registry.histogram("http_request_outbound_seconds", "Time requests spent waiting on other servers", ("method", "route")),
+            }
+
+    def start(self):
+        """ Start timing a request. Gives back a token to pass to finish() """
+        if self.registry is not None:
+            self.in_progress.inc()
+        return _current.set(RequestTimings())
+
+    def finish(self, token, method, route, status):
+        """ Stop timing the request start() gave token for, and record it. Gives back its RequestTimings """
+        timings = _current.get()
+        _current.reset(token)
+        wall_ms = (perf_counter() - timings.start) * 1000
+        with self.lock:
+            histograms = self.endpoints.get((method, route))
+            if histograms is None:
+                histograms = self.endpoints[(method, route)] = {kind: RollingHistogram(self.window_sec) for kind in KINDS}
+            histograms["wall"].add(wall_ms)
+            histograms["db"].add(timings.ms["db"])
+            histograms["http"].add(timings.ms["http"])
+        if self.registry is not None:
+            self.in_progress.dec()
+            self.requests_total.labels(method, route, status).inc()
+            self.seconds["wall"].labels(method, route).observe(wall_ms / 1000)
+            self.seconds["db"].labels(method, route).observe(timings.ms["db"] / 1000)
+            self.seconds["http"].labels(method, route).observe(timings.ms["http"] / 1000)
+        if wall_ms >= self.slow_ms:
+            self.log_trace(method, route, status, wall_ms, timings)
+        return timings
+
+    def log_trace(self, method, route, status, wall_ms, timings):
+        """ Log where a slow request's time went """
+        other_ms = wall_ms - timings.ms["db"] - timings.ms["http"]
+        lines = [f"{kind:4} {ms:8.1f} ms  {what[:200]}" for kind, what, ms in timings.spans]
+        if timings.counts["db"] + timings.counts["http"] > len(timings.spans):
+            lines.append(f"... and {timings.counts['db'] + timings.counts['http'] - len(timings.spans)} more")
+        self.logger.warning(
+            "Slow request: %s %s -> %s took %.1f ms (db: %.1f ms in %d calls, http: %.1f ms in %d calls, other: %.1f ms)%s",
+            method, route, status, wall_ms,
+            timings.ms["db"], timings.counts["db"], timings.ms["http"], timings.counts["http"], other_ms,
+            "".join("\n    " + line for line in lines),
+        )
+
+    def snapshot(self):
+        """ {"METHOD route": {"wall": RollingHistogram.snapshot(), "db": ..., "http": ...}}, slowest first """
+        with self.lock:
+            endpoints = {
+                f"{method} {route}": {kind: histogram.snapshot() for kind, histogram in histograms.items()}
+                for (method, route), histograms in self.endpoints.items()
+            }
+        return dict(sorted(endpoints.items(), key=lambda item: -item[1]["wall"]["sum_ms"]))
@@ -5,6 +5,7 @@ copied verbatim between the server and client.
 from datetime import datetime, timedelta, time
 import sqlite3
 from enum import Enum
+from collections import Counter
 import random
 import enum
 from typing import Literal, ClassVar, Union
@@ -37,6 +38,20 @@ def pretty_timedelta(td: timedelta) -> str:
     """ Convert a timedelta to a human-readable string """
     return f"{td.days}d {td.seconds // 3600}h {(td.seconds // 60) % 60}m {td.seconds % 60}s"
 
+class FakeClock:
+    """ A stand-in for datetime.now() that only moves when it's told to """
+    def __init__(self, start: datetime):
+        self.time = start
+
+    def __call__(self, tz=None) -> datetime:
+        # Same as datetime.now(): naive local time without a timezone, aware with one
+        if tz is None:
+            return self.time if self.time.tzinfo is None else self.time.astimezone().replace(tzinfo=None)
+        return self.time.astimezone(tz)
+
+    def advance(self, delta: timedelta):
+        self.time += delta
+
 # TODO: add timezones
 class Reminder(BaseModel):
     """ A complex, non-standard reminder with many parameters
@@ -45,7 +60,7 @@ class Reminder(BaseModel):
         but I wantedt to do it by hand to learn SQLite better
     """
     # This is the code version of this class
-    __version__ = 4
+    __version__ = 7
 
     @enum.unique
     class Distribution(Enum):
@@ -97,6 +112,18 @@ class Reminder(BaseModel):
         Distribution.NORMAL: random.normalvariate,
         Distribution.EXPONENTIAL: random.expovariate,
     }
+    # Load leveling: samples that aren't allowed get snapped to exactly the next time that is (the
+    # start of the work hours, midnight on the next work day, min_time), so lots of reminders with the
+    # same settings go off in the same second. Once more than snap_bucket_limit samples have landed on
+    # the same minute, the rest get spread uniformly over the next snap_jitter_sec seconds (without
+    # going past work_hours_end or max_time). 0 disables it. The counts are per process.
+    # The main server sets this from REMINDER_SNAP_JITTER_SEC
+    snap_jitter_sec: ClassVar = 0
+    snap_bucket_limit: ClassVar = 10
+    snap_buckets: ClassVar = Counter()
+    # Where the current time comes from. Takes a timezone, like datetime.now(). Swap it out for a
+    # FakeClock to run the scheduling logic faster than real time (see simulate.py)
+    clock: ClassVar = datetime.now
 
     def __init__(self, *args, **kwargs):
         """
@@ -119,7 +146,7 @@ class Reminder(BaseModel):
         """
         super().__init__(*args, **kwargs)
         if self.alive is None:
-            self.alive = self.max_time is None or self.max_time > datetime.now(self.timezone)
+            self.alive = self.max_time is None or self.max_time > self.now()
 
         # If we're deserializing, then don't create a new one
         if self.next_trigger_time is None:
@@ -212,7 +239,7 @@ class Reminder(BaseModel):
             raise ValueError("title or message must be provided")
 
         # max_time must be in the future. If it's not, force dead
-        if self.max_time and self.max_time < datetime.now(self.max_time.tzinfo):
+        if self.max_time and self.max_time < type(self).clock(self.max_time.tzinfo):
             self.alive = False
 
         # Validate & cast dist_params
@@ -227,6 +254,10 @@ class Reminder(BaseModel):
     def timezone(self):
         return self.min_time.tzinfo
 
+    def now(self) -> datetime:
+        """ The current time in this reminder's timezone, according to Reminder.clock """
+        return type(self).clock(self.timezone)
+
     def serialize(self, full: bool = True):
         """ Serialize the reminder to a dictionary, whose values can be directly inserted into the database """
         # Need to be in this order:
@@ -292,25 +323,46 @@ class Reminder(BaseModel):
         """
         if not self.can_trigger():
             return False
-        self.last_trigger_time = datetime.now(self.timezone)
-        if not self.repeat:
-            self.alive = False
-        else:
-            self.next_trigger_time = self._sample_trigger_time()
+        self.record_trigger(self.now())
 
+        data = self.serialize()
         conn.execute(
             "UPDATE reminders SET last_trigger_time = ?, next_trigger_time = ?, alive = ? WHERE id = ?",
-            (self.last_trigger_time, self.next_trigger_time, self.alive, self.id)
+            (data['last_trigger_time'], data['next_trigger_time'], data['alive'], data['id'])
         )
         conn.commit()
         return True
 
+    def record_trigger(self, when: datetime):
+        """
+        Update the internal state to reflect that the reminder went off at the given time: one-shot
+        reminders die, and repeating ones get a new next_trigger_time.
+        Unlike _trigger(), this doesn't check the constraints or touch the db. It's for when the runner
+        tells us after the fact that it's already gone off.
+        """
+        self.last_trigger_time = when
+        # If there's no time left that it's allowed to go off again, it's done
+        if not self.repeat or self.next_allowed_time(when + (self.spacing_min or timedelta())) is None:
+            self.alive = False
+        else:
+            # From when it actually went off, not from now, since we might be hearing about it late
+            sample = self._sample_trigger_time(since=when)
+            # So late that the next time has already gone by, so go off as soon as it's allowed to
+            if sample < self.now():
+                sample = self.next_allowed_time()
+                if sample is not None:
+                    sample = self._level_load(sample)
+            if sample is None:
+                self.alive = False
+            else:
+                self.next_trigger_time = sample
+
     def can_trigger(self, now: datetime = None):
         if now is None:
-            now = datetime.now(self.timezone)
+            now = self.now()
         else:
             # If the given time is in the past, we can't trigger
-            if now < datetime.now(self.timezone):
+            if now < self.now():
                 return False
 
         # trigger_work_hours
@@ -347,7 +399,7 @@ class Reminder(BaseModel):
         Will not set self.alive.
         """
         if now is None:
-            now = datetime.now(self.timezone)
+            now = self.now()
         if self.can_trigger(now):
             return now
         else:
@@ -391,6 +443,7 @@ class Reminder(BaseModel):
                     (
                         self.repeat and
                         self.last_trigger_time and
+                        self.spacing_max and
                         next_time > self.spacing_max + self.last_trigger_time
                     )
             )):
@@ -398,12 +451,13 @@ class Reminder(BaseModel):
 
             return next_time
 
-    def _sample_trigger_time(self, adj:Literal['next', 'resample']='next') -> datetime:
+    def _sample_trigger_time(self, adj:Literal['next', 'resample']='next', since:datetime=None) -> datetime:
         """
         Generates the next time this reminder will go off
 
         adj: If we randomly select an invalid time, 'next' will adjust it to the next
             allowed time, 'resample' will keep resampling until it's valid
+        since: The time to sample from (now, by default)
 
         Note: if the parameters are particularly poorly chosen (i.e. the trigger window is very small,
             and the mean of a distribution is very close to or outside of the window),
@@ -412,26 +466,59 @@ class Reminder(BaseModel):
         This is private, because we make modifications to the reminder in here, which don't get
         updated in the db. This is only allowed in the constructor.
         """
+        if since is None:
+            since = self.now()
         sample = None
         while sample is None:
             # If sample is None, it means it's outside the bounds of the trigger window
             if adj == 'next':
-                sample = self.next_allowed_time(datetime.now(self.timezone) + timedelta(
-                    seconds=self.dist_map[self.dist](**self._interpret_dist_params())
+                sample = self.next_allowed_time(since + timedelta(
+                    seconds=self.dist_map[self.dist](**self._interpret_dist_params(since))
                 ))
             elif adj == 'resample':
-                sample = datetime.now(self.timezone) + timedelta(
-                    seconds=self.dist_map[self.dist](**self._interpret_dist_params())
+                sample = since + timedelta(
+                    seconds=self.dist_map[self.dist](**self._interpret_dist_params(since))
                 )
                 if not self.can_trigger(sample):
                     sample = None
             else:
                 raise ValueError(f"Invalid adj value: {adj}")
-        return sample
+        return self._level_load(sample)
 
-    def _interpret_dist_params(self) -> dict:
+    def _level_load(self, sample: datetime) -> datetime:
+        """ If the sample got snapped to the next allowed time, and that minute is already crowded,
+            move it to a random time a little later. See snap_jitter_sec.
+        """
+        # Everything it gets snapped to is on the minute, and a random sample basically never is
+        if not self.snap_jitter_sec or (sample.second, sample.microsecond) != (0, 0):
+            return sample
+
+        # These are only useful for upcoming minutes, so don't let them pile up forever
+        if len(self.snap_buckets) > 10_000:
+            self.snap_buckets.clear()
+        self.snap_buckets[sample] += 1
+        if self.snap_buckets[sample] <= self.snap_bucket_limit:
+            return sample
+
+        latest = sample + timedelta(seconds=self.snap_jitter_sec)
+        if self.work_hours_end:
+            latest = min(latest, sample.replace(
+                hour=self.work_hours_end.hour,
+                minute=self.work_hours_end.minute,
+                second=self.work_hours_end.second,
+            ))
+        if self.max_time:
+            latest = min(latest, self.max_time)
+        if self.repeat and self.last_trigger_time and self.spacing_max:
+            latest = min(latest, self.last_trigger_time + self.spacing_max)
+        if latest <= sample:
+            return sample
+        return sample + (latest - sample) * random.random()
+
+    def _interpret_dist_params(self, now:datetime=None) -> dict:
         """ Interprets the distribution parameters based on the distribution type, and returns a dictionary of parameters for the correct function """
-        now = datetime.now(self.timezone)
+        if now is None:
+            now = self.now()
         if self.dist == Reminder.Distribution.UNIFORM:
             return {
                 "a": (self.min_time - now).total_seconds(),
@@ -454,7 +541,7 @@ class Reminder(BaseModel):
 
         Because we modify the reminder, we need a db connection so we can update it automatically as well
         """
-        if (self.next_trigger_time - datetime.now(self.timezone)).total_seconds() <= self.allowed_resolution_sec:
+        if (self.next_trigger_time - self.now()).total_seconds() <= self.allowed_resolution_sec:
             return self._trigger(conn)
         return False
 
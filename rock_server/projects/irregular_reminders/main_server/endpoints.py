@@ -1,5 +1,8 @@
+import hmac
 import logging
-import sqlite3
+import os
+from datetime import datetime
+from functools import wraps
 from time import sleep, time
 import traceback
 from typing import Literal
@@ -15,6 +18,7 @@ from flask import (
 )
 from pydantic import BaseModel, ValidationError
 
+from rock_server import metrics
 from rock_server.utils import (
     format_line,
     format_logs,
@@ -27,6 +31,7 @@ from .utils import (
     clear_all_from_reminder_runner,
     delete_from_reminder_runner,
     format_pydantic_errors,
+    make_job_data,
     send_to_reminder_runner,
     update_reminder_runner,
 )
@@ -37,8 +42,14 @@ bp = Blueprint("non_standard_reminders", __name__)
 log = current_app.logger
 DB = current_app.config['DATABASE']
 OUR_LOGS = "rock_server/projects/irregular_reminders/reminders_runner/reminder_runner.log"
-
-with sqlite3.connect(DB) as con:
+# If this is set, the runner has to send it (as X-Runner-Secret) too. It needs the same RUNNER_SECRET
+RUNNER_SECRET = os.environ.get("RUNNER_SECRET")
+# The runner's on the same machine
+RUNNER_ADDRS = ("127.0.0.1", "::1")
+# Spread out the reminders that all get snapped to the same time (see Reminder.snap_jitter_sec)
+Reminder.snap_jitter_sec = current_app.config.get('REMINDER_SNAP_JITTER_SEC', Reminder.snap_jitter_sec)
+
+with metrics.connect(DB) as con:
     con.executescript("""BEGIN;
         CREATE TABLE IF NOT EXISTS jobs (
             id TEXT PRIMARY KEY,
@@ -75,6 +86,20 @@ with sqlite3.connect(DB) as con:
             FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE SET NULL, -- If the job goes off, we need to know
             FOREIGN KEY (device_id) REFERENCES devices(device_id) ON DELETE CASCADE -- If the device somehow gets deleted (which it isn't set to do), delete all associated reminders
         );
+        -- Push notifications waiting to be sent by the runner. The runner makes this too, see reminders_runner/app.py
+        CREATE TABLE IF NOT EXISTS push_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id,
+            title,
+            message,
+            state TEXT NOT NULL DEFAULT 'pending', -- pending, sending, sent, or failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at,
+            next_attempt_at,
+            sent_at,
+            error
+        );
+        CREATE INDEX IF NOT EXISTS push_outbox_state ON push_outbox (state, next_attempt_at);
     END;""")
 
 VERSION = 1
@@ -86,6 +111,8 @@ ENDPOINTS = {
     'clearReminders':   f"/{API_VERSION}/reminders/<device_id>",
     'updateReminder':   f"/{API_VERSION}/reminders/<device_id>/<id>",
     'register':         f"/{API_VERSION}/devices/<device_id>",
+    # Only used by the reminders_runner process
+    'remindersFired':   f"/{API_VERSION}/runner/fired",
 }
 
 class RegisterDeviceValidator(BaseModel):
@@ -104,7 +131,7 @@ class RegisterDeviceValidator(BaseModel):
 }}))
 def register_device(data, device_id: str):
     """ Register is a misnomer: it registers first, every time after that it's an update """
-    with sqlite3.connect(DB) as con:
+    with metrics.connect(DB) as con:
         con.execute(
             # If it's already registered, update the token
             "INSERT OR REPLACE INTO devices (device_id, token, platform, app_version, last_updated) VALUES (?, ?, ?, ?, ?)",
@@ -133,7 +160,7 @@ def schedule_reminder(device_id: str):
     reminder = send_to_reminder_runner(reminder)
     log.debug("Reminder sent to runner: %s", reminder)
 
-    with sqlite3.connect(DB) as con:
+    with metrics.connect(DB) as con:
         reminder.load_to_db(con)
     log.debug("Reminder added to db: %s", reminder)
 
@@ -145,7 +172,7 @@ def update_reminder(device_id: str, id):
     if len(request.json) == 0:
         return 201
 
-    with sqlite3.connect(DB) as con:
+    with metrics.connect(DB) as con:
         # I don't see a reason this shouldn't work?
         try:
             reminder = Reminder.load_from_db(con, id)
@@ -182,7 +209,7 @@ def update_reminder(device_id: str, id):
 def delete_reminder(device_id: str, id: str):
     """ Delete a reminder from the db """
     # We need the reminder instance to delete it from the runner process, because it needs the job_id FK
-    with sqlite3.connect(DB) as con:
+    with metrics.connect(DB) as con:
         try:
             delete_from_reminder_runner(Reminder.load_from_db(con, id))
         except ValueError:
@@ -207,7 +234,7 @@ def get_reminders(device_id: str):
     # Remove device_id from the result
     # Darn sqlite3 doesn't support EXCLUDE
     # return con.execute("SELECT * EXCLUDE (device_id) FROM reminders WHERE device_id = ?", (device_id,)).fetchall()
-    with sqlite3.connect(DB) as con:
+    with metrics.connect(DB) as con:
         # cols = [row[1] for row in con.execute("PRAGMA table_info(reminders)") if row[1] != "device_id"]
         # All deserializing does is basically adds dictionary keys to a tuple
         data = [Reminder.from_db(row).serialize(False) for row in con.execute("SELECT * FROM reminders WHERE device_id = ?", (device_id,)).fetchall()]
@@ -223,7 +250,7 @@ def clear_reminders(device_id: str):
     else:
         just_inactive = False
 
-    with sqlite3.connect(DB) as con:
+    with metrics.connect(DB) as con:
         try:
             clear_all_from_reminder_runner(device_id, con, just_inactive)
         except ValueError:
@@ -243,6 +270,57 @@ def clear_reminders(device_id: str):
     return {"status": "ok"}, 200
 
 
+class FiredReminderValidator(BaseModel):
+    id: str
+    # Epoch seconds
+    time: float
+
+class RemindersFiredValidator(BaseModel):
+    fired: list[FiredReminderValidator] = []
+
+def runner_only(f):
+    """ For the endpoints only the reminders runner is supposed to use. Everything else gets a 403 """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.remote_addr not in RUNNER_ADDRS or (RUNNER_SECRET and
+                not hmac.compare_digest(request.headers.get('X-Runner-Secret', ''), RUNNER_SECRET)):
+            log.warning("%s tried to use %s, which only the reminders runner can", request.remote_addr, request.path)
+            return {"error": "Only the reminders runner can do that"}, 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+@bp.post(ENDPOINTS["remindersFired"])
+@runner_only
+@validate_json(RemindersFiredValidator)
+def reminders_fired(data):
+    """ The runner batches up the reminders it's fired, and lets us know about them all at once.
+        Repeating reminders get a new next_trigger_time, one-shot ones die, and it's all written in
+        a single UPDATE. The jobs that need to be scheduled again get sent back to the runner.
+    """
+    fired = sorted(data.fired, key=lambda f: f.time)
+    reminders = {}
+    with metrics.connect(DB) as con:
+        for entry in fired:
+            id = entry.id
+            try:
+                reminder = reminders.get(id) or Reminder.load_from_db(con, id)
+            except ValueError:
+                # It got deleted while the notification was on its way out
+                log.warning("Runner fired reminder %s, but it doesn't exist anymore", id)
+                continue
+            reminder.record_trigger(datetime.fromtimestamp(entry.time, reminder.timezone))
+            reminders[id] = reminder
+
+        rows = [reminder.serialize() for reminder in reminders.values()]
+        con.executemany(
+            "UPDATE reminders SET last_trigger_time = ?, next_trigger_time = ?, alive = ? WHERE id = ?",
+            [(row['last_trigger_time'], row['next_trigger_time'], row['alive'], row['id']) for row in rows]
+        )
+
+    jobs = [make_job_data(reminder) for reminder in reminders.values() if reminder.alive]
+    log.info("Runner fired %s reminders, rescheduling %s of them", len(reminders), len(jobs))
+    return {"jobs": jobs}, 200
+
 
 
 # Logs
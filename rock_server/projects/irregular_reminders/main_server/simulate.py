@@ -0,0 +1,129 @@
+"""
+Replays the scheduling logic for a lot of synthetic reminders against a fake clock, so changes to
+Reminder (or the way it's scheduled) can be benchmarked without waiting around in real time.
+
+The runner's APScheduler is replaced by a heap of next_trigger_times. Every time a reminder comes up,
+the clock jumps to it, the reminder gets fired the same way the runner's feedback does it
+(Reminder.record_trigger), and it's pushed back on the heap if it's still alive.
+Firing costs real CPU time, and the fake clock is moved forward by that much, like it would be on
+a single scheduler thread. So if lots of reminders come due at once, the later ones show up as drift.
+
+Run it from this directory:
+    python simulate.py --reminders 100000 --days 14
+"""
+import argparse
+import heapq
+import json
+import random
+import uuid
+from collections import Counter
+from datetime import datetime, time, timedelta
+from time import perf_counter, process_time
+
+from Reminder import FakeClock, Reminder
+
+
+def synthetic_reminder(now: datetime) -> Reminder:
+    """ A random, but plausible, reminder """
+    kind = random.random()
+    common = {
+        "id": uuid.uuid4(),
+        "version": 1,
+        "device_id": f"sim-{random.randrange(10_000)}",
+        "title": "Simulated",
+        "message": "Simulated reminder",
+        "min_time": now,
+    }
+    if random.random() < .5:
+        common |= {"work_hours_start": time(9), "work_hours_end": time(17)}
+    if random.random() < .3:
+        common["work_days"] = [True] * 5 + [False] * 2
+
+    if kind < .4:
+        # One-shot, sometime in the next couple weeks. The window has to be wide enough to always
+        # contain some work hours, or sampling never finishes
+        return Reminder(**common, dist="uniform", max_time=now + timedelta(days=random.uniform(4, 14)))
+    elif kind < .7:
+        mean = timedelta(hours=random.uniform(6, 48))
+        return Reminder(**common, dist="exponential", dist_params={"mean": mean}, repeat=True,
+            spacing_min=timedelta(hours=random.uniform(6, 24)))
+    else:
+        mean = timedelta(hours=random.uniform(6, 48))
+        return Reminder(**common, dist="normal", dist_params={"mean": mean, "std": mean / 4}, repeat=True,
+            spacing_min=timedelta(hours=random.uniform(6, 24)))
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+def simulate(count: int, days: float, seed=None) -> dict:
+    """ Simulate count reminders for the given number of days, and return the stats """
+    random.seed(seed)
+    start = datetime.now().replace(microsecond=0)
+    clock = FakeClock(start)
+    Reminder.clock = clock
+
+    try:
+        setup_started = perf_counter()
+        reminders = [synthetic_reminder(start) for _ in range(count)]
+        setup_sec = perf_counter() - setup_started
+
+        heap = [(r.next_trigger_time, i) for i, r in enumerate(reminders) if r.alive]
+        heapq.heapify(heap)
+        end = start + timedelta(days=days)
+
+        drifts = []
+        per_second = Counter()
+        cpu = 0.
+        wall_started = perf_counter()
+        while heap and heap[0][0] < end:
+            scheduled, i = heapq.heappop(heap)
+            # We can't go off before we're scheduled, and we can't go back in time either
+            if scheduled > clock.time:
+                clock.time = scheduled
+            drifts.append((clock.time - scheduled).total_seconds())
+            per_second[clock.time.replace(microsecond=0)] += 1
+
+            reminder = reminders[i]
+            cpu_started = process_time()
+            reminder.record_trigger(clock())
+            spent = process_time() - cpu_started
+            cpu += spent
+            clock.advance(timedelta(seconds=spent))
+
+            if reminder.alive:
+                heapq.heappush(heap, (reminder.next_trigger_time, i))
+        wall_sec = perf_counter() - wall_started
+    finally:
+        Reminder.clock = datetime.now
+
+    drifts.sort()
+    fires = len(drifts)
+    return {
+        "reminders": count,
+        "simulated_days": days,
+        "fires": fires,
+        "setup_sec": round(setup_sec, 3),
+        "wall_sec": round(wall_sec, 3),
+        "cpu_per_fire_us": round(cpu / fires * 1e6, 2) if fires else None,
+        "drift_sec": {
+            "p50": percentile(drifts, .50),
+            "p95": percentile(drifts, .95),
+            "p99": percentile(drifts, .99),
+            "max": drifts[-1] if drifts else 0,
+        },
+        "peak_fires_per_sec": max(per_second.values(), default=0),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reminders", type=int, default=100_000)
+    parser.add_argument("--days", type=float, default=14)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--snap-jitter", type=float, default=0, help="Sets Reminder.snap_jitter_sec")
+    args = parser.parse_args()
+
+    Reminder.snap_jitter_sec = args.snap_jitter
+    print(json.dumps(simulate(args.reminders, args.days, args.seed), indent=2))
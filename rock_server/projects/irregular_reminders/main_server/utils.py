@@ -4,7 +4,7 @@ Functions that aren't endpoints
 
 from datetime import datetime
 from sqlite3 import Connection
-import requests
+from rock_server import metrics
 from flask import current_app
 from .Reminder import Reminder
 
@@ -48,29 +48,35 @@ def format_pydantic_errors(err):
 # https://viniciuschiele.github.io/flask-apscheduler/rst/api.html for details
 def pause_job(job_id: str):
     try:
-        requests.post(f"{RUNNER_URL}/scheduler/jobs/{job_id}/pause", timeout=5).raise_for_status()
+        metrics.http.post(f"{RUNNER_URL}/scheduler/jobs/{job_id}/pause", timeout=5).raise_for_status()
         log.debug("Paused dead reminder with id %s", job_id)
     except Exception as e:
         log.error("Failed to pause reminder with id %s: %s", job_id, e)
 
 def resume_job(job_id: str):
     try:
-        requests.post(f"{RUNNER_URL}/scheduler/jobs/{job_id}/resume", timeout=5).raise_for_status()
+        metrics.http.post(f"{RUNNER_URL}/scheduler/jobs/{job_id}/resume", timeout=5).raise_for_status()
         log.debug("Resumed dead reminder with id %s", job_id)
     except Exception as e:
         log.error("Failed to resume reminder with id %s: %s", job_id, e)
 
-def send_to_reminder_runner(reminder:Reminder):
-    """ Send a reminder to be scheduled with the reminders_runner process """
-    job_data = {
+def make_job_data(reminder:Reminder):
+    """ The job definition the reminders_runner process needs to schedule a reminder """
+    return {
         "id": f"notify-{reminder.id}",
         "func": "app:send_push_notification",
         "args": [reminder.device_id, reminder.title, reminder.message],
+        # So the runner can tell us which reminder went off
+        "kwargs": {"reminder_id": str(reminder.id)},
         "trigger": "date",
         "run_date": reminder.next_trigger_time.isoformat()
     }
+
+def send_to_reminder_runner(reminder:Reminder):
+    """ Send a reminder to be scheduled with the reminders_runner process """
+    job_data = make_job_data(reminder)
     try:
-        resp = requests.post(f"{RUNNER_URL}/scheduler/jobs", json=job_data, timeout=5)
+        resp = metrics.http.post(f"{RUNNER_URL}/scheduler/jobs", json=job_data, timeout=5)
         resp.raise_for_status()
         resp_json = resp.json()
         reminder.job_id = resp_json['id']
@@ -87,15 +93,10 @@ def send_to_reminder_runner(reminder:Reminder):
 
 def update_reminder_runner(reminder:Reminder):
     """ Update a reminder in the reminders_runner process """
-    job_data = {
-        # "id": f"notify-{reminder.id}",
-        "func": "app:send_push_notification",
-        "args": [reminder.device_id, reminder.title, reminder.message],
-        "trigger": "date",
-        "run_date": reminder.next_trigger_time.isoformat()
-    }
+    job_data = make_job_data(reminder)
+    del job_data['id']
     try:
-        resp = requests.patch(f"{RUNNER_URL}/scheduler/jobs/{reminder.job_id}", json=job_data, timeout=5)
+        resp = metrics.http.patch(f"{RUNNER_URL}/scheduler/jobs/{reminder.job_id}", json=job_data, timeout=5)
         resp.raise_for_status()
         log.info("Successfully updated reminder with id %s", reminder.id)
     except Exception as e:
@@ -111,7 +112,7 @@ def update_reminder_runner(reminder:Reminder):
 def delete_from_reminder_runner(reminder:Reminder):
     """ Delete a reminder from the reminders_runner process """
     try:
-        resp = requests.delete(f"{RUNNER_URL}/scheduler/jobs/{reminder.job_id}", timeout=5)
+        resp = metrics.http.delete(f"{RUNNER_URL}/scheduler/jobs/{reminder.job_id}", timeout=5)
         resp.raise_for_status()
         log.info("Successfully deleted reminder with id %s", reminder.id)
     except Exception as e:
@@ -3,35 +3,64 @@ A thread that watches for reminders to trigger. This gets run by systemd in a se
 It communicates with the main app via a single localhost endpoint.
 It does:
 * Receive the next reminder to trigger from the main app
-* Send a push notification to the device at the appropriate time
-* Once it's sent a push notification, send a request to the main app to mark it as triggered. After that, the
-    main app calculates the next reminder to trigger and sends it's info to this process.
+* Send a push notification to the device at the appropriate time. Notifications get queued in the
+    push_outbox table first, and a background thread sends them to expo in batches, retrying failures
+* Once it's sent a push notification, let the main app know it's been triggered. Fires are kept in the
+    fired_outbox table, and sent to the main app in batches. The main app calculates the next time for repeating reminders, and sends the
+    jobs back to be scheduled again.
 * Start it's own Flask process to handle the requests from the main app
 It doesn't:
 * Calculate the next time to trigger
-* Touch the DB at all
+* Touch the DB at all (besides looking up tokens, and the push_outbox and fired_outbox tables)
 * Have access to Reminder (it just uses some of the reminder's info directly)
 """
 
 import requests
-from flask import Flask, request
+from flask import Flask, request, g
+from apscheduler.events import EVENT_JOB_SUBMITTED
 from logging.handlers import RotatingFileHandler
 import logging
 from flask_apscheduler import APScheduler
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 import sqlite3
 import os
+import threading
+import bisect
+import json
+from datetime import datetime
+from time import sleep, time, perf_counter
 
 app = Flask(__name__)
 
-DB = "/home/rock/rock-server/reminders.db" if os.uname().nodename == "rockpi-4b" else "/home/zeke/hello/rock-server/rock_server/reminders.db"
+DB = os.environ.get("REMINDERS_DB") or ("/home/rock/rock-server/reminders.db" if os.uname().nodename == "rockpi-4b" else "/home/zeke/hello/rock-server/rock_server/reminders.db")
 # LOG_FILE = 'reminder_thread.log'
 # file_handler = RotatingFileHandler(LOG_FILE, maxBytes=1024*1024, backupCount=1) # 1MB
 # file_handler.setLevel(logging.DEBUG)
 # file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 # app.logger.addHandler(file_handler)
+
+class JSONFormatter(logging.Formatter):
+    """ One JSON object per line. The same as the main app's rock_server.log_format.JSONFormatter
+        (which we can't import from here), so the log viewer can read both the same way
+    """
+    REQUEST_FIELDS = ('method', 'path', 'status', 'duration_ms')
+
+    def format(self, record):
+        data = {"ts": round(record.created, 3), "levelno": record.levelno, "level": record.levelname, "msg": record.getMessage()}
+        for field in self.REQUEST_FIELDS:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+# "text" (just the message) or "json", same as the main app's LOG_FORMAT
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
 # Just print them, so they show up in the system logs
-app.logger.addHandler(logging.StreamHandler())
+stream_handler = logging.StreamHandler()
+if LOG_FORMAT == "json":
+    stream_handler.setFormatter(JSONFormatter())
+app.logger.addHandler(stream_handler)
 app.logger.setLevel(logging.DEBUG)
 log = app.logger
 
@@ -41,6 +70,36 @@ class Config:
     # SCHEDULER_EXECUTORS = {"default": {"type": "threadpool", "max_workers": 8}}
     # SCHEDULER_JOB_DEFAULTS = {"coalesce": False, "max_instances": 3}
     SCHEDULER_API_ENABLED = True
+    # Notifications for the same device that come due within this many seconds of each other get
+    # merged into a single push. 0 disables coalescing, and every reminder gets sent on its own
+    COALESCE_WINDOW_SEC = 0
+    # Where push notifications get sent. Point this at fake_expo.py to test without the real service
+    EXPO_PUSH_URL = os.environ.get("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
+    # Push notifications go through the push_outbox table, and get sent by outbox_worker()
+    # Expo accepts up to 100 messages per request
+    OUTBOX_BATCH_SIZE = 100
+    # How often the worker checks the outbox for rows that weren't queued by this process
+    OUTBOX_POLL_SEC = 2
+    # After this many failed sends, a notification is marked as failed and left alone
+    OUTBOX_MAX_ATTEMPTS = 5
+    # Retries wait OUTBOX_RETRY_BACKOFF_SEC * 2**attempts
+    OUTBOX_RETRY_BACKOFF_SEC = 10
+    # If a notification's been sending for this long, whatever was sending it is gone, so it's sent again
+    OUTBOX_SENDING_TIMEOUT_SEC = 5 * 60
+    # Sent and failed rows are kept this long (for /outbox, and working out what happened), then deleted
+    OUTBOX_KEEP_DAYS = 7
+    # How often the worker deletes the old ones
+    OUTBOX_PRUNE_INTERVAL_SEC = 60 * 60
+    # Where the main app's irregular reminders endpoints live
+    MAIN_SERVER_URL = "http://localhost:5000/irregular-reminders/v1"
+    # Sent with everything we tell the main app, if it's set. It has to match the main app's
+    RUNNER_SECRET = os.environ.get("RUNNER_SECRET")
+    # How often to tell the main app which reminders have gone off
+    FIRE_FEEDBACK_INTERVAL_SEC = 10
+    # The most fired reminders to send the main app in one request
+    FIRE_FEEDBACK_BATCH_SIZE = 500
+    # If the main app is down, wait twice as long each time before trying again, up to this long
+    FIRE_FEEDBACK_MAX_BACKOFF_SEC = 10 * 60
     # TODO:
     # SCHEDULER_TIMEZONE = 'UTC'
 
@@ -48,6 +107,121 @@ app.config.from_object(Config)
 scheduler = APScheduler()
 
 
+class LatencyHistograms:
+    """ Fixed-bucket latency histograms for a handful of named metrics, one per hour.
+        Only the last keep_hours hours are kept. Percentiles are approximate (the upper edge of the
+        bucket they land in), but recording is cheap and the memory use doesn't grow with traffic.
+    """
+    # Upper edges of the buckets, in seconds. Anything past the last one goes in an overflow bucket
+    BUCKETS = (.001, .002, .005, .01, .02, .05, .1, .2, .5, 1, 2, 5, 10, 30, 60, 300, 900)
+
+    def __init__(self, keep_hours=48):
+        self.keep_hours = keep_hours
+        # {metric: {hour (epoch): {"counts": [...], "max": seconds}}}
+        self.metrics = {}
+        # Everything since we started, for /metrics: {metric: {"counts": [...], "sum": seconds}}
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def record(self, metric, seconds, when=None):
+        hour = int((when or time()) // 3600 * 3600)
+        with self.lock:
+            hours = self.metrics.setdefault(metric, {})
+            if hour not in hours:
+                hours[hour] = {"counts": [0] * (len(self.BUCKETS) + 1), "max": 0}
+                # Drop anything that's too old
+                for old in [h for h in hours if h <= hour - self.keep_hours * 3600]:
+                    del hours[old]
+            bucket = hours[hour]
+            bucket["counts"][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            bucket["max"] = max(bucket["max"], seconds)
+            total = self.totals.setdefault(metric, {"counts": [0] * (len(self.BUCKETS) + 1), "sum": 0.})
+            total["counts"][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            total["sum"] += seconds
+
+    @classmethod
+    def percentile(cls, counts, p, max_seen):
+        total = sum(counts)
+        if not total:
+            return None
+        running = 0
+        for i, count in enumerate(counts):
+            running += count
+            if running >= total * p:
+                # The overflow bucket doesn't have an upper edge, but we know the biggest value in it
+                return min(cls.BUCKETS[i], max_seen) if i < len(cls.BUCKETS) else max_seen
+        return max_seen
+
+    def summary(self):
+        """ {metric: [{hour, count, p50_ms, p95_ms, p99_ms, max_ms}, ...]}, oldest hour first """
+        ms = lambda sec: round(sec * 1000, 2) if sec is not None else None
+        with self.lock:
+            return {metric: [{
+                "hour": datetime.fromtimestamp(hour).isoformat(),
+                "count": sum(h["counts"]),
+                "p50_ms": ms(self.percentile(h["counts"], .50, h["max"])),
+                "p95_ms": ms(self.percentile(h["counts"], .95, h["max"])),
+                "p99_ms": ms(self.percentile(h["counts"], .99, h["max"])),
+                "max_ms": ms(h["max"]),
+            } for hour, h in sorted(hours.items())] for metric, hours in self.metrics.items()}
+
+    def prometheus(self, name):
+        """ The totals as a Prometheus histogram called name, with a metric label """
+        lines = [f"# HELP {name} How long each step of sending a reminder took", f"# TYPE {name} histogram"]
+        with self.lock:
+            for metric, total in sorted(self.totals.items()):
+                running = 0
+                for edge, count in zip((*self.BUCKETS, "+Inf"), total["counts"]):
+                    running += count
+                    lines.append(f'{name}_bucket{{metric="{metric}",le="{edge}"}} {running}')
+                lines.append(f'{name}_sum{{metric="{metric}"}} {total["sum"]}')
+                lines.append(f'{name}_count{{metric="{metric}"}} {running}')
+        return lines
+
+# How late things are, from when a job was supposed to run to when expo acknowledged it:
+# start_lag:    scheduled run_date -> APScheduler actually starting the job
+# token_lookup: looking up the tokens for a batch of notifications
+# expo_rtt:     the round trip of a single request to expo
+# queue_to_ack: a notification going into the outbox -> expo acknowledging it
+latency = LatencyHistograms()
+
+# Notifications waiting out the coalescing window: {device_id: [(title, message), ...]}
+_pending = {}
+_pending_lock = threading.Lock()
+# Set whenever something gets queued, so the outbox worker doesn't have to wait for the next poll
+_outbox_wakeup = threading.Event()
+
+# The outbox is the durable record of every push notification we've been asked to send. Rows go
+# pending -> sending -> sent, or back to pending to be retried, or to failed once we give up.
+# While a row is sending, next_attempt_at is when to give up on whoever's sending it (see claim_outbox_batch()).
+# The main server creates this table too, so either side can queue notifications with a local insert
+with sqlite3.connect(DB) as con:
+    con.executescript("""BEGIN;
+        CREATE TABLE IF NOT EXISTS push_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id,
+            title,
+            message,
+            state TEXT NOT NULL DEFAULT 'pending', -- pending, sending, sent, or failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at,
+            next_attempt_at,
+            sent_at,
+            error
+        );
+        CREATE INDEX IF NOT EXISTS push_outbox_state ON push_outbox (state, next_attempt_at);
+        -- Reminders that have gone off, but the main app doesn't know about yet. Kept here rather than
+        -- in memory, so they survive the main app (or us) being down for a while
+        CREATE TABLE IF NOT EXISTS fired_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reminder_id,
+            time -- epoch seconds
+        );
+        -- Anything that was mid-send when we went down never got confirmed, so send it again
+        UPDATE push_outbox SET state = 'pending' WHERE state = 'sending';
+    END;""")
+
+
 def get_token(device_id: str, con:sqlite3.Connection):
     """ Get a device's token from the database """
     try:
@@ -63,44 +237,265 @@ def get_token(device_id: str, con:sqlite3.Connection):
         return # {"error": str(e)}, 500
     return token
 
-def send_push_notification(device_id, title, message):
-    """ Send a push notification to a device """
-    log.info("⬆️ Sending Push Notification to %s: %s", device_id, title)
+def send_push_notification(device_id, title, message, reminder_id=None):
+    """ Send a push notification to a device
+        If coalescing is enabled, this gets held for a few seconds, in case other reminders for the
+        same device come due, and they all get sent together in flush_pending_notifications()
+        reminder_id is optional, because older jobs were scheduled without it
+    """
+    if reminder_id is not None:
+        with sqlite3.connect(DB) as con:
+            con.execute("INSERT INTO fired_outbox (reminder_id, time) VALUES (?, ?)", (reminder_id, time()))
 
-    with sqlite3.connect(DB) as con:
-        token = get_token(device_id, con)
+    window = app.config['COALESCE_WINDOW_SEC']
+    if not window:
+        enqueue_push(device_id, title, message)
+        return
+
+    with _pending_lock:
+        # There's already a timer waiting for this device, just tag along
+        if device_id in _pending:
+            _pending[device_id].append((title, message))
+            log.debug("Coalescing notification for %s: %s (%s pending)", device_id, title, len(_pending[device_id]))
+            return
+        _pending[device_id] = [(title, message)]
+
+    timer = threading.Timer(window, flush_pending_notifications, args=(device_id,))
+    timer.daemon = True
+    timer.start()
+
+def flush_pending_notifications(device_id):
+    """ Send everything that's been held for a device as a single push notification """
+    with _pending_lock:
+        notifications = _pending.pop(device_id, [])
 
-    if token is None:
-        log.error("Failed to get token for device %s", device_id)
+    if not notifications:
         return
+    if len(notifications) > 1:
+        log.info("Coalesced %s notifications for %s into one push", len(notifications), device_id)
+    enqueue_push(device_id, *merge_notifications(notifications))
 
-    log.debug("Token for push notification: %s", token)
-
-    # Expo push API endpoint
-    response = requests.post(
-        "https://exp.host/--/api/v2/push/send",
-        json={
-            "to": token,
-            "sound": "default",
-            "title": title,
-            "body": message,
-        },
-        headers={
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        },
-        timeout=5
-    )
-    log.info("✅ Push Notification Response from expo server: %s", response.json())
+def merge_notifications(notifications):
+    """ Combine a list of (title, message) pairs into a single (title, message) pair """
+    if len(notifications) == 1:
+        return notifications[0]
+    title = f"{len(notifications)} reminders"
+    message = "\n".join(f"{t}: {m}" if m else t for t, m in notifications)
+    return title, message
+
+def enqueue_push(device_id, title, message):
+    """ Queue a push notification in the outbox. It gets sent by the outbox worker """
+    log.info("⬆️ Queueing Push Notification to %s: %s", device_id, title)
+    now = time()
+    with sqlite3.connect(DB) as con:
+        con.execute(
+            "INSERT INTO push_outbox (device_id, title, message, state, created_at, next_attempt_at) VALUES (?, ?, ?, 'pending', ?, ?)",
+            (device_id, title, message, now, now)
+        )
+    _outbox_wakeup.set()
+
+def claim_outbox_batch(con:sqlite3.Connection, limit:int):
+    """ Mark up to limit pending notifications as sending, and return them as (id, device_id, title, message, attempts, created_at)
+        Ones that have been sending for longer than OUTBOX_SENDING_TIMEOUT_SEC get claimed again too
+    """
+    now = time()
+    with con:
+        rows = con.execute(
+            "SELECT id, device_id, title, message, attempts, created_at FROM push_outbox "
+            "WHERE state IN ('pending', 'sending') AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (now, limit)
+        ).fetchall()
+        con.executemany("UPDATE push_outbox SET state = 'sending', next_attempt_at = ? WHERE id = ?",
+            [(now + app.config['OUTBOX_SENDING_TIMEOUT_SEC'], row[0]) for row in rows])
+    return rows
+
+def _mark_failed(con:sqlite3.Connection, row, error, permanent=False):
+    """ Either schedule a row to be retried, or give up on it """
+    id, device_id, _, _, attempts, _ = row
+    attempts += 1
+    if permanent or attempts >= app.config['OUTBOX_MAX_ATTEMPTS']:
+        log.error("Giving up on push notification %s to %s after %s attempts: %s", id, device_id, attempts, error)
+        con.execute("UPDATE push_outbox SET state = 'failed', attempts = ?, error = ? WHERE id = ?", (attempts, error, id))
+    else:
+        retry_at = time() + app.config['OUTBOX_RETRY_BACKOFF_SEC'] * 2 ** attempts
+        log.warning("Push notification %s to %s failed (attempt %s), retrying later: %s", id, device_id, attempts, error)
+        con.execute(
+            "UPDATE push_outbox SET state = 'pending', attempts = ?, error = ?, next_attempt_at = ? WHERE id = ?",
+            (attempts, error, retry_at, id)
+        )
+
+def drain_outbox():
+    """ Send one batch of pending notifications from the outbox. Returns how many rows were claimed """
+    with sqlite3.connect(DB) as con:
+        rows = claim_outbox_batch(con, app.config['OUTBOX_BATCH_SIZE'])
+        if not rows:
+            return 0
+
+        device_ids = list({row[1] for row in rows})
+        started = perf_counter()
+        tokens = dict(con.execute(
+            f"SELECT device_id, token FROM devices WHERE device_id IN ({', '.join(['?'] * len(device_ids))})",
+            device_ids
+        ).fetchall())
+        latency.record("token_lookup", perf_counter() - started)
+
+        to_send = []
+        with con:
+            for row in rows:
+                if tokens.get(row[1]) is None:
+                    _mark_failed(con, row, "Invalid device_id", permanent=True)
+                else:
+                    to_send.append(row)
+        if not to_send:
+            return len(rows)
+
+        log.debug("Sending %s push notifications to expo", len(to_send))
+        started = perf_counter()
+        try:
+            # Expo push API endpoint. It takes a list, and gives back a list of tickets in the same order
+            response = requests.post(
+                app.config['EXPO_PUSH_URL'],
+                json=[{
+                    "to": tokens[device_id],
+                    "sound": "default",
+                    "title": title,
+                    "body": message,
+                } for _, device_id, title, message, _, _ in to_send],
+                headers={
+                    "Content-Type": "application/json",
+                    "Accept": "application/json"
+                },
+                timeout=5
+            )
+            latency.record("expo_rtt", perf_counter() - started)
+            response.raise_for_status()
+            tickets = response.json()['data']
+        except Exception as e:
+            log.error("Failed to send push notifications to expo: %s", e)
+            with con:
+                for row in to_send:
+                    _mark_failed(con, row, str(e))
+            return len(rows)
+
+        log.info("✅ Push Notification Response from expo server: %s", tickets)
+        acked = time()
+        with con:
+            if len(tickets) != len(to_send):
+                log.error("Sent expo %s push notifications, but only got %s tickets back", len(to_send), len(tickets))
+                # We can't tell if these went out, so they get sent again
+                for row in to_send[len(tickets):]:
+                    _mark_failed(con, row, "No ticket from expo")
+            for row, ticket in zip(to_send, tickets):
+                if ticket.get('status') == 'ok':
+                    con.execute("UPDATE push_outbox SET state = 'sent', attempts = attempts + 1, sent_at = ? WHERE id = ?", (acked, row[0]))
+                    latency.record("queue_to_ack", acked - row[5])
+                else:
+                    # The device isn't coming back, so there's no point retrying
+                    permanent = ticket.get('details', {}).get('error') == 'DeviceNotRegistered'
+                    _mark_failed(con, row, ticket.get('message', 'Unknown error'), permanent)
+    return len(rows)
+
+def prune_outbox(now=None):
+    """ Delete the sent and failed rows that are older than OUTBOX_KEEP_DAYS, so the outbox doesn't grow
+        forever. Returns how many it deleted
+    """
+    cutoff = (now or time()) - app.config['OUTBOX_KEEP_DAYS'] * 24 * 60 * 60
+    with sqlite3.connect(DB) as con:
+        deleted = con.execute("DELETE FROM push_outbox WHERE state IN ('sent', 'failed') AND created_at < ?", (cutoff,)).rowcount
+    if deleted:
+        log.info("Deleted %s old rows from the outbox", deleted)
+    return deleted
+
+def outbox_worker():
+    """ Runs forever in a background thread, draining the outbox, and pruning it every so often """
+    pruned_at = 0
+    while True:
+        try:
+            if time() - pruned_at >= app.config['OUTBOX_PRUNE_INTERVAL_SEC']:
+                pruned_at = time()
+                prune_outbox()
+            # If we got a full batch, there's probably more waiting
+            if drain_outbox() >= app.config['OUTBOX_BATCH_SIZE']:
+                continue
+        except Exception as e:
+            log.exception("Outbox worker failed: %s", e)
+        _outbox_wakeup.wait(app.config['OUTBOX_POLL_SEC'])
+        _outbox_wakeup.clear()
+
+def flush_fired():
+    """ Tell the main app about the oldest batch of reminders that have gone off, in one request, and
+        schedule the jobs it sends back. Returns how many it told it about. Raises if the main app
+        couldn't be told, and leaves them in fired_outbox for next time
+    """
+    with sqlite3.connect(DB) as con:
+        rows = con.execute("SELECT id, reminder_id, time FROM fired_outbox ORDER BY id LIMIT ?",
+            (app.config['FIRE_FEEDBACK_BATCH_SIZE'],)).fetchall()
+    if not rows:
+        return 0
+
+    resp = requests.post(f"{app.config['MAIN_SERVER_URL']}/runner/fired",
+        json={"fired": [{"id": reminder_id, "time": when} for _, reminder_id, when in rows]},
+        headers={"X-Runner-Secret": app.config['RUNNER_SECRET']} if app.config['RUNNER_SECRET'] else None,
+        timeout=5)
+    resp.raise_for_status()
+    jobs = resp.json()['jobs']
+    with sqlite3.connect(DB) as con:
+        con.executemany("DELETE FROM fired_outbox WHERE id = ?", [(row[0],) for row in rows])
+
+    for job in jobs:
+        try:
+            scheduler.add_job(replace_existing=True, **job)
+        except Exception as e:
+            log.error("Failed to reschedule job %s: %s", job.get('id'), e)
+    log.info("Sent %s fired reminders to the main app, rescheduled %s jobs", len(rows), len(jobs))
+    return len(rows)
+
+def fire_feedback_worker():
+    """ Runs forever in a background thread, flushing fired reminders to the main app. Backs off while
+        the main app is down
+    """
+    wait = app.config['FIRE_FEEDBACK_INTERVAL_SEC']
+    while True:
+        sleep(wait)
+        try:
+            # If we got a full batch, there's probably more waiting
+            while flush_fired() >= app.config['FIRE_FEEDBACK_BATCH_SIZE']:
+                pass
+            wait = app.config['FIRE_FEEDBACK_INTERVAL_SEC']
+        except Exception as e:
+            wait = min(wait * 2, app.config['FIRE_FEEDBACK_MAX_BACKOFF_SEC'])
+            log.error("Failed to send fired reminders to the main app, trying again in %s seconds: %s", wait, e)
+
+def on_job_submitted(event):
+    """ Record how long after its run_date APScheduler actually got around to a job """
+    for scheduled in event.scheduled_run_times:
+        lag = (datetime.now(scheduled.tzinfo) - scheduled).total_seconds()
+        latency.record("start_lag", max(lag, 0))
+        if lag > 60:
+            log.warning("Job %s started %.1f seconds late", event.job_id, lag)
+
+# Requests handled, for /metrics: {(method, route, status): [count, total seconds]}
+_requests = {}
+_requests_lock = threading.Lock()
 
 @app.before_request
 def log_request_info():
     """ Log all requests """
-    app.logger.debug("Request: %s %s", request.method, request.url)
+    g.start_time = perf_counter()
+    app.logger.debug("Request: %s %s", request.method, request.url,
+        extra={"method": request.method, "path": request.path})
 
 @app.after_request
 def log_response(response):
-    app.logger.debug("Response: %s %s -> %s", request.method, request.url, response.status)
+    extra = {"method": request.method, "path": request.path, "status": response.status_code}
+    if 'start_time' in g:
+        extra["duration_ms"] = round((perf_counter() - g.start_time) * 1000, 2)
+        route = request.url_rule.rule if request.url_rule else "<no route>"
+        with _requests_lock:
+            counts = _requests.setdefault((request.method, route, response.status_code), [0, 0.])
+            counts[0] += 1
+            counts[1] += extra["duration_ms"] / 1000
+    app.logger.debug("Response: %s %s -> %s", request.method, request.url, response.status, extra=extra)
     return response
 
 @app.errorhandler(Exception)
@@ -113,9 +508,61 @@ def log_error(e):
 def index():
     return {"status": "ok"}, 200
 
+@app.route("/outbox")
+def outbox_status():
+    """ How many notifications are in each state, and how long the oldest pending one has been waiting """
+    with sqlite3.connect(DB) as con:
+        counts = dict(con.execute("SELECT state, COUNT(*) FROM push_outbox GROUP BY state").fetchall())
+        oldest = con.execute("SELECT MIN(created_at) FROM push_outbox WHERE state = 'pending'").fetchone()[0]
+    return {
+        "counts": {state: counts.get(state, 0) for state in ('pending', 'sending', 'sent', 'failed')},
+        "oldest_pending_age_sec": time() - oldest if oldest is not None else None,
+    }, 200
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """ The runner's own metrics, in the Prometheus text format. It's only ever one process, so unlike
+        the main server's, there's nothing to add up
+    """
+    lines = [
+        "# HELP runner_http_requests_total Requests handled",
+        "# TYPE runner_http_requests_total counter",
+    ]
+    with _requests_lock:
+        requests_handled = sorted(_requests.items())
+    for (method, route, status), (count, _) in requests_handled:
+        lines.append(f'runner_http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+    lines += ["# HELP runner_http_request_seconds_total Time spent handling requests",
+        "# TYPE runner_http_request_seconds_total counter"]
+    for (method, route, status), (_, seconds) in requests_handled:
+        lines.append(f'runner_http_request_seconds_total{{method="{method}",route="{route}",status="{status}"}} {seconds}')
+
+    lines += latency.prometheus("runner_latency_seconds")
+
+    with sqlite3.connect(DB) as con:
+        counts = dict(con.execute("SELECT state, COUNT(*) FROM push_outbox GROUP BY state").fetchall())
+    lines += ["# HELP runner_outbox_notifications Push notifications in the outbox, by state",
+        "# TYPE runner_outbox_notifications gauge"]
+    for state in ('pending', 'sending', 'sent', 'failed'):
+        lines.append(f'runner_outbox_notifications{{state="{state}"}} {counts.get(state, 0)}')
+    lines += ["# HELP runner_scheduled_jobs Jobs in the scheduler", "# TYPE runner_scheduled_jobs gauge",
+        f"runner_scheduled_jobs {len(scheduler.get_jobs())}"]
+    return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+@app.route("/metrics/latency")
+def latency_metrics():
+    """ Per-hour latency percentiles, from a job's scheduled run_date to expo acknowledging the push """
+    return latency.summary(), 200
+
 
 scheduler.init_app(app)
-scheduler.start()
+scheduler.add_listener(on_job_submitted, EVENT_JOB_SUBMITTED)
+# The tests set this to 0, so they can import this without anything running in the background
+if os.environ.get("REMINDERS_RUNNER_START", "1") == "1":
+    scheduler.start()
+    threading.Thread(target=outbox_worker, daemon=True, name="outbox-worker").start()
+    threading.Thread(target=fire_feedback_worker, daemon=True, name="fire-feedback-worker").start()
 
 if __name__ == "__main__":
     app.run(host="localhost", port=5050)
@@ -0,0 +1,121 @@
+"""
+A local stand-in for Expo's push API, so the runner's push path can be load tested without the real
+service (or the internet).
+It does:
+* Batch sends (a single message or a list of up to 100) on /--/api/v2/push/send, giving back tickets
+* Receipts for those tickets on /--/api/v2/push/getReceipts
+* Configurable latency, per-message error rate, and whole-request 429s
+* Counts of everything it's seen on /stats
+
+To use it, start it, and then start the runner pointing at it:
+    python fake_expo.py --port 5055 --latency 0.1 --error-rate 0.01 --rate-limit 0.05
+    EXPO_PUSH_URL=http://localhost:5055/--/api/v2/push/send gunicorn -w 1 --threads 1 -b 127.0.0.1:5050 app:app
+"""
+
+import argparse
+import random
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from time import sleep
+
+from flask import Flask, request
+
+app = Flask(__name__)
+
+# Expo won't take more than this many messages in one request
+MAX_BATCH_SIZE = 100
+# The most receipts to hang onto. Once there's more, the oldest ones are forgotten (Expo only keeps
+# them for a day anyway), so a long load test doesn't use up all the memory
+MAX_RECEIPTS = 100_000
+
+class Config:
+    # Seconds each request takes, plus or minus LATENCY_JITTER
+    LATENCY = 0.
+    LATENCY_JITTER = 0.
+    # Chance of any single message in a request failing
+    ERROR_RATE = 0.
+    # Chance of a whole request getting a 429
+    RATE_LIMIT = 0.
+
+app.config.from_object(Config)
+
+# {ticket_id: receipt}, oldest first
+receipts = OrderedDict()
+stats = Counter()
+lock = threading.Lock()
+
+
+def make_ticket(message):
+    """ Decide what happens to a single message, and give back its ticket """
+    if not message.get("to"):
+        return {"status": "error", "message": "\"to\" is required", "details": {"error": "DeviceNotRegistered"}}
+    if random.random() < app.config['ERROR_RATE']:
+        error = random.choice(["DeviceNotRegistered", "MessageRateExceeded"])
+        return {"status": "error", "message": f"Fake {error}", "details": {"error": error}}
+    return {"status": "ok", "id": str(uuid.uuid4())}
+
+@app.post("/--/api/v2/push/send")
+def send():
+    sleep(max(0, app.config['LATENCY'] + random.uniform(-1, 1) * app.config['LATENCY_JITTER']))
+
+    with lock:
+        stats['requests'] += 1
+    if random.random() < app.config['RATE_LIMIT']:
+        with lock:
+            stats['rate_limited'] += 1
+        return {"errors": [{"code": "TOO_MANY_REQUESTS", "message": "Fake rate limit"}]}, 429
+
+    data = request.get_json()
+    # Expo takes a single message, or a list of them
+    single = isinstance(data, dict)
+    messages = [data] if single else data
+    if len(messages) > MAX_BATCH_SIZE:
+        return {"errors": [{"code": "PUSH_TOO_MANY_NOTIFICATIONS", "message": f"Can't send more than {MAX_BATCH_SIZE} at once"}]}, 400
+
+    tickets = [make_ticket(message) for message in messages]
+    with lock:
+        for ticket in tickets:
+            stats[f"tickets_{ticket['status']}"] += 1
+            if ticket['status'] == 'ok':
+                receipts[ticket['id']] = {"status": "ok"}
+        while len(receipts) > MAX_RECEIPTS:
+            receipts.popitem(last=False)
+    return {"data": tickets[0] if single else tickets}, 200
+
+@app.post("/--/api/v2/push/getReceipts")
+def get_receipts():
+    ids = request.get_json().get("ids", [])
+    with lock:
+        stats['receipt_requests'] += 1
+        return {"data": {id: receipts[id] for id in ids if id in receipts}}, 200
+
+@app.get("/stats")
+def get_stats():
+    with lock:
+        return dict(stats), 200
+
+@app.delete("/stats")
+def reset_stats():
+    with lock:
+        stats.clear()
+        receipts.clear()
+    return {"status": "ok"}, 200
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--latency", type=float, default=0., help="Seconds each request takes")
+    parser.add_argument("--latency-jitter", type=float, default=0., help="Randomly add or remove up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0., help="Chance of each message failing")
+    parser.add_argument("--rate-limit", type=float, default=0., help="Chance of each request getting a 429")
+    args = parser.parse_args()
+
+    app.config.update(
+        LATENCY=args.latency,
+        LATENCY_JITTER=args.latency_jitter,
+        ERROR_RATE=args.error_rate,
+        RATE_LIMIT=args.rate_limit,
+    )
+    app.run(host="localhost", port=args.port, threaded=True)
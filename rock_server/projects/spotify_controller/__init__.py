@@ -2,6 +2,7 @@ import requests
 import json
 import os
 from flask import Blueprint
+from rock_server import metrics
 from rock_server.utils import current_app
 import datetime as dt
 from werkzeug.exceptions import Unauthorized, HTTPException
@@ -63,7 +64,7 @@ def refresh_token():
         'refresh_token': token,
     }
     auth = (CLIENT_ID, CLIENT_SECRET)
-    response = requests.post(url, data=payload, auth=auth)
+    response = metrics.http.post(url, data=payload, auth=auth)
     if response.status_code == 200:
         new_access_token = response.json().get('access_token')
         save_tokens(new_access_token, token)  # Save the new access token
@@ -79,13 +80,13 @@ def make_request(endpoint, method='GET', data=None, raw=False, **query_params):
 
     url = API_BASE + endpoint
     if method == 'GET':
-        response = requests.get(url, headers=AUTH_HEADERS, params=query_params)
+        response = metrics.http.get(url, headers=AUTH_HEADERS, params=query_params)
     elif method == 'DELETE':
-        response = requests.delete(url, headers=AUTH_HEADERS, params=query_params, json=data)
+        response = metrics.http.delete(url, headers=AUTH_HEADERS, params=query_params, json=data)
     elif method == 'POST':
-        response = requests.post(url, headers=AUTH_HEADERS, params=query_params, json=data)
+        response = metrics.http.post(url, headers=AUTH_HEADERS, params=query_params, json=data)
     elif method == 'PUT':
-        response = requests.put(url, headers=AUTH_HEADERS, params=query_params, json=data)
+        response = metrics.http.put(url, headers=AUTH_HEADERS, params=query_params, json=data)
     else:
         raise TypeError('Invalid method given to make_request')
 
@@ -257,7 +258,7 @@ def spotify_callback():
         f"{CLIENT_ID}:{CLIENT_SECRET}".encode()
     ).decode()
 
-    response = requests.post(
+    response = metrics.http.post(
         TOKEN_URL,
         headers={
             "Authorization": f"Basic {auth_header}",
@@ -0,0 +1,300 @@
+"""
+Counters, gauges and histograms that add up across all the gunicorn workers, served in the Prometheus
+text format (see /metrics).
+
+Every process writes its own values into its own mmap'd file in a shared directory, so updating a
+metric is just writing a float into memory. Whichever worker gets scraped reads all the files, and adds
+them up. gunicorn.conf.py gives each run of the server a fresh directory (METRICS_DIR), so numbers from
+workers that have since exited still count, but nothing from last time does.
+
+    requests_total = registry.counter("requests_total", "Requests handled", ("route",))
+    requests_total.labels(route="/info/").inc()
+    print(registry.render())
+
+Gauges are added up across workers too, unless they're made with multiprocess_mode="max" (the biggest
+one) or "all" (one per worker, with a pid label). Gauges from workers that have exited get left out.
+"""
+import glob
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import weakref
+
+# The histogram buckets, in seconds, if none are given
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, float('inf'))
+# How big each process's file starts out. It doubles whenever it fills up
+INITIAL_FILE_SIZE = 64 * 1024
+
+# The file format: a header with how many bytes are used, then entries of
+# [key length (4 bytes)][key (utf-8, padded to 8 bytes)][value (8 byte float)]
+_HEADER = struct.Struct('<Q')
+_KEY_LENGTH = struct.Struct('<I')
+_VALUE = struct.Struct('<d')
+
+
+def _padded(n):
+    return (n + 7) // 8 * 8
+
+
+class MmapValues:
+    """ One process's values, as {key: float}, in a file other processes can read at any time.
+        Entries only ever get added (with the value written before the used size gets bumped), and values
+        are 8 byte aligned, so a reader never sees half of anything
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # {key: where its value is}
+        self.positions = {}
+        self.file = open(path, 'a+b')
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.truncate(INITIAL_FILE_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.used = _HEADER.unpack_from(self.map, 0)[0] or _HEADER.size
+        for key, _, position in self._entries(self.map, self.used):
+            self.positions[key] = position
+
+    @staticmethod
+    def _entries(data, used):
+        """ (key, value, where the value is) for each entry in data """
+        position = _HEADER.size
+        while position < used:
+            length = _KEY_LENGTH.unpack_from(data, position)[0]
+            key = bytes(data[position + _KEY_LENGTH.size:position + _KEY_LENGTH.size + length]).decode()
+            position = _padded(position + _KEY_LENGTH.size + length)
+            yield key, _VALUE.unpack_from(data, position)[0], position
+            position += _VALUE.size
+
+    def _position(self, key):
+        """ Where key's value is, adding it if it's not there yet. Call with the lock held """
+        if (position := self.positions.get(key)) is not None:
+            return position
+        encoded = key.encode()
+        position = _padded(self.used + _KEY_LENGTH.size + len(encoded))
+        end = position + _VALUE.size
+        if end > len(self.map):
+            size = len(self.map)
+            while size < end:
+                size *= 2
+            self.map.close()
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        _KEY_LENGTH.pack_into(self.map, self.used, len(encoded))
+        self.map[self.used + _KEY_LENGTH.size:self.used + _KEY_LENGTH.size + len(encoded)] = encoded
+        _VALUE.pack_into(self.map, position, 0.)
+        self.used = end
+        # Only now can readers see it
+        _HEADER.pack_into(self.map, 0, self.used)
+        self.positions[key] = position
+        return position
+
+    def inc(self, key, amount):
+        with self.lock:
+            position = self._position(key)
+            _VALUE.pack_into(self.map, position, _VALUE.unpack_from(self.map, position)[0] + amount)
+
+    def set(self, key, value):
+        with self.lock:
+            _VALUE.pack_into(self.map, self._position(key), value)
+
+    def close(self):
+        with self.lock:
+            self.map.close()
+            self.file.close()
+
+    @classmethod
+    def read(cls, path):
+        """ {key: value} from any process's file, without mapping it """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < _HEADER.size:
+            return {}
+        used = min(_HEADER.unpack_from(data, 0)[0], len(data))
+        return {key: value for key, value, _ in cls._entries(data, used)}
+
+
+def _key(name, labels):
+    return json.dumps([name, labels], separators=(',', ':'))
+
+def _format_value(value):
+    value = float(value)
+    if value == float('inf'):
+        return "+Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def _sample_order(label_key):
+    """ Sorts samples by their labels, with histogram buckets in order of le """
+    labels = json.loads(label_key)
+    le = labels.pop("le", None)
+    return json.dumps(labels, sort_keys=True), float(le) if le is not None else 0
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+def _remove_directory(directory, pid):
+    # Only from the process that made it. Ones that forked off it share it
+    if os.getpid() == pid:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Child:
+    """ A metric with all its labels filled in """
+    def __init__(self, metric, labels):
+        self.metric = metric
+        self.labels = labels
+
+    def inc(self, amount=1):
+        self.metric.registry.values.inc(_key(self.metric.name, self.labels), amount)
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.metric.registry.values.set(_key(self.metric.name, self.labels), value)
+
+    def observe(self, value):
+        values = self.metric.registry.values
+        for bound in self.metric.buckets:
+            if value <= bound:
+                values.inc(_key(self.metric.name + "_bucket", {**self.labels, "le": _format_value(bound)}), 1)
+        values.inc(_key(self.metric.name + "_sum", self.labels), value)
+        values.inc(_key(self.metric.name + "_count", self.labels), 1)
+
+
+class Metric:
+    def __init__(self, registry, kind, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, multiprocess_mode="sum"):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.multiprocess_mode = multiprocess_mode
+
+    def labels(self, *values, **labels):
+        if values:
+            labels = dict(zip(self.labelnames, values))
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} needs the labels {self.labelnames}, not {tuple(labels)}")
+        return _Child(self, {name: str(labels[name]) for name in self.labelnames})
+
+    # So metrics without labels can be used directly
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Registry:
+    """ All the metrics, backed by a file for this process in directory (a temporary directory of its
+        own if there isn't one, for when there's only one process anyway). A temporary directory gets
+        deleted by close(), or when the registry is garbage collected, or at exit, whichever's first
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or tempfile.mkdtemp(prefix="rock-server-metrics-")
+        os.makedirs(self.directory, exist_ok=True)
+        self._cleanup = None if directory else weakref.finalize(self, _remove_directory, self.directory, os.getpid())
+        self.metrics = {}
+        self._values = None
+        self._pid = None
+        self.lock = threading.Lock()
+
+    @property
+    def values(self):
+        """ This process's file. It's opened on first use, so a process that forks gets its own """
+        if self._pid != os.getpid():
+            with self.lock:
+                if self._pid != os.getpid():
+                    self._values = MmapValues(os.path.join(self.directory, f"{os.getpid()}.db"))
+                    self._pid = os.getpid()
+        return self._values
+
+    def close(self):
+        """ Close this process's file, and delete the directory if it's a temporary one """
+        with self.lock:
+            if self._values is not None and self._pid == os.getpid():
+                self._values.close()
+            self._values = self._pid = None
+        if self._cleanup is not None:
+            self._cleanup()
+
+    def _add(self, kind, name, help, labelnames=(), **kwargs):
+        if name in self.metrics:
+            return self.metrics[name]
+        metric = self.metrics[name] = Metric(self, kind, name, help, labelnames, **kwargs)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add("counter", name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=(), multiprocess_mode="sum"):
+        return self._add("gauge", name, help, labelnames, multiprocess_mode=multiprocess_mode)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add("histogram", name, help, labelnames, buckets=buckets)
+
+    def collect(self):
+        """ {sample name: {labels json: value}}, added up across every process's file """
+        samples = {}
+        for path in glob.glob(os.path.join(self.directory, "*.db")):
+            pid = int(os.path.basename(path).split('.')[0])
+            alive = None
+            try:
+                values = MmapValues.read(path)
+            except FileNotFoundError:
+                continue
+            for key, value in values.items():
+                name, labels = json.loads(key)
+                metric = self.metrics.get(name) or self.metrics.get(name.rsplit('_', 1)[0])
+                if metric is None:
+                    continue
+                if metric.kind == "gauge":
+                    if alive is None:
+                        alive = _alive(pid)
+                    if not alive:
+                        continue
+                    if metric.multiprocess_mode == "all":
+                        labels = {**labels, "pid": str(pid)}
+                label_key = json.dumps(labels, sort_keys=True)
+                sample = samples.setdefault(name, {})
+                if metric.kind == "gauge" and metric.multiprocess_mode == "max":
+                    sample[label_key] = max(sample.get(label_key, value), value)
+                else:
+                    sample[label_key] = sample.get(label_key, 0) + value
+        return samples
+
+    def render(self):
+        """ Everything, in the Prometheus text format """
+        samples = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            suffixes = ("_bucket", "_sum", "_count") if metric.kind == "histogram" else ("",)
+            for suffix in suffixes:
+                for label_key, value in sorted(samples.get(name + suffix, {}).items(), key=lambda item: _sample_order(item[0])):
+                    lines.append(f"{name}{suffix}{_format_labels(json.loads(label_key))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
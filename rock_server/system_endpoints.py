@@ -1,16 +1,18 @@
-from flask import redirect, send_file, url_for, current_app, Blueprint
+from flask import redirect, send_file, url_for, current_app, Blueprint, Response, request
 import subprocess
 import git
 import logging
-import requests
+from . import metrics
 import psutil
 import os
 import time
+import tempfile
 import datetime as dt
 from pathlib import Path
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
-from .utils import format_logs, pretty_timedelta, format_line, generate_log_endpoints
+from .utils import format_logs, pretty_timedelta, format_line, generate_log_endpoints, generate_merged_log_endpoint
 
 bp = Blueprint("system_endpoints", __name__)
 
@@ -18,6 +20,7 @@ log = current_app.logger
 
 SERVICE_NAME = "rock-server"
 REMINDER_RUNNER_SERVICE_NAME = "reminders-runner"
+REMINDER_RUNNER_LOG = "rock_server/projects/irregular_reminders/reminders_runner/reminder_runner.log"
 if not current_app.DEBUG:
     repo = git.Repo("/home/rock/rock-server")
     PYTHON_BINARY = "/home/rock/rock-server/bin/python"
@@ -25,6 +28,114 @@ else:
     repo = git.Repo(".")
     PYTHON_BINARY = "python"
 
+RUNNER_URL = "http://localhost:5050"
+# If a pull changes anything in here, the reminders runner gets restarted
+REMINDER_RUNNER_PATH = "rock_server/projects/irregular_reminders/reminders_runner/"
+# Things a reload doesn't pick up, since only the gunicorn master or the log writer loads them, so if
+# a pull changes them, the whole server gets restarted
+RESTART_PATHS = {
+    "rock_server/log_writer.py",
+    "rock_server/log_format.py",
+    "rock_server/log_archive.py",
+}
+# If a pull changes one of these, systemd has to reload it before the service gets restarted. That only
+# does anything if the installed unit is linked to the one in the repo (otherwise, see edit_service.sh)
+SERVICE_FILES = {
+    "rock-server.service": SERVICE_NAME,
+    "reminders-runner.service": REMINDER_RUNNER_SERVICE_NAME,
+}
+
+# How long the slow parts of /info get reused for
+PACKAGES_TTL_SEC = 60 * 60
+GIT_TTL_SEC = 10 * 60
+RUNNER_TTL_SEC = 5
+# Touching these tells every worker to throw away what it has cached (see CachedValue)
+PACKAGES_STAMP = os.path.join(tempfile.gettempdir(), "rock-server-packages.stamp")
+GIT_STAMP = os.path.join(tempfile.gettempdir(), "rock-server-git.stamp")
+
+
+class CachedValue:
+    """ compute()'s result, reused for ttl seconds. Each gunicorn worker has its own, so invalidate()
+        touches the stamp file, and every worker recomputes once it sees the stamp's changed
+    """
+    def __init__(self, compute, ttl, stamp=None):
+        self.compute = compute
+        self.ttl = ttl
+        self.stamp = stamp
+        self.lock = threading.Lock()
+        self.value = None
+        self.computed_at = None
+        self.stamp_mtime = None
+
+    def _stamp_mtime(self):
+        try:
+            return os.stat(self.stamp).st_mtime_ns if self.stamp else None
+        except FileNotFoundError:
+            return None
+
+    def _fresh(self, stamp_mtime):
+        return (self.computed_at is not None and time.monotonic() - self.computed_at < self.ttl
+            and stamp_mtime == self.stamp_mtime)
+
+    def get(self):
+        stamp_mtime = self._stamp_mtime()
+        if self._fresh(stamp_mtime):
+            return self.value
+        # Only one thread computes it. The rest wait, and use what it got
+        with self.lock:
+            if not self._fresh(stamp_mtime):
+                self.value = self.compute()
+                self.computed_at = time.monotonic()
+                self.stamp_mtime = stamp_mtime
+            return self.value
+
+    def invalidate(self):
+        self.computed_at = None
+        if self.stamp:
+            Path(self.stamp).touch()
+
+
+def get_packages():
+    if current_app.DEBUG:
+        return []
+    return subprocess.check_output([PYTHON_BINARY, "-m", "pip", "freeze"]).decode("utf-8").split("\n")
+
+def get_git_info():
+    commit = repo.head.commit
+    return {
+        "last_commit_msg": commit.message,
+        "last_commit_time": time.strftime("%m-%d-%Y %H:%M:%S", time.localtime(commit.authored_date)),
+        "authored_date": commit.authored_date,
+    }
+
+def get_runner_info():
+    """ What the reminders runner says about itself. All three get asked at once, so it takes at most
+        one timeout instead of three
+    """
+    def get(path):
+        return metrics.http.get(f"{RUNNER_URL}{path}", timeout=5).json()
+    futures = {name: _runner_probes.submit(get, path) for name, path in
+        (("status", "/"), ("process_info", "/scheduler"), ("currently_running_jobs", "/scheduler/jobs"))}
+    info = {}
+    try:
+        info['status'] = futures['status'].result()
+    except Exception:
+        return {'status': 'Not running'}
+    try:
+        info['process_info'] = futures['process_info'].result()
+    except Exception as e:
+        info['process_info'] = f'Failed to get process info: {str(e)}'
+    try:
+        info['currently_running_jobs'] = futures['currently_running_jobs'].result()
+    except Exception as e:
+        info['currently_running_jobs'] = f'Failed to get jobs: {str(e)}'
+    return info
+
+_runner_probes = ThreadPoolExecutor(max_workers=3, thread_name_prefix="runner probe")
+packages = CachedValue(get_packages, PACKAGES_TTL_SEC, PACKAGES_STAMP)
+git_info = CachedValue(get_git_info, GIT_TTL_SEC, GIT_STAMP)
+runner_info = CachedValue(get_runner_info, RUNNER_TTL_SEC)
+
 
 @bp.route("/")
 def index():
@@ -46,6 +157,59 @@ def restart_service():
     # simulate a SIGTERM if that didn't already
     exit(15)
 
+def systemctl(*args):
+    """ sudo systemctl args. Gives back what went wrong, or None if it worked """
+    result = subprocess.run(["sudo", "systemctl", *args], capture_output=True, text=True)
+    if result.returncode:
+        return f"systemctl {' '.join(args)} failed ({result.returncode}): {result.stderr.strip()}"
+    return None
+
+def deploy_plan(changed):
+    """ What a pull that changed these paths needs: {"restart": the whole server has to restart,
+        instead of just reloading, "restart_runner": the reminders runner has to restart,
+        "daemon_reload": systemd has to reload the unit files first}
+    """
+    services = {SERVICE_FILES[path] for path in changed if path in SERVICE_FILES}
+    return {
+        "restart": SERVICE_NAME in services or any(path in RESTART_PATHS for path in changed),
+        "restart_runner": REMINDER_RUNNER_SERVICE_NAME in services or any(path.startswith(REMINDER_RUNNER_PATH) for path in changed),
+        "daemon_reload": bool(services),
+    }
+
+def restart_server():
+    """ Restart this server. Called in a thread, since it takes the thread that calls it down with it """
+    sleep(0.1)
+    log.info("Service restarting")
+    if (error := systemctl("restart", SERVICE_NAME)) is not None:
+        log.error("Failed to restart the service: %s", error)
+
+def deploy(plan):
+    """ Put a pull into effect. Normally that's a gunicorn reload: it starts new workers with the new
+        code, and lets the old ones finish what they're doing before they go (log streams reconnect on
+        their own, and pick up where they left off). Only restarts what it has to, and restarts if the
+        reload doesn't work. Gives back {"status": "reloaded" or "restarting", "errors": [...]}
+    """
+    errors = []
+    if plan["daemon_reload"] and (error := systemctl("daemon-reload")) is not None:
+        errors.append(error)
+    if plan["restart_runner"]:
+        log.info("The reminders runner changed, restarting it")
+        if (error := systemctl("restart", REMINDER_RUNNER_SERVICE_NAME)) is not None:
+            errors.append(error)
+    restart = plan["restart"]
+    if not restart:
+        log.info("Service reloading")
+        if (error := systemctl("reload", SERVICE_NAME)) is not None:
+            # Probably the installed unit doesn't have ExecReload yet
+            log.warning("Reloading didn't work, restarting instead: %s", error)
+            errors.append(error)
+            restart = True
+    if restart:
+        threading.Thread(target=restart_server).start()
+    for error in errors:
+        log.error("Deploy: %s", error)
+    return {"status": "restarting" if restart else "reloaded", "errors": errors}
+
 @bp.route("/restart/", methods=["POST"])
 def restart():
     """ Restart the server """
@@ -59,22 +223,23 @@ def restart():
 
 @bp.route("/github-webhook/", methods=["POST"])
 def github_webhook():
-    """ Triggered by the github repo. Pulls the latest changes and restarts the server """
+    """ Triggered by the github repo. Pulls the latest changes and reloads the server (see deploy()) """
     log.info("Github change detected")
     try:
         log.info("Pulling from remote...")
+        before = repo.head.commit
         origin = repo.remotes.origin
         origin.pull()
         repo.submodule_update(init=True, recursive=True)
         log.info("Pull successful")
-        threading.Thread(target=restart_service).start()
-    except subprocess.CalledProcessError as e:
-        log.error("Failed to restart service: %s", e)
-        return {"error": str(e)}, 500
+        git_info.invalidate()
+        changed = {path for diff in before.diff(repo.head.commit) for path in (diff.a_path, diff.b_path) if path}
+        plan = deploy_plan(changed)
     except Exception as e:
         log.error("Failed to pull from remote: %s", e)
         return {"error": str(e)}, 500
-    return {"status": "restarted"}, 200
+    result = deploy(plan)
+    return {**result, **plan}, 500 if result["errors"] else 200
 
 # Not a system endpoint, but I'm lazy
 @bp.route("/evme-github-webhook/", methods=["POST"])
@@ -98,45 +263,65 @@ def evme_github_webhook():
         return {"error": str(e)}, 500
     return {"status": "restarted"}, 200
 
+@bp.route("/healthz/")
+# Without the slash too, since monitors don't always follow the redirect
+@bp.route("/healthz")
+def healthz():
+    """ Just whether we're up, for things that check every few seconds. /info/ is the slow one """
+    return {"status": "ok"}, 200
+
 @bp.route("/info/")
 def info():
-    """ Return information about the server """
+    """ Return information about the server. The slow parts (the package list, git, and asking the
+        reminders runner) are cached, see CachedValue
+    """
     proc = psutil.Process(os.getpid())
     start_time = proc.create_time()
     uptime_seconds = time.time() - start_time
-
-    irregular_reminders_info = {}
-    try:
-        irregular_reminders_info['status'] = requests.get("http://localhost:5050/", timeout=5).json()
-    except Exception as e:
-        irregular_reminders_info['status'] = 'Not running'
-    else:
-        try:
-            irregular_reminders_info['process_info'] = requests.get("http://localhost:5050/scheduler", timeout=5).json()
-        except Exception as e:
-            irregular_reminders_info['process_info'] = f'Failed to get process info: {str(e)}'
-        try:
-            irregular_reminders_info['currently_running_jobs'] = requests.get("http://localhost:5050/scheduler/jobs", timeout=5).json()
-        except Exception as e:
-            irregular_reminders_info['currently_running_jobs'] = f'Failed to get jobs: {str(e)}'
+    disk = psutil.disk_usage("/")
+    commit = git_info.get()
 
     return {
             "status": "ok",
             "server_started": time.strftime("%m-%d-%Y %H:%M:%S", time.localtime(start_time)),
             "uptime_seconds": uptime_seconds,
             "uptime_human": time.strftime("%H:%M:%S", time.localtime(uptime_seconds)),
-            "current_packages": subprocess.check_output([PYTHON_BINARY, "-m", "pip", "freeze"]).decode("utf-8").split("\n") if not current_app.DEBUG else [],
-            "storage_available": str(round(psutil.disk_usage("/").free / 1024 / 1024 / 1024, 2)) + " GB",
-            "storage_total": str(round(psutil.disk_usage("/").total / 1024 / 1024 / 1024, 2)) + " GB",
-            "storage_percent": psutil.disk_usage("/").percent,
+            "current_packages": packages.get(),
+            "storage_available": str(round(disk.free / 1024 / 1024 / 1024, 2)) + " GB",
+            "storage_total": str(round(disk.total / 1024 / 1024 / 1024, 2)) + " GB",
+            "storage_percent": disk.percent,
             "pi_uptime_seconds": time.time() - psutil.boot_time(),
             "pi_uptime_human": time.strftime("%m-%d-%Y %H:%M:%S", time.localtime(time.time() - psutil.boot_time())),
-            "last_commit_msg": repo.head.commit.message,
-            "last_commit_time": time.strftime("%m-%d-%Y %H:%M:%S", time.localtime(repo.head.commit.authored_date)),
-            "last_commit_age": time.strftime("%H:%M:%S", time.localtime(time.time() - repo.head.commit.authored_date)),
-            "irregular_reminders": irregular_reminders_info,
+            "last_commit_msg": commit["last_commit_msg"],
+            "last_commit_time": commit["last_commit_time"],
+            "last_commit_age": time.strftime("%H:%M:%S", time.localtime(time.time() - commit["authored_date"])),
+            "irregular_reminders": runner_info.get(),
         }, 200
 
+@bp.route("/metrics/requests/")
+def request_metrics():
+    """ Latency histograms for every endpoint, over the last hour: total time, time in sqlite, and time
+        waiting on other servers. Each gunicorn worker keeps its own, so this is just the one that answered
+    """
+    return {
+        "pid": os.getpid(),
+        "slow_ms": current_app.request_metrics.slow_ms,
+        "endpoints": current_app.request_metrics.snapshot(),
+    }, 200
+
+@bp.route("/metrics/host/")
+def host_metrics():
+    """ How the pi's been doing over the last ?hours= (1 by default), as an array for each of the
+        fields, oldest first. See rock_server.host_metrics
+    """
+    hours = request.args.get('hours', 1, type=float)
+    return current_app.host_sampler.ring().read(since=time.time() - hours * 3600), 200
+
+@bp.route("/metrics")
+def prometheus_metrics():
+    """ Every worker's counters, gauges and histograms, added up, in the Prometheus text format """
+    return Response(current_app.metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
 @bp.route("/install/<package>", methods=["POST"])
 def install_package(package):
     """ Install a package using pip """
@@ -147,6 +332,9 @@ def install_package(package):
     except Exception as e:
         log.error("Failed to install %s: %s", package, e)
         return {"error": str(e)}, 500
+    finally:
+        # Even if it failed, it might have installed some of it
+        packages.invalidate()
     return {"status": "ok"}, 200
 
 # TODO: move this into it's own project
@@ -175,6 +363,12 @@ def docs():
 # LOGS
 generate_log_endpoints(bp, current_app.LOG_FILE, False)
 generate_log_endpoints(bp, "system.log", True, postfix="/system")
+# All of them at once, to follow something across processes
+generate_merged_log_endpoint(bp, [
+    ("app", current_app.LOG_FILE, False),
+    ("system", "system.log", True),
+    ("runner", REMINDER_RUNNER_LOG, True),
+])
 
 # @bp.get('/logs/')
 # def logs():
@@ -1,13 +1,46 @@
-from functools import wraps
-from flask import request, current_app, Response, stream_with_context, url_for, render_template
+from functools import wraps, lru_cache
+from flask import request, current_app, Response, stream_with_context, url_for, render_template, stream_template
 from time import sleep
+from urllib.parse import urlencode
+import os
+import re
+import gzip
+import struct
+import collections
+import json
+import bisect
+import heapq
+import threading
+import queue
+import select
+import ctypes
+import ctypes.util
 from pydantic import ValidationError
+from rock_server import log_archive
+from rock_server.log_format import REQUEST_FIELDS
 import datetime as dt
 import logging
 
 
 log = current_app.logger
 
+# How much of a log file to read at a time when reading it backwards
+LOG_BLOCK_SIZE = 64 * 1024
+# How many lines to show on one page of logs by default
+LOG_PAGE_SIZE = 500
+# How many lines a stream client can fall behind by before it starts missing the oldest ones
+LOG_STREAM_QUEUE_SIZE = 1000
+# How often to send a comment to idle stream clients, so we notice when they've gone away
+LOG_STREAM_KEEPALIVE_SEC = 15
+# How often the tailer checks the file when inotify isn't available (or misses something)
+LOG_TAIL_POLL_SEC = 0.25
+# The most a reconnecting stream gets sent of what it missed
+LOG_STREAM_BACKFILL_MAX = 1024 * 1024
+# The most of a log file a single search will look through before giving up (it gives a link to carry on)
+LOG_SEARCH_MAX_BYTES = 16 * 1024 * 1024
+# How many rendered lines to remember. A couple pages worth, plus whatever the streams are sending
+LOG_RENDER_CACHE_SIZE = 20_000
+
 def validate_json(schema):
     def decorator(f):
         @wraps(f)
@@ -40,43 +73,69 @@ def pretty_timedelta(td):
         return f"{td.seconds} seconds"
 
 
-def format_line(line, is_system):
+# One precompiled pattern for each kind of line we know how to read. They all have date, time, level
+# and message groups, and the ones with milliseconds have an ms group
+# 2025-09-13 16:55:29,220 - INFO - ...  (app.log's RotatingFileHandler)
+_APP_LOG_LINE = re.compile(r"(?P<date>\d{4}-\d\d-\d\d) (?P<time>\d\d:\d\d:\d\d),(?P<ms>\d{3}) - (?P<level>[A-Z]+) - (?P<message>.*)")
+# [2025-09-13 16:55:29,220] INFO in app: ...  (Flask's default handler, in system.log and the runner's log)
+_FLASK_LINE = re.compile(r"\[(?P<date>\d{4}-\d\d-\d\d) (?P<time>\d\d:\d\d:\d\d),(?P<ms>\d{3})\] (?P<level>[A-Z]+) in (?P<message>.*)")
+# [2025-09-13 16:55:10 -0500] [176625] [INFO] ...  (gunicorn, in system.log and the runner's log)
+_GUNICORN_LINE = re.compile(r"\[(?P<date>\d{4}-\d\d-\d\d) (?P<time>\d\d:\d\d:\d\d) [+-]\d{4}\] \[\d+\] \[(?P<level>[A-Z]+)\] (?P<message>.*)")
+_LINE_FORMATS = {
+    False: (_APP_LOG_LINE,),
+    True: (_FLASK_LINE, _GUNICORN_LINE),
+}
+
+def _split_timestamp(datetime):
+    """ raw_date and raw_time, like they'd be in a text log line """
+    return datetime.strftime('%Y-%m-%d'), f"{datetime.strftime('%H:%M:%S')},{datetime.microsecond // 1000:03}"
+
+def parse_line(line, is_system):
+    """ Split a log line into (datetime, raw_date, raw_time, levelname, message).
+        Raises if it isn't a normal log line (tracebacks, spacers, etc.)
+        Lines written with the JSON log format (see rock_server.log_format) work too.
+    """
+    if line.startswith('{'):
+        record = json.loads(line)
+        datetime = dt.datetime.fromtimestamp(record['ts'])
+        return datetime, *_split_timestamp(datetime), record['level'], record['msg']
+
+    for pattern in _LINE_FORMATS[is_system]:
+        if (match := pattern.match(line)):
+            break
+    else:
+        raise ValueError(f"Not a log line: {line!r}")
+    raw_date, raw_time, levelname, message = match['date'], match['time'], match['level'], match['message']
+    # fromisoformat is a lot faster than strptime
+    if (ms := match.groupdict().get('ms')):
+        datetime = dt.datetime.fromisoformat(f"{raw_date} {raw_time}.{ms}")
+        raw_time = f"{raw_time},{ms}"
+    else:
+        datetime = dt.datetime.fromisoformat(f"{raw_date} {raw_time}")
+    return datetime, raw_date, raw_time, levelname, message
+
+
+# Colored levelnames, all the same width
+LEVEL_HTML = {
+    "DEBUG": "<span style='color: gray;'>DEBUG  </span>",
+    "INFO": "<span style='color: blue;'>INFO   </span>",
+    "WARNING": "<span style='color: orange;'>WARNING</span>",
+    "ERROR": "<span style='color: red;'>ERROR  </span>",
+}
+
+@lru_cache(maxsize=LOG_RENDER_CACHE_SIZE)
+def _render_line(line, is_system):
+    """ Everything about how a line gets shown, except how long ago it was (which keeps changing):
+        (levelno, datetime, html before the "ago", html after it), or None if it can't be parsed.
+        It's cached by the line itself, so re-rendering a page, or sending the same line to every
+        stream, doesn't parse anything again.
+    """
+    if line.startswith('{'):
+        return _render_json_line(line)
     try:
-        # [2025-09-13 16:55:29,220] ...
-        # [2025-09-13 16:55:10 -0500] [176625] [INFO] ...
-        parts = line.split(' ')
-        if is_system:
-            raw_date = parts[0][1:]
-            if parts[2].startswith('-'):
-                parts.pop(2)
-                # Also pop the 3rd element, which is now the 2nd element
-                parts.pop(2)
-                raw_time = parts[1]
-                levelname = parts[2].strip('[]')
-                datetime = dt.datetime.strptime(f"{raw_date} {raw_time}", "%Y-%m-%d %H:%M:%S")
-            else:
-                levelname = parts[2]
-                raw_time = parts[1][:-1]
-            message = ' '.join(parts[4:])
-            datetime = dt.datetime.strptime(f"{raw_date} {raw_time}", "%Y-%m-%d %H:%M:%S,%f")
-        else:
-            raw_date = parts[0]
-            raw_time = parts[1]
-            levelname = parts[3]
-            message = ' '.join(parts[5:])
-            datetime = dt.datetime.strptime(f"{raw_date} {raw_time}", "%Y-%m-%d %H:%M:%S,%f")
-        ago = dt.datetime.now() - datetime
+        datetime, raw_date, raw_time, levelname, message = parse_line(line, is_system)
     except Exception:
-        return f"<pre>{line}</pre>"
-    # Color the levelname
-    if levelname == "DEBUG":
-        levelname = "<span style='color: gray;'>DEBUG  </span>"
-    elif levelname == "INFO":
-        levelname = "<span style='color: blue;'>INFO   </span>"
-    elif levelname == "WARNING":
-        levelname = "<span style='color: orange;'>WARNING</span>"
-    elif levelname == "ERROR":
-        levelname = "<span style='color: red;'>ERROR  </span>"
+        return None
 
     if message.startswith("Request") or message.startswith("Response"):
         message = message.replace("http://localhost:5000", "", 1)
@@ -86,31 +145,827 @@ def format_line(line, is_system):
         message = message.replace("->", "<span style='font-weight: bold'>-></span>", 1)
         message = message.replace("200 OK", "<span style='color: green'>200 OK</span>", 1)
 
+    return (
+        logging._nameToLevel.get(levelname, 100),
+        datetime,
+        f"<span style='color: #dedede;'>{raw_date} {raw_time}</span>",
+        f"{LEVEL_HTML.get(levelname, levelname)} : {message}",
+    )
+
+
+def _render_json_line(line):
+    """ _render_line() for a line in the JSON log format. Everything's already split out, so there's
+        nothing to dig out of the message
+    """
+    try:
+        record = json.loads(line)
+        datetime = dt.datetime.fromtimestamp(record['ts'])
+        levelname = record['level']
+        message = record['msg']
+    except Exception:
+        return None
+
+    if 'status' in record:
+        status = record['status']
+        color = 'green' if status < 400 else 'orange' if status < 500 else 'red'
+        message = (f"<span style='font-weight: bold'>🔼 Response</span>: {record.get('method')} {record.get('path')} "
+            f"<span style='font-weight: bold'>-></span> <span style='color: {color}'>{status}</span>")
+        if 'duration_ms' in record:
+            message += f" in {record['duration_ms']} ms"
+            if record.get('db_ms') or record.get('http_ms'):
+                message += f" (db {record.get('db_ms', 0)} ms, http {record.get('http_ms', 0)} ms)"
+    elif 'method' in record:
+        message = f"<span style='font-weight: bold'>⬇️  Request</span>: {record['method']} {record.get('path')}"
+    if 'exc' in record:
+        message += f"<pre>{record['exc']}</pre>"
+
+    raw_date, raw_time = _split_timestamp(datetime)
+    return (
+        record.get('levelno', logging._nameToLevel.get(levelname, 100)),
+        datetime,
+        f"<span style='color: #dedede;'>{raw_date} {raw_time}</span>",
+        f"{LEVEL_HTML.get(levelname, levelname)} : {message}",
+    )
+
+
+@lru_cache(maxsize=LOG_RENDER_CACHE_SIZE)
+def _line_record(line, is_system):
+    """ The parts of a line the JSON log API sends: ts (epoch seconds), level, levelno and msg, plus the
+        request fields and exc for JSON lines. Lines we can't parse (tracebacks, spacers, etc.) just have
+        the whole line as msg, and no ts or level. Cached like _render_line(), so don't change what it gives
+    """
+    if line.startswith('{'):
+        try:
+            record = json.loads(line)
+            return {
+                'ts': record['ts'],
+                'level': record['level'],
+                'levelno': record.get('levelno', logging._nameToLevel.get(record['level'], 100)),
+                'msg': record['msg'],
+                **{field: record[field] for field in (*REQUEST_FIELDS, 'exc') if field in record},
+            }
+        except Exception:
+            pass
+    else:
+        try:
+            datetime, _, _, levelname, message = parse_line(line, is_system)
+            return {'ts': datetime.timestamp(), 'level': levelname,
+                'levelno': logging._nameToLevel.get(levelname, 100), 'msg': message}
+        except Exception:
+            pass
+    return {'ts': None, 'level': None, 'levelno': 100, 'msg': line}
+
+def line_record(offset, line, is_system):
+    """ A line as a dict for the JSON log API (see _line_record()), with where it is in the file """
+    return {'offset': offset, **_line_record(line, is_system)}
+
+
+def line_level(line, is_system):
+    """ The numeric level of a log line. Lines we can't parse (tracebacks, spacers, etc.) always get shown """
+    rendered = _render_line(line, is_system)
+    return 100 if rendered is None else rendered[0]
+
+
+def format_line(line, is_system):
+    rendered = _render_line(line, is_system)
+    if rendered is None:
+        return f"<pre>{line}</pre>"
+    _, datetime, when, rest = rendered
+    return f"{when} {pretty_timedelta(dt.datetime.now() - datetime)} ago {rest}"
+
+
+def read_lines_reversed(log_file, before=None, block_size=LOG_BLOCK_SIZE):
+    """ Yields (offset, line) pairs from a file, newest (last) line first, reading fixed-size blocks
+        backwards from the end, so we never have to load the whole file.
+        offset is the byte offset where the line starts. If before is given, it starts with the line
+        that ends right before that offset (so passing the offset of the last line you got gives you
+        the next page). Empty lines are skipped.
+    """
+    with open(log_file, 'rb') as f:
+        size = f.seek(0, 2)
+        pos = size if before is None else max(0, min(before, size))
+        # The start of a line that began in a block we haven't read yet
+        leftover = b''
+        while pos > 0:
+            read = min(block_size, pos)
+            pos -= read
+            f.seek(pos)
+            pieces = (f.read(read) + leftover).split(b'\n')
+            # The first piece might not be a whole line, unless we're at the start of the file
+            leftover = pieces.pop(0) if pos > 0 else b''
+            start = pos + len(leftover) + 1 if pos > 0 else 0
+            starts = []
+            for piece in pieces:
+                starts.append(start)
+                start += len(piece) + 1
+            for start, piece in zip(reversed(starts), reversed(pieces)):
+                if piece:
+                    yield start, piece.decode('utf-8', errors='replace')
+
+
+def read_entries_reversed(log_file, is_system, before=None):
+    """ Like read_lines_reversed(), but yields (datetime, offset, lines) for each entry: a line with a
+        timestamp, and the lines after it that don't have one (tracebacks, spacers, etc.), in order.
+        Anything before the first timestamp in the file gets datetime.min.
+    """
+    # Going backwards, the lines without a timestamp come before the one they go with
+    extra = []
+    for offset, line in read_lines_reversed(log_file, before):
+        rendered = _render_line(line, is_system)
+        if rendered is None:
+            extra.append(line)
+            continue
+        yield rendered[1], offset, [line, *reversed(extra)]
+        extra = []
+    if extra:
+        yield dt.datetime.min, 0, extra[::-1]
+
+def _tag_entries(name, log_file, is_system, before):
+    for when, offset, lines in read_entries_reversed(log_file, is_system, before):
+        yield when, name, offset, lines
+
+def merge_logs(sources, before=None):
+    """ Merges several logs into one timeline, newest first, the same way read_lines_reversed() reads
+        one: it only ever has one entry from each log in memory at a time.
+        sources is [(name, log file, is_system), ...], and before is {name: offset}, for where to start
+        in each one. Yields (datetime, name, offset, lines) for each entry (see read_entries_reversed()).
+    """
+    before = before or {}
+    return heapq.merge(*(
+        _tag_entries(name, log_file, is_system, before.get(name))
+        for name, log_file, is_system in sources if os.path.exists(log_file)
+    ), key=lambda entry: entry[0], reverse=True)
+
 
-    preamble = f"<span style='color: #dedede;'>{raw_date} {raw_time}</span> {pretty_timedelta(ago)} ago {levelname} "
-    return f"{preamble}: {message}"
+def read_lines_at(log_file, offsets):
+    """ Yields (offset, line) pairs for the lines starting at each of the given offsets """
+    with open(log_file, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            yield offset, f.readline().rstrip(b'\n').decode('utf-8', errors='replace')
 
 
-def format_logs(lines, threshold, is_system):
-    """ Format the logs """
+class LogIndex:
+    """ A sidecar index for a log file, saved next to it as <log_file>.idx.
+        It records the byte offset of every line by level, and the offset of the first line of every
+        minute, so filtered views can jump straight to the lines they want instead of parsing the
+        whole file. It's updated incrementally (only what's been written since last time gets
+        scanned), and rebuilt from scratch if the file gets rotated or cleared.
+
+        The .idx file is append only: a header line ({"inode", "head"}), then a line for each update
+        with just the offsets it found ({"inode", "from", "to", "levels", "minutes"}), so saving costs
+        as much as what changed, not the whole index. Every worker appends its own, so the same bit of
+        the log can be in there more than once. Loading only takes the ones that carry on from
+        where the last one stopped.
+    """
+    # How much of the start of the file we remember, to notice it's been replaced
+    HEAD_SIZE = 64
+    # Past this many updates, loading it writes it back out as one
+    MAX_CHUNKS = 1000
+
+    def __init__(self, log_file, is_system):
+        self.log_file = log_file
+        self.is_system = is_system
+        self.index_file = f"{log_file}.idx"
+        self.lock = threading.Lock()
+        self._reset()
+        try:
+            self._load()
+        except Exception:
+            # Missing or broken, either way we'll just build a new one
+            self._reset()
+
+    def _reset(self, inode=None):
+        self.inode = inode
+        self.head = b''
+        self.scanned_to = 0
+        # {levelno: [offsets]}. Lines we can't parse are under 100, like line_level()
+        self.levels = {}
+        # [[minute since the epoch, offset of the first line in it], ...], in order
+        self.minutes = []
+
+    def _load(self):
+        with open(self.index_file, 'r') as f:
+            header = json.loads(f.readline())
+            self.inode = header['inode']
+            self.head = bytes.fromhex(header['head'])
+            chunks = 0
+            for line in f:
+                try:
+                    chunk = json.loads(line)
+                except ValueError:
+                    # Half written
+                    continue
+                # Another worker's already added this bit, or it's from before the log got rotated
+                if chunk['inode'] != self.inode or chunk['from'] != self.scanned_to:
+                    continue
+                self._apply(chunk)
+                chunks += 1
+        if chunks > self.MAX_CHUNKS:
+            self._save()
+
+    def _apply(self, chunk):
+        for level, offsets in chunk['levels'].items():
+            self.levels.setdefault(int(level), []).extend(offsets)
+        self.minutes.extend(chunk['minutes'])
+        self.scanned_to = chunk['to']
+        if 'head' in chunk:
+            self.head = bytes.fromhex(chunk['head'])
+
+    def _save(self):
+        """ Write out the whole thing, as a header and one chunk """
+        tmp = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({'inode': self.inode, 'head': self.head.hex()}) + '\n')
+            if self.scanned_to:
+                f.write(json.dumps({'inode': self.inode, 'from': 0, 'to': self.scanned_to,
+                    'levels': self.levels, 'minutes': self.minutes, 'head': self.head.hex()}) + '\n')
+        # Other workers might be reading it
+        os.replace(tmp, self.index_file)
+
+    def _append(self, chunk):
+        # One write, so lines from different workers don't get mixed up
+        with open(self.index_file, 'a') as f:
+            f.write(json.dumps(chunk) + '\n')
+
+    def update(self):
+        """ Index anything that's been written since last time """
+        with self.lock, open(self.log_file, 'rb') as f:
+            inode = os.fstat(f.fileno()).st_ino
+            size = f.seek(0, 2)
+            f.seek(0)
+            # It's been rotated, or cleared
+            reset = inode != self.inode or size < self.scanned_to or f.read(len(self.head)) != self.head
+            if reset:
+                self._reset(inode)
+            if size == self.scanned_to:
+                if reset:
+                    self._save()
+                return
+
+            f.seek(self.scanned_to)
+            data = f.read(size - self.scanned_to)
+            # Only index whole lines, the rest gets picked up next time
+            end = data.rfind(b'\n') + 1
+            if not end:
+                if reset:
+                    self._save()
+                return
+            offset = self.scanned_to
+            levels = {}
+            minutes = []
+            last_minute = self.minutes[-1][0] if self.minutes else None
+            for raw in data[:end].split(b'\n')[:-1]:
+                if raw:
+                    try:
+                        datetime, _, _, levelname, _ = parse_line(raw.decode('utf-8', errors='replace'), self.is_system)
+                        level = logging._nameToLevel.get(levelname, 100)
+                        minute = int(datetime.timestamp() // 60)
+                        # Logs from different processes can be a little out of order
+                        if last_minute is None or minute > last_minute:
+                            minutes.append([minute, offset])
+                            last_minute = minute
+                    except Exception:
+                        level = 100
+                    levels.setdefault(level, []).append(offset)
+                offset += len(raw) + 1
+            chunk = {'inode': inode, 'from': self.scanned_to, 'to': self.scanned_to + end, 'levels': levels, 'minutes': minutes}
+
+            if len(self.head) < self.HEAD_SIZE:
+                f.seek(0)
+                chunk['head'] = f.read(min(self.HEAD_SIZE, self.scanned_to + end)).hex()
+            self._apply(chunk)
+            if reset:
+                self._save()
+            else:
+                self._append(chunk)
+
+    def offsets(self, threshold=0, since=None, until=None, before=None):
+        """ The offsets of the lines at or above threshold, between the since and until datetimes, and
+            starting before the before offset, newest first. The time range is rounded out to the minute.
+        """
+        self.update()
+        with self.lock:
+            lo, hi = 0, self.scanned_to
+            if since is not None:
+                i = bisect.bisect_left(self.minutes, [int(since.timestamp() // 60), -1])
+                lo = self.minutes[i][1] if i < len(self.minutes) else self.scanned_to
+            if until is not None:
+                i = bisect.bisect_right(self.minutes, [int(until.timestamp() // 60), self.scanned_to])
+                hi = self.minutes[i][1] if i < len(self.minutes) else self.scanned_to
+            if before is not None:
+                hi = min(hi, before)
+
+            matching = []
+            for level, offsets in self.levels.items():
+                if level >= threshold:
+                    matching.append(offsets[bisect.bisect_left(offsets, lo):bisect.bisect_left(offsets, hi)])
+        return heapq.merge(*[reversed(offsets) for offsets in matching], reverse=True)
+
+# One per log file, per process
+_log_indexes = {}
+
+def get_log_index(log_file, is_system):
+    if log_file not in _log_indexes:
+        _log_indexes[log_file] = LogIndex(log_file, is_system)
+    return _log_indexes[log_file]
+
+
+# inotify, if we can get it. It's Linux only, and there's no stdlib wrapper for it
+_IN_MODIFY = 0x002
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.inotify_init1
+except (OSError, AttributeError):
+    _libc = None
+
+def _inotify_watch(directory):
+    """ A non-blocking inotify fd watching directory for files being written, created, or moved in,
+        or None if inotify isn't available
+    """
+    if _libc is None:
+        return None
+    fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+    if _libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class LogTailer:
+    """ Follows a log file, and hands every new line to everyone subscribed to it.
+        There's one per log file (per process), so it doesn't matter how many streams are open, the
+        file only gets read once. It's woken up by inotify on the file's directory (the whole
+        directory, so it notices the file being rotated or recreated), and falls back to polling
+        every LOG_TAIL_POLL_SEC if inotify isn't available.
+        Each subscriber gets a bounded queue of (inode, offset, line) tuples, the inode being the file's
+        at the time, so a rotated file's offsets can't be mistaken for the new one's. If one falls too
+        far behind, its oldest lines get dropped, instead of holding up everyone else or eating all the memory.
+        The thread only runs while there's someone subscribed.
+    """
+    def __init__(self, log_file, queue_size=LOG_STREAM_QUEUE_SIZE, use_inotify=True):
+        self.log_file = log_file
+        self.queue_size = queue_size
+        self.use_inotify = use_inotify
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self):
+        """ A new queue, which gets every line written from now on """
+        q = queue.Queue(self.queue_size)
+        with self.lock:
+            self.subscribers.add(q)
+            if self.thread is None:
+                self._ready = threading.Event()
+                self.thread = threading.Thread(target=self._run, args=(self._ready,), daemon=True, name=f"tail {self.log_file}")
+                self.thread.start()
+            ready = self._ready
+        # Wait until it's found the end of the file, so lines written right after this returns don't get missed
+        ready.wait()
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def _broadcast(self, inode, offset, line):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            while True:
+                try:
+                    q.put_nowait((inode, offset, line))
+                    break
+                except queue.Full:
+                    # They're too slow, drop their oldest line to make room
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _open(self, from_start):
+        f = open(self.log_file, 'rb')
+        if not from_start:
+            f.seek(0, 2)
+        return f
+
+    def _run(self, ready):
+        fd = _inotify_watch(os.path.dirname(os.path.abspath(self.log_file))) if self.use_inotify else None
+        f = None
+        try:
+            try:
+                f = self._open(from_start=False)
+            except FileNotFoundError:
+                pass
+            ready.set()
+            # The start of a line that hasn't been finished yet
+            partial = b''
+            while True:
+                with self.lock:
+                    if not self.subscribers:
+                        self.thread = None
+                        return
+
+                if fd is None:
+                    sleep(LOG_TAIL_POLL_SEC)
+                # Wake up once in a while regardless, in case we missed an event (or it was a
+                # different file in the directory, and we need to check if anyone's still listening)
+                elif select.select([fd], [], [], 1)[0]:
+                    try:
+                        while os.read(fd, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+
+                try:
+                    stat = os.stat(self.log_file)
+                except FileNotFoundError:
+                    continue
+                if f is None:
+                    f = self._open(from_start=True)
+                # It's been rotated or cleared, so everything in it is new
+                elif stat.st_ino != os.fstat(f.fileno()).st_ino or stat.st_size < f.tell():
+                    f.close()
+                    f = self._open(from_start=True)
+                    partial = b''
+
+                inode = os.fstat(f.fileno()).st_ino
+                offset = f.tell() - len(partial)
+                data = partial + f.read()
+                lines = data.split(b'\n')
+                partial = lines.pop()
+                for line in lines:
+                    if line:
+                        self._broadcast(inode, offset, line.decode('utf-8', errors='replace'))
+                    offset += len(line) + 1
+        finally:
+            ready.set()
+            if f is not None:
+                f.close()
+            if fd is not None:
+                os.close(fd)
+
+# One per log file, per process
+_log_tailers = {}
+_log_tailers_lock = threading.Lock()
+
+def get_log_tailer(log_file):
+    with _log_tailers_lock:
+        if log_file not in _log_tailers:
+            _log_tailers[log_file] = LogTailer(log_file)
+        return _log_tailers[log_file]
+
+
+def _first_timed_line(f, pos, is_system):
+    """ (offset, datetime) of the first line that starts at or after pos and has a timestamp, or None """
+    f.seek(max(pos - 1, 0))
+    # Finish the line pos is in the middle of. If pos is the start of a line, this just eats the \n before it
+    if pos:
+        f.readline()
+    while (raw := f.readline()):
+        try:
+            return f.tell() - len(raw), parse_line(raw.rstrip(b'\n').decode('utf-8', errors='replace'), is_system)[0]
+        except Exception:
+            pass
+    return None
+
+def find_time(log_file, when, is_system, after=False):
+    """ The offset of the first line logged at when or later (or after when, if after is True), found by
+        binary searching the file, since lines get written in order. Lines without timestamps (like
+        tracebacks) go with the line before them. Gives back the file size if there isn't one.
+    """
+    reached = (lambda time: time > when) if after else (lambda time: time >= when)
+    with open(log_file, 'rb') as f:
+        size = f.seek(0, 2)
+        # The line we want starts somewhere in [lo, hi]
+        lo, hi = 0, size
+        while hi - lo > LOG_BLOCK_SIZE:
+            mid = (lo + hi) // 2
+            found = _first_timed_line(f, mid, is_system)
+            if found is None or reached(found[1]):
+                hi = mid
+            else:
+                lo = found[0] + 1
+        # Close enough, just look through what's left
+        pos = lo
+        while (found := _first_timed_line(f, pos, is_system)) is not None:
+            if reached(found[1]):
+                return found[0]
+            pos = found[0] + 1
+        return size
+
+def search_lines(log_file, pattern, start=0, end=None, max_bytes=LOG_SEARCH_MAX_BYTES, page=None):
+    """ Yields the (offset, line)s that pattern (a compiled regex) matches, between the start and end
+        offsets, newest first. It gives up after looking through max_bytes, and if page is given,
+        page['before'] gets set to where to carry on from, and page['truncated'] to True.
+    """
+    page = page if page is not None else {}
+    page.setdefault('scanned', 0)
+    last_offset = end
+    for offset, line in read_lines_reversed(log_file, end):
+        if offset < start:
+            return
+        page['scanned'] += len(line) + 1
+        if page['scanned'] > max_bytes:
+            page['before'] = last_offset
+            page['truncated'] = True
+            return
+        last_offset = offset
+        if pattern.search(line):
+            yield offset, line
+
+
+def read_archive_lines(path):
+    """ Yields (offset, line) for every line in a gzipped archive, oldest first, decompressing as it goes.
+        offset is where the line starts in the decompressed log
+    """
+    with gzip.open(path, 'rb') as f:
+        offset = 0
+        for raw in f:
+            line = raw.rstrip(b'\n')
+            if line:
+                yield offset, line.decode('utf-8', errors='replace')
+            offset += len(raw)
+
+def archive_size(path):
+    """ How big an archive is decompressed, without decompressing it (gzip keeps it at the end, mod 4GB) """
+    with open(path, 'rb') as f:
+        f.seek(-4, 2)
+        return struct.unpack('<I', f.read(4))[0]
+
+def read_archive_lines_reversed(path, before=None, keep=None, count=LOG_PAGE_SIZE):
+    """ Like read_lines_reversed(), for an archive: (offset, line)s, newest first, starting before the
+        before offset. Since gzip can only be read from the start, it goes through the whole thing, and
+        only remembers the newest count lines that keep(line) says to keep (all of them, if there's no
+        keep). Asking for the next page (before= the last offset you got) picks up where it left off.
+    """
+    kept = collections.deque(maxlen=count + 1)
+    for offset, line in read_archive_lines(path):
+        if before is not None and offset >= before:
+            break
+        if keep is None or keep(line):
+            kept.append((offset, line))
+    return reversed(kept)
+
+def parse_archive_cursor(cursor):
+    """ "<archive name>:<offset>" (see search_archives()) as (name, offset), with None if the offset is
+        empty. Raises ValueError if it isn't one
+    """
+    name, colon, before = cursor.partition(':')
+    if not colon or not name:
+        raise ValueError(f"Not an archive cursor: {cursor}")
+    return name, int(before) if before else None
+
+def search_archives(log_file, pattern, is_system, threshold=0, since=None, until=None, cursor=None,
+    count=LOG_PAGE_SIZE, max_bytes=LOG_SEARCH_MAX_BYTES, page=None):
+    """ search_lines(), through log_file's archives (see rock_server.log_archive), newest first.
+        Offsets are "<archive name>:<offset>", so they can be passed back as cursor to carry on from
+        there. Archives that are entirely outside since and until are skipped without being opened.
+        Since archives can't be read backwards, it goes through a whole one at a time: if the next one
+        would go over max_bytes, it stops before it (unless it's the first one).
+        The level (threshold) gets checked here too, so a page of matches is a page of lines to show.
+    """
+    page = page if page is not None else {}
+    page.setdefault('scanned', 0)
+    start_name, start_before = parse_archive_cursor(cursor) if cursor else (None, None)
+    found = log_archive.archives(log_file)
+    for i, (path, ends) in enumerate(found):
+        name = os.path.basename(path)
+        if start_name:
+            if name != start_name:
+                continue
+            # Found where we left off
+            start_name = None
+            before = start_before
+        else:
+            before = None
+        # They're newest first, so they all end before this
+        if since and ends < since:
+            return
+        starts = found[i + 1][1] if i + 1 < len(found) else None
+        if until and starts and starts > until:
+            continue
+
+        size = before if before is not None else archive_size(path)
+        if page['scanned'] and page['scanned'] + size > max_bytes:
+            page['before'] = f"{name}:{before if before is not None else ''}"
+            page['truncated'] = True
+            return
+        page['scanned'] += size
+
+        # Lines without times go with the line before them
+        last_time = starts
+        def keep(line):
+            nonlocal last_time
+            if since or until:
+                try:
+                    last_time = parse_line(line, is_system)[0]
+                except Exception:
+                    pass
+                if last_time and ((since and last_time < since) or (until and last_time > until)):
+                    return False
+            return line_level(line, is_system) >= threshold and bool(pattern.search(line))
+
+        for offset, line in read_archive_lines_reversed(path, before, keep, count):
+            yield f"{name}:{offset}", line
+
+
+def parse_event_id(event_id):
+    """ A stream event's id is "inode:offset", of the line it carried. Gives back (inode, offset), or
+        None if there isn't one (or it's garbage)
+    """
+    try:
+        inode, offset = event_id.split(':')
+        return int(inode), int(offset)
+    except (AttributeError, ValueError):
+        return None
+
+def format_event(inode, offset, line, is_system, as_json=False):
+    """ A line of the log as an SSE event, with an id a reconnecting client can pick back up from.
+        The data is the line as html, or as a line_record() if as_json
+    """
+    data = json.dumps(line_record(offset, line, is_system)) if as_json else format_line(line, is_system)
+    return f"id: {inode}:{offset}\ndata: {data}\n\n"
+
+def read_missed_lines(log_file, last_event_id, max_bytes=LOG_STREAM_BACKFILL_MAX):
+    """ Yields the (inode, offset, line)s a reconnecting stream missed, starting with the line after
+        the one last_event_id ((inode, offset), from parse_event_id()) points to.
+        If the file's been rotated since, whatever's left of the old one comes first (if it's still
+        around as <log_file>.1, like RotatingFileHandler leaves it), then all of the new one. If it's
+        been cleared, it starts over from the beginning. It won't go back more than max_bytes in a
+        file, and it stops at a line that's still being written, since the tailer will get that one.
+    """
+    inode, offset = last_event_id
+    try:
+        current = os.stat(log_file)
+    except FileNotFoundError:
+        return
+    if current.st_ino == inode:
+        sources = [(log_file, offset, True)]
+    else:
+        sources = [(log_file, 0, False)]
+        try:
+            if os.stat(f"{log_file}.1").st_ino == inode:
+                sources.insert(0, (f"{log_file}.1", offset, True))
+        except FileNotFoundError:
+            pass
+
+    for path, start, skip_first in sources:
+        with open(path, 'rb') as f:
+            size = f.seek(0, 2)
+            if start > size:
+                # It's been cleared since
+                start, skip_first = 0, False
+            if size - start > max_bytes:
+                # We'll probably land in the middle of a line
+                start, skip_first = size - max_bytes, True
+            f.seek(start)
+            file_inode = os.fstat(f.fileno()).st_ino
+            if skip_first:
+                start += len(f.readline())
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                if raw.strip():
+                    yield file_inode, start, raw.rstrip(b'\n').decode('utf-8', errors='replace')
+                start += len(raw)
+
+
+def format_logs(lines, threshold, is_system, limit=None, page=None):
+    """ Format the logs
+        lines should be (offset, line) pairs, newest first (like read_lines_reversed() gives).
+        Stops after limit lines. If page is given, page['before'] gets set to the offset to pass to
+        read_lines_reversed() to get the next page, or None if there isn't one.
+    """
     spacer_count = 0
-    for line in reversed(lines):
+    shown = 0
+    last_offset = None
+    if page is not None:
+        page['before'] = None
+    for offset, line in lines:
+        if limit is not None and shown >= limit:
+            if page is not None:
+                # The next page starts with this line, which is the one right before the last one we looked at
+                page['before'] = last_offset
+            return
+        last_offset = offset
         try:
             parts = line.split(' ')
             # It's a spacer
             if len(parts) == 1:
                 spacer_count += 1
+                shown += 1
                 yield line + f"<span style='color: #dedede;'>Spacer #{spacer_count}</span>"
                 continue
-            levelname = parts[3]
-            if logging._nameToLevel.get(levelname, 100) >= threshold:
+            if line_level(line, is_system) >= threshold:
+                shown += 1
                 yield format_line(line, is_system)
         except Exception as err:
             # continue  # skip malformed lines
             # log.error("Failed to format log line: %s", line)
+            shown += 1
             yield f"Error parsing line: {str(err)}\t{line}"#<br/><pre>{traceback.format_exc().replace('\n', '<br/>')}</pre>"
 
 
+def format_cursor(before):
+    """ {name: offset} -> "name:offset,name:offset", for merged log pages """
+    return ','.join(f"{name}:{offset}" for name, offset in before.items())
+
+def parse_cursor(cursor):
+    """ The opposite of format_cursor(). Raises ValueError if it's not one """
+    if not cursor:
+        return {}
+    return {name: int(offset) for name, offset in (part.rsplit(':', 1) for part in cursor.split(','))}
+
+def generate_merged_log_endpoint(app, sources, postfix='/merged'):
+    """ A page that shows several logs at once, merged by time, so you can see what happened across
+        processes. sources is [(name, log file, is_system), ...]
+    """
+    is_system = {name: system for name, _, system in sources}
+
+    @app.get(f'/logs{postfix}/<level>/')
+    def get_merged_logs(level):
+        """ One page of all the logs, newest first, each line tagged with the log it came from. ?limit=
+            works like the normal log pages, and ?before= is where each log is up to, like
+            "app:1234,system:5678" (the "Older" link fills it in)
+        """
+        level = level.upper()
+        if level not in logging._nameToLevel:
+            return f'Invalid level: {level}', 400
+        threshold = logging._nameToLevel[level]
+        try:
+            limit = limit_arg()
+        except ValueError as err:
+            return str(err), 400
+        try:
+            before = parse_cursor(request.args.get('before', ''))
+        except ValueError:
+            return f"Invalid cursor: {request.args['before']}", 400
+        # Pin the ones we haven't started on yet to where they are now, so lines written in the
+        # meantime don't show up in the middle of the next page
+        for name, log_file, _ in sources:
+            if name not in before and os.path.exists(log_file):
+                before[name] = os.path.getsize(log_file)
+        page = {'before': None}
+
+        def lines():
+            cursor = dict(before)
+            shown = 0
+            for _, name, offset, entry in merge_logs(sources, before):
+                if shown >= limit:
+                    page['before'] = format_cursor(cursor)
+                    return
+                cursor[name] = offset
+                if line_level(entry[0], is_system[name]) < threshold:
+                    continue
+                shown += 1
+                yield f"<span style='color: gray;'>[{name}]</span> " + \
+                    "<br/>".join(format_line(line, is_system[name]) for line in entry)
+
+        return Response(stream_template('logs_merged_template.html',
+            logs=lines(),
+            page=page,
+            limit=limit,
+            names=[name for name, _, _ in sources],
+        ), mimetype='text/html')
+    get_merged_logs.__name__ = f"get_{postfix}_logs"
+
+    return get_merged_logs
+
+
+def limit_arg():
+    """ ?limit= (the page size), or LOG_PAGE_SIZE if it's not there. Raises ValueError if it isn't a
+        whole number that's at least 1
+    """
+    limit = request.args.get('limit', LOG_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError(f"Invalid limit: {limit}") from None
+    if limit < 1:
+        raise ValueError(f"Invalid limit: {limit}, it has to be at least 1")
+    return limit
+
+def time_range_args():
+    """ ?from= and ?to= as naive local datetimes, like the logs' timestamps (None if they're not there).
+        Ones with a timezone get converted. Raises ValueError if either isn't an ISO time
+        (request.args.get(type=) would just quietly ignore it)
+    """
+    times = []
+    for name in ('from', 'to'):
+        when = dt.datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+        if when is not None and when.tzinfo is not None:
+            when = when.astimezone().replace(tzinfo=None)
+        times.append(when)
+    return tuple(times)
+
 def generate_log_endpoints(app, log_file, is_system, postfix=''):
     """ Generate endpoints for logging.
         postfix should start with a / and not end with one
@@ -131,41 +986,284 @@ def generate_log_endpoints(app, log_file, is_system, postfix=''):
 
     @app.get(f"/logs{postfix}/stream/")
     def stream_logs():
+        # EventSource sends this when it reconnects. The page gives it as ?last_event_id= the first time
+        last_event_id = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+        # ?format=json sends line_record()s instead of html
+        as_json = request.args.get('format') == 'json'
         def generate():
-            with open(log_file, 'r') as f:
-                f.seek(0, 2)  # move to end of file
+            # Subscribe before catching up, so nothing falls in between
+            lines = get_log_tailer(log_file).subscribe()
+            try:
+                # Get the headers out now, instead of whenever the next line gets logged
+                yield ": connected\n\n"
+                caught_up = None
+                if last_event_id:
+                    for inode, offset, line in read_missed_lines(log_file, last_event_id):
+                        caught_up = (inode, offset)
+                        yield format_event(inode, offset, line, is_system, as_json)
                 while True:
-                    line = f.readline()
-                    if line:
-                        yield f"data: {format_line(line, is_system)}\n\n"
-                    else:
-                        sleep(0.25)  # don’t busy loop
+                    try:
+                        inode, offset, line = lines.get(timeout=LOG_STREAM_KEEPALIVE_SEC)
+                    except queue.Empty:
+                        # An SSE comment. If they've gone away, this is what notices
+                        yield ": keepalive\n\n"
+                        continue
+                    # Already sent it while catching up
+                    if caught_up and inode == caught_up[0] and offset <= caught_up[1]:
+                        continue
+                    yield format_event(inode, offset, line, is_system, as_json)
+            finally:
+                # Closing the connection closes the generator
+                get_log_tailer(log_file).unsubscribe(lines)
         return Response(stream_with_context(generate()), mimetype="text/event-stream")
     stream_logs.__name__ = f"stream_{postfix}_logs"
 
+    def stream_endpoint(last_event_id=None, as_json=False):
+        """ Where the page should get its live stream from: log_streamer, if LOG_STREAM_URL is set and
+            it serves this log at the same path, and stream_logs otherwise. last_event_id is where the
+            stream should start from, if not the end of the file
+        """
+        # It imports us, so it can't be imported at the top
+        from .log_streamer import STREAMS
+        url = url_for(f"{app.name}.stream_{postfix}_logs")
+        base = current_app.config.get('LOG_STREAM_URL')
+        if base and url in STREAMS and os.path.abspath(STREAMS[url][0]) == os.path.abspath(log_file):
+            url = base.rstrip('/') + url
+        args = {}
+        if last_event_id:
+            args['last_event_id'] = last_event_id
+        if as_json:
+            args['format'] = 'json'
+        if args:
+            url += '?' + urlencode(args)
+        return url
+
+    def newest_event_id():
+        """ The event id of the last line in the file, so a stream can start right after it """
+        if os.path.exists(log_file) and (newest := next(read_lines_reversed(log_file), None)):
+            return f"{os.stat(log_file).st_ino}:{newest[0]}"
+        return None
+
+    def select_lines(threshold, before, since, until):
+        """ The (offset, line)s for a page of logs, newest first, and the level they still need to be
+            filtered by (0 if they already have been)
+        """
+        if threshold > logging.DEBUG or since or until:
+            # The index knows exactly which lines we want, so we don't have to look at the rest
+            return read_lines_at(log_file, get_log_index(log_file, is_system).offsets(threshold, since, until, before)), 0
+        return read_lines_reversed(log_file, before), threshold
+
+    @app.get(f'/logs{postfix}/search/')
+    def search_logs():
+        """ Search the logs, newest first. ?q= is what to look for (anything, if it's empty), as a
+            case insensitive substring, or a regex if ?regex=1. ?from= and ?to= narrow it down to a time
+            range, and ?level= is the lowest level to show. ?limit= and ?before= work like they do for the
+            normal log pages. ?archives=1 keeps going into the compressed archives once it runs out of log.
+            It won't look through more than LOG_SEARCH_MAX_BYTES at once, but it links to the next bit.
+        """
+        q = request.args.get('q', '')
+        level = request.args.get('level', 'DEBUG').upper()
+        if level not in logging._nameToLevel:
+            return f'Invalid level: {level}', 400
+        try:
+            pattern = re.compile(q) if request.args.get('regex') else re.compile(re.escape(q), re.IGNORECASE)
+        except re.error as err:
+            return f'Invalid regex: {err}', 400
+        try:
+            since, until = time_range_args()
+        except ValueError as err:
+            return f'Invalid time: {err}', 400
+        try:
+            limit = limit_arg()
+        except ValueError as err:
+            return str(err), 400
+        # A number for the log itself, or "<archive name>:<offset>" once we're into the archives. This
+        # has to be checked now, since once the page starts streaming it's too late for a 400
+        before = request.args.get('before', None)
+        cursor = None
+        try:
+            if before is not None and ':' in before:
+                parse_archive_cursor(before)
+                cursor, before = before, None
+            elif before is not None:
+                before = int(before)
+        except ValueError:
+            return f'Invalid before: {before}', 400
+        include_archives = bool(request.args.get('archives'))
+        threshold = logging._nameToLevel[level]
+        page = {'before': None, 'truncated': False}
+
+        def matches():
+            if cursor is None:
+                if os.path.exists(log_file):
+                    start = find_time(log_file, since, is_system) if since else 0
+                    end = find_time(log_file, until, is_system, after=True) if until else None
+                    if before is not None:
+                        end = before if end is None else min(end, before)
+                    yield from search_lines(log_file, pattern, start, end, page=page)
+                if page['truncated'] or not include_archives:
+                    return
+            yield from search_archives(log_file, pattern, is_system, threshold, since, until,
+                cursor=cursor, count=limit, page=page)
+
+        lines = format_logs(matches(), threshold, is_system, limit, page)
+
+        return Response(stream_template('logs_search_template.html',
+            logs=lines,
+            page=page,
+            args=request.args,
+            # So the next page keeps the same search
+            extra_args=urlencode({k: v for k, v in request.args.items() if k != 'before'}),
+            max_mb=LOG_SEARCH_MAX_BYTES // (1024 * 1024),
+        ), mimetype='text/html')
+    search_logs.__name__ = f"search_{postfix}_logs"
+
+    @app.get(f'/logs{postfix}/archives/')
+    def list_archives():
+        """ All the compressed archives of old logs, newest first """
+        found = [{
+            'name': os.path.basename(path),
+            'ends': ends,
+            'size_kb': os.path.getsize(path) // 1024,
+            'url': url_for(f"{app.name}.get_{postfix}_archive", name=os.path.basename(path)),
+        } for path, ends in log_archive.archives(log_file)]
+        return render_template('logs_archive_template.html', archives=found, logs=None,
+            search_endpoint=url_for(f"{app.name}.search_{postfix}_logs", archives=1))
+    list_archives.__name__ = f"list_{postfix}_archives"
+
+    @app.get(f'/logs{postfix}/archives/<name>/')
+    def get_archive(name):
+        """ One page of an archive, newest first. ?level=, ?limit= and ?before= work like they do for
+            the normal log pages
+        """
+        # Only ones that are actually there, so nobody can ask for ../../something
+        paths = {os.path.basename(path): path for path, _ in log_archive.archives(log_file)}
+        if name not in paths:
+            return f'No archive called {name}', 404
+        level = request.args.get('level', 'DEBUG').upper()
+        if level not in logging._nameToLevel:
+            return f'Invalid level: {level}', 400
+        threshold = logging._nameToLevel[level]
+        try:
+            limit = limit_arg()
+        except ValueError as err:
+            return str(err), 400
+        before = request.args.get('before', None, type=int)
+        page = {'before': None}
+
+        lines = format_logs(read_archive_lines_reversed(paths[name], before,
+            lambda line: line_level(line, is_system) >= threshold, limit), 0, is_system, limit, page)
+        return Response(stream_template('logs_archive_template.html',
+            name=name,
+            archives=None,
+            logs=lines,
+            page=page,
+            extra_args=urlencode({k: v for k, v in request.args.items() if k != 'before'}),
+        ), mimetype='text/html')
+    get_archive.__name__ = f"get_{postfix}_archive"
+
+    @app.get(f'/logs{postfix}/api/')
+    def get_log_records():
+        """ One page of logs as JSON, newest first, for the viewer (or anything else):
+            {"records": [line_record(), ...], "before": the offset to pass as ?before= for the next
+             page (or null), "last_event_id": ..., "stream": ...}
+            ?level=, ?limit=, ?before=, ?from= and ?to= work like they do for the normal log pages. On
+            the first page, stream is where to get the new lines from as they're written (as JSON too),
+            starting right after the newest record here.
+        """
+        level = request.args.get('level', 'DEBUG').upper()
+        if level not in logging._nameToLevel:
+            return {'error': f'Invalid level: {level}'}, 400
+        threshold = logging._nameToLevel[level]
+        try:
+            limit = limit_arg()
+        except ValueError as err:
+            return {'error': str(err)}, 400
+        before = request.args.get('before', None, type=int)
+        try:
+            since, until = time_range_args()
+        except ValueError as err:
+            return {'error': f'Invalid time: {err}'}, 400
+
+        last_event_id = newest_event_id() if before is None and until is None else None
+        records = []
+        next_before = None
+        if os.path.exists(log_file):
+            lines, threshold = select_lines(threshold, before, since, until)
+            for offset, line in lines:
+                if len(records) >= limit:
+                    next_before = records[-1]['offset']
+                    break
+                record = line_record(offset, line, is_system)
+                if record['levelno'] >= threshold:
+                    records.append(record)
+        return {
+            'records': records,
+            'before': next_before,
+            'last_event_id': last_event_id,
+            'stream': stream_endpoint(last_event_id, as_json=True) if last_event_id else None,
+        }
+    get_log_records.__name__ = f"get_{postfix}_log_records"
+
+    @app.get(f'/logs{postfix}/viewer/')
+    def log_viewer():
+        """ The logs, rendered in the browser from get_log_records() and the JSON stream. Only the
+            rows that are on screen are in the page, so it stays fast however long it's left open
+        """
+        return render_template('logs_viewer_template.html',
+            api_endpoint=url_for(f"{app.name}.get_{postfix}_log_records"),
+            logs_endpoint=url_for(f"{app.name}.get_{postfix}_logs", level='debug'),
+        )
+    log_viewer.__name__ = f"view_{postfix}_logs"
+
     @app.get(f'/logs{postfix}/<level>/')
     def get_logs(level):
+        """ One page of logs, newest first. ?limit= is the page size, and ?before= is the byte offset
+            the next page starts before (the "Older" link at the bottom of the page fills it in)
+        """
         level = level.upper()
 
         if level not in logging._nameToLevel:
             return f'Invalid level: {level}', 400
 
+        threshold = logging._nameToLevel[level]
         try:
-            with open(log_file, 'r') as f:
-                lines = format_logs(f.readlines(), logging._nameToLevel[level], is_system)
-        except FileNotFoundError:
-            lines = ["Log file not found."]
+            limit = limit_arg()
+        except ValueError as err:
+            return str(err), 400
+        before = request.args.get('before', None, type=int)
+        try:
+            since, until = time_range_args()
+        except ValueError as err:
+            return f'Invalid time: {err}', 400
+        # Gets filled in once all the lines have been rendered
+        page = {'before': None}
+        # So the stream starts right after the newest line on the page, and nothing written while the
+        # page loads gets lost
+        last_event_id = newest_event_id() if before is None and until is None else None
 
+        if not os.path.exists(log_file):
+            lines = ["Log file not found."]
+        else:
+            lines = format_logs(*select_lines(threshold, before, since, until), is_system, limit, page)
 
-        return render_template('logs_template.html',
+        # Stream it, so the first lines go out while we're still reading the rest
+        return Response(stream_template('logs_template.html',
             logs=lines,
+            page=page,
+            limit=limit,
+            # So the "Older" link keeps the same time range
+            extra_args=urlencode({k: v for k, v in request.args.items() if k in ('from', 'to')}),
             clear_endpoint=url_for(f"{app.name}.delete_{postfix}_logs"),
             # clear_endpoint=f'/logs{postfix}/',
             add_spacer_endpoint=url_for(f"{app.name}.add_spacer_{postfix}"),
             # add_spacer_endpoint=f'/logs{postfix}/',
-            stream_endpoint=url_for(f"{app.name}.stream_{postfix}_logs")
+            stream_endpoint=stream_endpoint(last_event_id),
+            search_endpoint=url_for(f"{app.name}.search_{postfix}_logs"),
+            archives_endpoint=url_for(f"{app.name}.list_{postfix}_archives"),
+            viewer_endpoint=url_for(f"{app.name}.view_{postfix}_logs"),
             # stream_endpoint=f'/logs{postfix}/stream/'
-        )
+        ), mimetype='text/html')
     get_logs.__name__ = f"get_{postfix}_logs"
 
-    return get_logs, stream_logs, add_spacer, delete_logs
+    return get_logs, stream_logs, add_spacer, delete_logs, search_logs, list_archives, get_archive, get_log_records, log_viewer
@@ -14,7 +14,7 @@ def create_test_app():
     app.config['DATABASE'] = DB
 
     with app.app_context():
-        from rock_server.projects.irregular_reminders import bp as irregular_reminders_bp
+        from rock_server.projects.irregular_reminders.main_server import bp as irregular_reminders_bp
         # Register the blueprint
         app.register_blueprint(irregular_reminders_bp)
 
@@ -120,7 +120,7 @@ def examples(app):
     }
 
     with app.app_context():
-        from rock_server.projects.irregular_reminders import Reminder
+        from rock_server.projects.irregular_reminders.main_server import Reminder
     data['reminder_objs'] = [Reminder(**x) for x in data['reminders']]
 
     yield data
@@ -162,6 +162,7 @@ def db(app, examples):
                     last_trigger_time,
                     next_trigger_time,
                     device_id,
+                    job_id,
                     FOREIGN KEY (device_id) REFERENCES devices(device_id)
                 );
                 END;
@@ -169,6 +170,7 @@ def db(app, examples):
             # Add a test device
             con.executemany(f"INSERT INTO devices {tuple(examples['devices'][0].keys())} VALUES (?, ?, ?, ?, ?)", [list(i.values()) for i in examples['devices']])
             # Insert a couple reminders into the DB for testing
-            con.executemany(f"INSERT INTO reminders {tuple(examples['reminders'][0].keys())} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [list(i.serialize().values()) for i in examples['reminder_objs']])
+            rows = [i.serialize() for i in examples['reminder_objs']]
+            con.executemany(f"INSERT INTO reminders {tuple(rows[0].keys())} VALUES ({', '.join(['?'] * len(rows[0]))})", [list(row.values()) for row in rows])
 
     yield con
\ No newline at end of file
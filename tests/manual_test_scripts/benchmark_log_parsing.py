@@ -0,0 +1,123 @@
+""" Benchmarks parsing and rendering log lines, over a big made up log with all the formats we read.
+Compares against the old split() and strptime() parser, and checks they agree on every line.
+
+Run it from the repo root:
+    python -m tests.manual_test_scripts.benchmark_log_parsing --lines 100000
+"""
+
+import argparse
+import datetime as dt
+import os
+import random
+import tempfile
+from time import perf_counter
+
+from flask import Flask
+
+with Flask("rock_server").app_context():
+    from rock_server import utils
+
+
+def legacy_parse_line(line, is_system):
+    """ What parse_line used to be, to compare against """
+    parts = line.split(' ')
+    if is_system:
+        raw_date = parts[0][1:]
+        if parts[2].startswith('-'):
+            parts.pop(2)
+            parts.pop(2)
+            raw_time = parts[1]
+            levelname = parts[2].strip('[]')
+            message = ' '.join(parts[3:])
+            datetime = dt.datetime.strptime(f"{raw_date} {raw_time}", "%Y-%m-%d %H:%M:%S")
+        else:
+            levelname = parts[2]
+            raw_time = parts[1][:-1]
+            message = ' '.join(parts[4:])
+            datetime = dt.datetime.strptime(f"{raw_date} {raw_time}", "%Y-%m-%d %H:%M:%S,%f")
+    else:
+        raw_date = parts[0]
+        raw_time = parts[1]
+        levelname = parts[3]
+        message = ' '.join(parts[5:])
+        datetime = dt.datetime.strptime(f"{raw_date} {raw_time}", "%Y-%m-%d %H:%M:%S,%f")
+    return datetime, raw_date, raw_time, levelname, message
+
+
+def make_lines(count, is_system):
+    """ count lines, mostly normal ones, with a few tracebacks and spacers thrown in """
+    start = dt.datetime.now() - dt.timedelta(days=2)
+    levels = ["DEBUG", "INFO", "WARNING", "ERROR"]
+    messages = [
+        "Request: GET http://localhost:5000/info",
+        "Response: GET http://localhost:5000/info -> 200 OK",
+        "Sent a reminder to some-device",
+        "Something went wrong with a fairly long message, to make sure that isn't free either",
+    ]
+    lines = []
+    for i in range(count):
+        when = start + dt.timedelta(seconds=i)
+        stamp = when.strftime('%Y-%m-%d %H:%M:%S')
+        level = random.choice(levels)
+        message = random.choice(messages)
+        kind = random.random()
+        if kind < .02:
+            lines.append('  File "app.py", line 12, in <module>')
+        elif kind < .025:
+            lines.append("<hr/>")
+        elif not is_system:
+            lines.append(f"{stamp},{i % 1000:03} - {level} - {message}")
+        elif kind < .5:
+            lines.append(f"[{stamp},{i % 1000:03}] {level} in app: {message}")
+        else:
+            lines.append(f"[{stamp} -0500] [{1000 + i % 6}] [{level}] {message}")
+    return lines
+
+
+def timed(name, func, count):
+    started = perf_counter()
+    func()
+    took = perf_counter() - started
+    print(f"{name:<40} {took:8.3f} s {took / count * 1e6:8.2f} us/line")
+
+
+def try_parse(parse, line, is_system):
+    try:
+        return parse(line, is_system)
+    except Exception:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    for is_system in (False, True):
+        lines = make_lines(args.lines, is_system)
+        print(f"\n{'system.log' if is_system else 'app.log'} format, {len(lines)} lines")
+
+        # They should agree on everything the old one could parse
+        for line in lines:
+            old = try_parse(legacy_parse_line, line, is_system)
+            if old is not None:
+                assert try_parse(utils.parse_line, line, is_system) == old, line
+
+        timed("legacy parse_line", lambda: [try_parse(legacy_parse_line, l, is_system) for l in lines], len(lines))
+        timed("parse_line", lambda: [try_parse(utils.parse_line, l, is_system) for l in lines], len(lines))
+        utils._render_line.cache_clear()
+        timed("format_line (cold cache)", lambda: [utils.format_line(l, is_system) for l in lines], len(lines))
+        # Like reloading the page
+        page = lines[-utils.LOG_PAGE_SIZE:]
+        timed("format_line (one page, warm cache)", lambda: [utils.format_line(l, is_system) for l in page], len(page))
+
+        # The whole page, the way get_logs does it
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as f:
+            f.write("\n".join(lines) + "\n")
+        try:
+            utils._render_line.cache_clear()
+            timed("format_logs, whole file", lambda: list(utils.format_logs(utils.read_lines_reversed(f.name), 0, is_system)), len(lines))
+        finally:
+            os.remove(f.name)
@@ -0,0 +1,56 @@
+import logging
+import random
+import pytest
+
+from rock_server.access_log import AccessLog
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+@pytest.fixture
+def logged():
+    logger = logging.getLogger("test_access_log")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = ListHandler()
+    logger.addHandler(handler)
+    yield logger, handler.records
+    logger.removeHandler(handler)
+
+
+def test_sampling():
+    random.seed(0)
+    access_log = AccessLog(logging.getLogger("test_access_log"), sample_rate=10, slow_ms=500)
+    levels = [access_log.level(200, 5) for _ in range(10_000)]
+    # Roughly 1 in 10 of the good ones
+    assert 800 < levels.count(logging.DEBUG) < 1200
+    assert set(levels) == {logging.DEBUG, None}
+
+    # Errors and slow ones, always
+    assert all(access_log.level(404, 5) == logging.INFO for _ in range(100))
+    assert all(access_log.level(500, 5) == logging.WARNING for _ in range(100))
+    assert all(access_log.level(200, 500) == logging.WARNING for _ in range(100))
+
+def test_summary(logged):
+    logger, records = logged
+    access_log = AccessLog(logger, summary_sec=60)
+    for _ in range(3):
+        access_log.record("GET", "/info", 200, 100, 10)
+    access_log.record("GET", "/info", 500, None, 40)
+    access_log.record("POST", "/logs/", 200, 12, 1)
+
+    access_log.flush()
+    # All in one line, busiest route first
+    assert len(records) == 1
+    summary = records[0].getMessage()
+    assert summary.index("GET /info: 4 requests, 1 errors, 300 bytes, 17.5 ms avg") < summary.index("POST /logs/: 1 requests")
+
+    # It starts over, and doesn't log anything if there's been nothing
+    access_log.flush()
+    assert len(records) == 1
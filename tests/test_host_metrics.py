@@ -0,0 +1,48 @@
+import math
+from time import sleep, time
+
+from rock_server.host_metrics import FIELDS, HostSampler, RingBuffer
+
+
+def test_ring_buffer(tmp_path):
+    path = str(tmp_path / "host")
+    ring = RingBuffer(path, capacity=10, interval=1)
+    for i in range(25):
+        ring.append((1000 + i, *[i] * (len(FIELDS) - 2), math.nan))
+
+    # Only the newest ones are still there (less the one that gets written next), oldest first
+    history = ring.read()
+    assert history["ts"] == list(range(1016, 1025))
+    assert history["cpu_percent"] == list(range(16, 25))
+    assert history[FIELDS[-1]] == [None] * 9
+    assert ring.read(since=1020)["ts"] == list(range(1020, 1025))
+
+    # Another process sees the same thing, and different settings start it over
+    assert RingBuffer(path, capacity=10, interval=1).read() == history
+    assert RingBuffer(path, capacity=20, interval=1).read()["ts"] == []
+
+def test_one_sampler(tmp_path):
+    path = str(tmp_path / "host")
+    # Like two workers
+    samplers = [HostSampler(path, interval=.05, hours=1) for _ in range(2)]
+    for sampler in samplers:
+        sampler.start()
+    try:
+        sleep(.5)
+        assert sum(sampler.lock_file is not None for sampler in samplers) == 1
+        history = samplers[0].ring().read()
+        assert 5 <= len(history["ts"]) <= 11
+        assert all(time() - 1 < ts <= time() for ts in history["ts"])
+        # The first one doesn't have anything to compare disk I/O to
+        assert history["mem_percent"][-1] > 0 and history["open_fds"][-1] > 0
+        assert history["worker_rss_0"][-1] > 0
+
+        # If the one that's sampling goes away, the other one takes over
+        sampling = next(sampler for sampler in samplers if sampler.lock_file is not None)
+        sampling.stop()
+        written = sampling.ring().written
+        sleep(.3)
+        assert sampling.ring().written > written
+    finally:
+        for sampler in samplers:
+            sampler.stop()
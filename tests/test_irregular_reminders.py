@@ -184,3 +184,37 @@ def test_delete_reminder(client, db, examples):
     # Test deleting a non-existent reminder
     response = client.delete(f'{API_VERSION}/reminders/{examples["devices"][0]["device_id"]}/non-existent-reminder', headers=HEADERS)
     assert response.status_code == 200  # Should still return 200 even if reminder doesn't exist
+
+def test_reminders_fired(client, examples):
+    """Test the endpoint the runner reports fired reminders to."""
+    reminder = examples['reminder_objs'][1]
+    response = client.post(f'{API_VERSION}/runner/fired', json={"fired": [
+        {"id": str(reminder.id), "time": datetime.now().timestamp()},
+        {"id": "non-existent-reminder", "time": datetime.now().timestamp()},
+    ]})
+    assert response.status_code == 200
+    # It's a one-shot reminder, so there's nothing to schedule again
+    assert response.json == {"jobs": []}
+    with sqlite3.connect(DB) as con:
+        assert not con.execute("SELECT alive FROM reminders WHERE id = ?", (str(reminder.id),)).fetchone()[0]
+
+    # Bad bodies get a 400, not a 500
+    assert client.post(f'{API_VERSION}/runner/fired').status_code == 400
+    assert client.post(f'{API_VERSION}/runner/fired', data="not json", headers=HEADERS).status_code == 400
+    assert client.post(f'{API_VERSION}/runner/fired', json={"fired": [{"id": "x"}]}).status_code == 400
+
+def test_reminders_fired_runner_only(client, examples, monkeypatch):
+    """Only the runner can say reminders have fired."""
+    from rock_server.projects.irregular_reminders.main_server import endpoints
+    reminder = examples['reminder_objs'][1]
+    body = {"fired": [{"id": str(reminder.id), "time": datetime.now().timestamp()}]}
+    # Not from this machine
+    response = client.post(f'{API_VERSION}/runner/fired', json=body, environ_base={"REMOTE_ADDR": "203.0.113.7"})
+    assert response.status_code == 403
+    # With a secret, it has to send it too
+    monkeypatch.setattr(endpoints, "RUNNER_SECRET", "hunter2")
+    assert client.post(f'{API_VERSION}/runner/fired', json=body).status_code == 403
+    assert client.post(f'{API_VERSION}/runner/fired', json=body, headers={"X-Runner-Secret": "nope"}).status_code == 403
+    with sqlite3.connect(DB) as con:
+        assert con.execute("SELECT alive FROM reminders WHERE id = ?", (str(reminder.id),)).fetchone()[0]
+    assert client.post(f'{API_VERSION}/runner/fired', json=body, headers={"X-Runner-Secret": "hunter2"}).status_code == 200
@@ -0,0 +1,155 @@
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+import pytest
+from flask import Blueprint
+
+from rock_server import log_archive
+from .test_logs import make_log_lines, log_app, utils
+
+
+def write_archives(log_file, count=3, lines=200):
+    """ Archive count chunks of lines, an hour apart, and then put more in the live log. Gives back all
+        the lines, oldest first
+    """
+    everything = []
+    start = datetime(2025, 1, 1)
+    for i in range(count + 1):
+        chunk = make_log_lines(lines, start + timedelta(hours=i), timedelta(seconds=10))
+        chunk = [line.replace("Message number", f"Chunk {i} message number") for line in chunk]
+        everything += chunk
+        log_file.write_text("".join(chunk))
+        if i < count:
+            ends = (start + timedelta(hours=i, seconds=10 * lines)).timestamp()
+            os.utime(log_file, (ends, ends))
+            log_archive.archive(str(log_file))
+    return [line.rstrip('\n') for line in everything]
+
+
+def test_archive_and_prune(tmp_path):
+    log_file = tmp_path / "app.log"
+    assert log_archive.archive(str(log_file)) is None
+    log_file.write_text("".join(make_log_lines(1000)))
+    first = log_archive.archive(str(log_file))
+    second = log_archive.archive(str(log_file))
+
+    # Same mtime, so the second one gets a -1
+    assert os.path.dirname(first) == str(tmp_path / log_archive.ARCHIVE_DIR)
+    assert second.endswith("-1.gz")
+    with gzip.open(second, 'rt') as f:
+        assert f.read() == log_file.read_text()
+    assert [path for path, _ in log_archive.archives(str(log_file))] == [second, first]
+
+    # Only the newest ones are kept once they're over the limit
+    log_archive.prune(str(log_file), os.path.getsize(second))
+    assert [path for path, _ in log_archive.archives(str(log_file))] == [second]
+
+def test_rollover(tmp_path):
+    log_file = tmp_path / "app.log"
+    handler = log_archive.ArchivingRotatingFileHandler(str(log_file), maxBytes=1000, backupCount=1)
+    logger = logging.getLogger("test_rollover")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(500):
+            logger.warning("line %d", i)
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    # Nothing got thrown away
+    lines = []
+    for path, _ in reversed(log_archive.archives(str(log_file))):
+        with gzip.open(path, 'rt') as f:
+            lines += f.read().splitlines()
+    lines += (tmp_path / "app.log.1").read_text().splitlines() + log_file.read_text().splitlines()
+    assert lines == [f"line {i}" for i in range(500)]
+
+def test_rollover_archive_fails(tmp_path, monkeypatch, capsys):
+    log_file = tmp_path / "app.log"
+    handler = log_archive.ArchivingRotatingFileHandler(str(log_file), maxBytes=1000, backupCount=1)
+    logger = logging.getLogger("test_rollover_archive_fails")
+    logger.propagate = False
+    logger.addHandler(handler)
+    archive = log_archive.archive
+    def broken(*args, **kwargs):
+        raise OSError("disk full")
+    try:
+        monkeypatch.setattr(log_archive, "archive", broken)
+        for i in range(400):
+            logger.warning("line %d", i)
+        # It says so, and keeps what it couldn't archive
+        assert "Failed to archive" in capsys.readouterr().err
+        assert len(list(tmp_path.glob("app.log.unarchived-*"))) > 1
+        # Then archives it once it can
+        monkeypatch.setattr(log_archive, "archive", archive)
+        for i in range(400, 800):
+            logger.warning("line %d", i)
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    assert not list(tmp_path.glob("app.log.unarchived-*"))
+    lines = []
+    for path, _ in reversed(log_archive.archives(str(log_file))):
+        with gzip.open(path, 'rt') as f:
+            lines += f.read().splitlines()
+    lines += (tmp_path / "app.log.1").read_text().splitlines() + log_file.read_text().splitlines()
+    assert sorted(lines, key=lambda line: int(line.split()[1])) == [f"line {i}" for i in range(800)]
+
+def test_read_archive(utils, tmp_path):
+    log_file = tmp_path / "app.log"
+    everything = write_archives(log_file, count=1)
+    path, _ = log_archive.archives(str(log_file))[0]
+    archived = everything[:200]
+    assert utils.archive_size(path) == len("\n".join(archived)) + 1
+    assert [line for _, line in utils.read_archive_lines(path)] == archived
+
+    # Pages, newest first
+    page = list(utils.read_archive_lines_reversed(path, count=10))
+    assert [line for _, line in page] == archived[::-1][:11]
+    page = list(utils.read_archive_lines_reversed(path, before=page[9][0], count=10))
+    assert [line for _, line in page] == archived[::-1][10:21]
+
+def test_archive_endpoints(log_app, utils, tmp_path):
+    log_file = tmp_path / "app.log"
+    everything = write_archives(log_file)
+    bp = Blueprint("test_archives", __name__)
+    utils.generate_log_endpoints(bp, str(log_file), False)
+    log_app.register_blueprint(bp)
+    client = log_app.test_client()
+    def messages(resp):
+        assert resp.status_code == 200
+        return re.findall(r'Chunk \d message number \d+', resp.get_data(as_text=True))
+
+    listing = client.get('/logs/archives/').get_data(as_text=True)
+    names = re.findall(r'>(app\.log\.[\d-]+\.gz)<', listing)
+    assert len(names) == 3
+
+    # Viewing one, with a level and paging
+    resp = client.get(f'/logs/archives/{names[0]}/', query_string={"level": "error", "limit": 5})
+    assert messages(resp) == [f"Chunk 2 message number {i}" for i in (199, 195, 191, 187, 183)]
+    before = re.search(r'before=(\d+)', resp.get_data(as_text=True)).group(1)
+    resp = client.get(f'/logs/archives/{names[0]}/', query_string={"level": "error", "limit": 5, "before": before})
+    assert messages(resp)[0] == "Chunk 2 message number 179"
+    assert client.get('/logs/archives/..%2Fapp.log/').status_code == 404
+
+    # Searching goes from the live log into the archives, and pages across them
+    found = []
+    args = {"q": "number 1", "archives": 1, "limit": 30}
+    while True:
+        resp = client.get('/logs/search/', query_string=args)
+        found += messages(resp)
+        if not (more := re.search(r'before=([^"&]+)', resp.get_data(as_text=True))):
+            break
+        args["before"] = more.group(1)
+    assert found == [re.search(r'Chunk.*', line).group(0) for line in everything[::-1]
+        if re.search(r'number 1', line)]
+    # Without archives=1 it stops at the live log
+    assert all(m.startswith("Chunk 3") for m in messages(client.get('/logs/search/', query_string={"q": "number 1"})))
+
+    # Archives outside the time range don't get looked at
+    resp = client.get('/logs/search/', query_string={"archives": 1, "from": "2025-01-01T01:05:00", "to": "2025-01-01T01:06:00"})
+    assert set(m.split()[1] for m in messages(resp)) == {"1"}
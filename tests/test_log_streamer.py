@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+import re
+import socket
+import statistics
+import threading
+from time import perf_counter, sleep
+from urllib.parse import urlsplit
+import pytest
+import requests
+from flask import Flask, Blueprint
+from werkzeug.serving import make_server
+
+from .test_logs import make_log_lines
+
+# How many streams to hold open while timing the app
+CLIENTS = 200
+
+
+@pytest.fixture
+def streamer(tmp_path, monkeypatch):
+    """ A log streamer on a random port, following a log file in tmp_path. Gives back (port, log_file) """
+    from rock_server import log_streamer
+    log_file = tmp_path / "stream.log"
+    log_file.write_text("")
+    streams = {"/logs/stream/": (str(log_file), False)}
+    # So the log pages send people to it
+    monkeypatch.setattr(log_streamer, "STREAMS", streams)
+
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    servers = []
+    def on_started(server):
+        servers.append(server)
+        started.set()
+    task = loop.create_task(log_streamer.LogStreamer(streams).serve("127.0.0.1", 0, on_started))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    assert started.wait(5)
+    yield servers[0].sockets[0].getsockname()[1], log_file
+    async def stop():
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    asyncio.run_coroutine_threadsafe(stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+@pytest.fixture
+def log_server(streamer):
+    """ The app's log endpoints for the streamer's log file, served threaded like the main server, with
+        LOG_STREAM_URL pointing at the streamer. Gives back the url it's at
+    """
+    port, log_file = streamer
+    app = Flask("rock_server")
+    app.config['LOG_STREAM_URL'] = f"http://127.0.0.1:{port}"
+    with app.app_context():
+        from rock_server.utils import generate_log_endpoints
+        bp = Blueprint("streamed_logs", __name__)
+        generate_log_endpoints(bp, str(log_file), False)
+        app.register_blueprint(bp)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def open_stream(port, path="/logs/stream/", headers=""):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+    sock.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n".encode())
+    return sock
+
+def read_until(sock, marker):
+    data = b''
+    while marker not in data:
+        chunk = sock.recv(65536)
+        assert chunk, f"Connection closed before {marker}"
+        data += chunk
+    return data
+
+def api_latency(url, count=50):
+    """ The median time a request takes, in seconds """
+    with requests.Session() as session:
+        times = []
+        for _ in range(count):
+            started = perf_counter()
+            session.get(url).raise_for_status()
+            times.append(perf_counter() - started)
+    return statistics.median(times)
+
+
+def test_unknown_path(streamer):
+    port, _ = streamer
+    sock = open_stream(port, "/nope/")
+    assert read_until(sock, b"\r\n\r\n").startswith(b"HTTP/1.1 404")
+    sock.close()
+
+def test_resume(streamer):
+    port, log_file = streamer
+    lines = make_log_lines(10)
+    log_file.write_text("".join(lines))
+    inode = log_file.stat().st_ino
+    second_line = len(lines[0])
+
+    sock = open_stream(port, headers=f"Last-Event-ID: {inode}:{second_line}\r\n")
+    data = read_until(sock, b"Message number 9\n")
+    # Everything after the second line, and only once
+    assert b"Message number 1\n" not in data
+    assert [int(n) for n in re.findall(rb"Message number (\d+)", data)] == list(range(2, 10))
+    assert f"id: {inode}:{second_line + len(lines[1])}\n".encode() in data
+    sock.close()
+
+def test_many_streams(streamer, log_server):
+    port, log_file = streamer
+    log_file.write_text("".join(make_log_lines(200)))
+    # A normal request to the app: a page of logs, like the viewer asks for
+    api = f"{log_server}/logs/api/?limit=50"
+    baseline = api_latency(api)
+
+    # Open the streams the same way the log pages do, from where the app says to get them
+    stream = urlsplit(requests.get(api).json()['stream'])
+    assert stream.port == port
+    socks = [open_stream(port, f"{stream.path}?{stream.query}") for _ in range(CLIENTS)]
+    try:
+        for sock in socks:
+            assert read_until(sock, b": connected\n\n").startswith(b"HTTP/1.1 200 OK")
+
+        # Keep the streams busy while we time the app
+        writing = True
+        def write_lines():
+            while writing:
+                with open(log_file, 'a') as f:
+                    f.writelines(make_log_lines(5))
+                sleep(.05)
+        writer = threading.Thread(target=write_lines)
+        writer.start()
+        try:
+            loaded = api_latency(api)
+        finally:
+            writing = False
+            writer.join()
+
+        with open(log_file, 'a') as f:
+            f.write("2025-01-01 12:00:00,000 - INFO - The last line\n")
+        for sock in socks:
+            read_until(sock, b"The last line")
+    finally:
+        for sock in socks:
+            sock.close()
+
+    # Holding all those streams open doesn't slow the app's own requests down, since none of them are
+    # on its threads (with some slack for a noisy machine, and the log getting longer)
+    assert loaded < max(baseline * 3, baseline + .01), (baseline, loaded)
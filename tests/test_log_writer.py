@@ -0,0 +1,99 @@
+import json
+import logging
+import multiprocessing
+import re
+import threading
+from time import sleep, time
+import pytest
+
+from rock_server.log_writer import make_server, queue_logging
+
+PROCESSES = 4
+LINES = 200
+
+
+@pytest.fixture
+def writer(tmp_path):
+    """ A log writer that rotates often, and keeps every backup. Gives back (socket, log file) """
+    socket_path = str(tmp_path / "app.log.sock")
+    log_file = tmp_path / "app.log"
+    server = make_server(socket_path, str(log_file), max_bytes=4096, backup_count=1000)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield socket_path, log_file
+    server.shutdown()
+    server.server_close()
+    thread.join(5)
+
+def log_lines(name, log_file, socket_path, log_format="text"):
+    """ Log LINES lines from a new logger, the way a worker would """
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    listener = queue_logging(logger, log_file, log_format, socket_path)
+    for i in range(LINES):
+        logger.info("%s line %d", name, i)
+    listener.stop()
+
+def all_lines(log_file):
+    """ Every line in the log file and its backups """
+    return [line for path in log_file.parent.glob("app.log*") if not path.name.endswith(".sock")
+        for line in path.read_text().splitlines()]
+
+
+def test_many_processes(writer, tmp_path):
+    socket_path, log_file = writer
+    # If anything fell back to writing on its own, it'd show up here
+    fallback = tmp_path / "fallback.log"
+    processes = [
+        multiprocessing.get_context("fork").Process(target=log_lines, args=(f"worker{i}", str(fallback), socket_path))
+        for i in range(PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    # The writer might still be catching up
+    deadline = time() + 10
+    while len(lines := all_lines(log_file)) < PROCESSES * LINES and time() < deadline:
+        sleep(.05)
+    # It rotated, and nothing got lost or mangled on the way
+    assert len([p for p in tmp_path.glob("app.log.*") if p.suffix != ".sock"]) > 1
+    assert len(lines) == PROCESSES * LINES
+    for line in lines:
+        assert re.fullmatch(r"\S+ \S+ - INFO - worker\d line \d+", line), line
+    for i in range(PROCESSES):
+        assert sorted(int(l.split()[-1]) for l in lines if f"worker{i} " in l) == list(range(LINES))
+    assert not fallback.exists()
+
+def test_exceptions(writer, tmp_path):
+    socket_path, _ = writer
+    log_file = tmp_path / "json.log"
+    server = make_server(str(tmp_path / "json.sock"), str(log_file), "json")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        logger = logging.getLogger("test_exceptions")
+        logger.propagate = False
+        listener = queue_logging(logger, str(tmp_path / "fallback.log"), "json", str(tmp_path / "json.sock"))
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("It broke", extra={"path": "/broken"})
+        listener.stop()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    record = json.loads(log_file.read_text())
+    # The traceback still gets its own field, after going through the queue and the socket
+    assert record["msg"] == "It broke"
+    assert record["path"] == "/broken"
+    assert "ZeroDivisionError" in record["exc"]
+
+def test_no_writer(tmp_path):
+    # Without a log writer, it writes the file itself (still off the calling thread)
+    log_file = tmp_path / "app.log"
+    log_lines("alone", str(log_file), str(tmp_path / "missing.sock"))
+    assert len(log_file.read_text().splitlines()) == LINES
@@ -0,0 +1,495 @@
+import json
+import re
+from time import sleep, time
+from datetime import datetime, timedelta, timezone
+import pytest
+from flask import Flask, Blueprint
+
+
+def make_log_lines(count, start=None, step=timedelta(seconds=1)):
+    """ count lines in the same format app.log uses, step apart """
+    start = start or datetime.now() - timedelta(hours=1)
+    levels = ["DEBUG", "INFO", "WARNING", "ERROR"]
+    return [
+        f"{(start + step * i).strftime('%Y-%m-%d %H:%M:%S')},{i % 1000:03} - {levels[i % 4]} - Message number {i}\n"
+        for i in range(count)
+    ]
+
+@pytest.fixture
+def log_app():
+    """ A bare app, so rock_server.utils can be imported """
+    app = Flask("rock_server")
+    app.config['TESTING'] = True
+    with app.app_context():
+        yield app
+
+@pytest.fixture
+def utils(log_app):
+    import rock_server.utils
+    return rock_server.utils
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = tmp_path / "test.log"
+    path.write_text("".join(make_log_lines(50)))
+    return path
+
+@pytest.fixture
+def log_client(log_app, utils, log_file):
+    bp = Blueprint("test_logs", __name__)
+    utils.generate_log_endpoints(bp, str(log_file), False)
+    log_app.register_blueprint(bp)
+    return log_app.test_client()
+
+
+def test_read_lines_reversed(utils, log_file):
+    data = log_file.read_bytes()
+    expected = []
+    offset = 0
+    for line in data.split(b'\n'):
+        if line:
+            expected.append((offset, line.decode()))
+        offset += len(line) + 1
+    expected.reverse()
+
+    # Small blocks, so lines get split across them
+    for block_size in (7, 64, 1024 * 1024):
+        assert list(utils.read_lines_reversed(str(log_file), block_size=block_size)) == expected
+
+    # Starting before a line gives everything older than it
+    assert list(utils.read_lines_reversed(str(log_file), before=expected[10][0], block_size=13)) == expected[11:]
+    assert list(utils.read_lines_reversed(str(log_file), before=0)) == []
+
+def test_logs_pagination(log_client, log_file):
+    resp = log_client.get('/logs/debug/?limit=20')
+    assert resp.status_code == 200
+    page = resp.get_data(as_text=True)
+    numbers = [int(n) for n in re.findall(r'Message number (\d+)', page)]
+    assert numbers == list(range(49, 29, -1))
+
+    # Follow the "Older" link until we run out
+    seen = numbers
+    while (older := re.search(r'href="\?limit=20&before=(\d+)"', page)):
+        page = log_client.get(f'/logs/debug/?limit=20&before={older[1]}').get_data(as_text=True)
+        seen += [int(n) for n in re.findall(r'Message number (\d+)', page)]
+    assert seen == list(range(49, -1, -1))
+
+def test_logs_level_filter(log_client):
+    page = log_client.get('/logs/error/').get_data(as_text=True)
+    numbers = [int(n) for n in re.findall(r'Message number (\d+)', page)]
+    assert numbers == [i for i in range(49, -1, -1) if i % 4 == 3]
+
+def test_log_index(utils, log_file):
+    index = utils.LogIndex(str(log_file), False)
+    lines = dict(utils.read_lines_reversed(str(log_file)))
+
+    warnings = list(index.offsets(utils.logging.WARNING))
+    assert warnings == sorted(warnings, reverse=True)
+    assert [int(lines[o].split()[-1]) for o in warnings] == [i for i in range(49, -1, -1) if i % 4 >= 2]
+
+    # New lines get picked up incrementally
+    with open(log_file, 'a') as f:
+        f.writelines(make_log_lines(4, datetime.now()))
+    assert len(list(index.offsets(utils.logging.WARNING))) == len(warnings) + 2
+
+    # It's saved next to the log file, and a new index picks up where it left off
+    assert (log_file.parent / "test.log.idx").exists()
+    assert list(utils.LogIndex(str(log_file), False).offsets()) == list(index.offsets())
+
+    # Rotating the file (a new inode) or clearing it starts over
+    log_file.rename(log_file.parent / "test.log.1")
+    log_file.write_text("".join(make_log_lines(3)))
+    assert len(list(index.offsets())) == 3
+    log_file.write_text("")
+    assert list(index.offsets()) == []
+
+def test_log_index_appends(utils, log_file, monkeypatch):
+    index_file = log_file.parent / "test.log.idx"
+    # Two workers, indexing the same log
+    first = utils.LogIndex(str(log_file), False)
+    second = utils.LogIndex(str(log_file), False)
+    expected = list(first.offsets())
+    list(second.offsets())
+    for _ in range(3):
+        with open(log_file, 'a') as f:
+            f.writelines(make_log_lines(4, datetime.now()))
+        expected = list(first.offsets())
+        assert list(second.offsets()) == expected
+
+    # Each update only adds a line, instead of writing it all out again
+    lines = index_file.read_text().splitlines()
+    # (the header and everything so far, then one for each worker, each time)
+    assert len(lines) == 2 + 3 * 2
+    assert all(len(line) < 1000 for line in lines[2:])
+    # And a new one skips the bits that are in there twice
+    assert list(utils.LogIndex(str(log_file), False).offsets()) == expected
+
+    # Once there's too many, it gets written back out as one
+    monkeypatch.setattr(utils.LogIndex, "MAX_CHUNKS", 2)
+    assert list(utils.LogIndex(str(log_file), False).offsets()) == expected
+    assert len(index_file.read_text().splitlines()) == 2
+    assert list(utils.LogIndex(str(log_file), False).offsets()) == expected
+
+def test_log_index_time_range(utils, tmp_path):
+    log_file = tmp_path / "range.log"
+    start = datetime(2025, 1, 1, 12, 0)
+    # One line every 10 seconds, for 10 minutes
+    log_file.write_text("".join(make_log_lines(60, start, timedelta(seconds=10))))
+    index = utils.LogIndex(str(log_file), False)
+
+    offsets = list(index.offsets(since=start + timedelta(minutes=2), until=start + timedelta(minutes=3)))
+    # Whole minutes, from 12:02:00 to 12:03:59
+    assert len(offsets) == 12
+    with open(log_file, 'rb') as f:
+        f.seek(offsets[-1])
+        assert f.readline().decode().startswith("2025-01-01 12:02:00")
+        f.seek(offsets[0])
+        assert f.readline().decode().startswith("2025-01-01 12:03:50")
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_log_tailer(utils, log_file, use_inotify):
+    tailer = utils.LogTailer(str(log_file), queue_size=5, use_inotify=use_inotify)
+    first = tailer.subscribe()
+    second = tailer.subscribe()
+
+    size = log_file.stat().st_size
+    new = make_log_lines(3, datetime.now())
+    with open(log_file, 'a') as f:
+        f.writelines(new)
+    # Everyone gets the same lines, starting from the end of the file
+    for q in (first, second):
+        got = [q.get(timeout=5) for _ in new]
+        assert [line for _, _, line in got] == [line.rstrip('\n') for line in new]
+        assert got[0][0] == log_file.stat().st_ino
+        assert got[0][1] == size
+
+    # A slow subscriber loses its oldest lines, not the newest
+    tailer.unsubscribe(first)
+    new = make_log_lines(8, datetime.now())
+    with open(log_file, 'a') as f:
+        f.writelines(new)
+    deadline = time() + 5
+    while not second.full() or second.queue[-1][2] != new[-1].rstrip('\n'):
+        assert time() < deadline
+        sleep(.05)
+    assert [line for _, _, line in list(second.queue)] == [line.rstrip('\n') for line in new[-5:]]
+    assert first.empty()
+
+    # Rotating starts over at the beginning of the new file
+    while not second.empty():
+        second.get()
+    log_file.rename(log_file.parent / "test.log.1")
+    log_file.write_text("".join(make_log_lines(2)))
+    assert second.get(timeout=5)[1] == 0
+
+    # And it stops once nobody's listening
+    tailer.unsubscribe(second)
+    deadline = time() + 5
+    while tailer.thread is not None:
+        assert time() < deadline
+        sleep(.05)
+
+def test_read_missed_lines(utils, log_file):
+    inode = log_file.stat().st_ino
+    lines = list(reversed(list(utils.read_lines_reversed(str(log_file)))))
+    expected = [(inode, offset, line) for offset, line in lines]
+
+    # Everything after the line with that offset
+    assert list(utils.read_missed_lines(str(log_file), (inode, lines[40][0]))) == expected[41:]
+    assert list(utils.read_missed_lines(str(log_file), (inode, lines[-1][0]))) == []
+    # Only as much as it's allowed
+    assert list(utils.read_missed_lines(str(log_file), (inode, 0), max_bytes=200)) == \
+        [e for e in expected if e[1] > log_file.stat().st_size - 200]
+    # A line that's still being written gets left for the tailer
+    with open(log_file, 'a') as f:
+        f.write("2025-01-01 12:00:00,000 - INFO - Not done ye")
+    assert list(utils.read_missed_lines(str(log_file), (inode, lines[48][0]))) == expected[49:]
+
+    # After it's been rotated, we get the rest of the old one, then all of the new one
+    log_file.rename(log_file.parent / "test.log.1")
+    log_file.write_text("".join(make_log_lines(2)))
+    missed = list(utils.read_missed_lines(str(log_file), (inode, lines[47][0])))
+    assert missed[:2] == expected[48:]
+    assert [(offset, line) for _, offset, line in missed[2:]] == list(reversed(list(utils.read_lines_reversed(str(log_file)))))
+
+    # And if the old one's gone, just the new one
+    (log_file.parent / "test.log.1").unlink()
+    assert len(list(utils.read_missed_lines(str(log_file), (inode, lines[47][0])))) == 2
+
+def test_stream_resume(log_client, log_file):
+    inode = log_file.stat().st_ino
+    lines = list(utils_lines(log_file))
+    # The page tells the stream to start after its newest line
+    page = log_client.get('/logs/debug/').get_data(as_text=True)
+    assert f"last_event_id={inode}%3A{lines[-1][0]}" in page
+
+    # Reconnecting gets what was missed first, with the ids to pick up from next time
+    resp = log_client.get('/logs/stream/', headers={'Last-Event-ID': f"{inode}:{lines[46][0]}"}, buffered=False)
+    chunks = iter(resp.response)
+    assert next(chunks) == b": connected\n\n"
+    for offset, line in lines[47:]:
+        event = next(chunks).decode()
+        assert event.startswith(f"id: {inode}:{offset}\ndata: ")
+        assert line.split(' - ')[-1] in event
+    resp.close()
+
+def utils_lines(log_file):
+    """ (offset, line) for every line in the file, oldest first """
+    offset = 0
+    for line in log_file.read_bytes().split(b'\n'):
+        if line:
+            yield offset, line.decode()
+        offset += len(line) + 1
+
+def test_parse_line(utils):
+    app_line = "2025-09-13 16:55:29,220 - WARNING - Something - with dashes"
+    assert utils.parse_line(app_line, False) == (
+        datetime(2025, 9, 13, 16, 55, 29, 220000), "2025-09-13", "16:55:29,220", "WARNING", "Something - with dashes")
+
+    flask_line = "[2025-09-13 16:55:29,220] INFO in app: Request: GET /"
+    assert utils.parse_line(flask_line, True) == (
+        datetime(2025, 9, 13, 16, 55, 29, 220000), "2025-09-13", "16:55:29,220", "INFO", "app: Request: GET /")
+
+    gunicorn_line = "[2025-09-13 16:55:10 -0500] [176625] [INFO] Booting worker with pid: 176625"
+    assert utils.parse_line(gunicorn_line, True) == (
+        datetime(2025, 9, 13, 16, 55, 10), "2025-09-13", "16:55:10", "INFO", "Booting worker with pid: 176625")
+
+    for line, is_system in [("Traceback (most recent call last):", False), ("<hr/>", True), (app_line, True)]:
+        with pytest.raises(ValueError):
+            utils.parse_line(line, is_system)
+        assert utils.line_level(line, is_system) == 100
+        assert utils.format_line(line, is_system) == f"<pre>{line}</pre>"
+
+    assert utils.line_level(app_line, False) == utils.logging.WARNING
+    assert "ago <span style='color: orange;'>WARNING</span> : Something - with dashes" in utils.format_line(app_line, False)
+
+def test_json_log_lines(utils, tmp_path):
+    from rock_server.log_format import JSONFormatter
+    log_file = tmp_path / "json.log"
+    logger = utils.logging.getLogger("test_json_log_lines")
+    logger.propagate = False
+    handler = utils.logging.FileHandler(log_file)
+    handler.setFormatter(JSONFormatter())
+    logger.addHandler(handler)
+    try:
+        logger.warning("Response: %s %s -> %s", "GET", "http://localhost:5000/info", "404 NOT FOUND",
+            extra={"method": "GET", "path": "/info", "status": 404, "duration_ms": 1.5})
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("It broke")
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    response, error = log_file.read_text().splitlines()
+    # A traceback doesn't spill over onto more lines
+    assert "ZeroDivisionError" in error
+
+    parsed, raw_date, raw_time, levelname, message = utils.parse_line(response, False)
+    assert abs((datetime.now() - parsed).total_seconds()) < 60
+    assert (levelname, message) == ("WARNING", "Response: GET http://localhost:5000/info -> 404 NOT FOUND")
+    assert utils.line_level(response, False) == utils.logging.WARNING
+    assert utils.line_level(error, True) == utils.logging.ERROR
+
+    # It's rendered from the fields, not the message
+    html = utils.format_line(response, False)
+    assert "GET /info" in html and "color: orange'>404" in html and "1.5 ms" in html
+    assert "<pre>Traceback" in utils.format_line(error, False)
+
+    # The index can read them too
+    index = utils.LogIndex(str(log_file), False)
+    assert list(index.offsets(utils.logging.ERROR)) == [len(response) + 1]
+
+@pytest.fixture
+def timed_log(tmp_path):
+    """ 600 lines, 10 seconds apart, starting at noon on 2025-01-01, with a traceback after every 100th """
+    log_file = tmp_path / "timed.log"
+    lines = make_log_lines(600, datetime(2025, 1, 1, 12), timedelta(seconds=10))
+    for i in range(0, 600, 100):
+        lines[i] += "Traceback (most recent call last):\n  ZeroDivisionError: division by zero\n"
+    log_file.write_text("".join(lines))
+    return log_file
+
+def test_find_time(utils, timed_log, monkeypatch):
+    # Small blocks, so it actually has to bisect
+    monkeypatch.setattr(utils, "LOG_BLOCK_SIZE", 256)
+    with open(timed_log, 'rb') as f:
+        data = f.read()
+    def line_at(offset):
+        return data[offset:data.index(b'\n', offset)].decode()
+
+    start = datetime(2025, 1, 1, 12)
+    # make_log_lines() adds i milliseconds to each line too
+    times = [start + timedelta(seconds=10 * i, milliseconds=i) for i in range(600)]
+    for seconds in (0, 5, 10, 995, 1000, 3000, 5990):
+        when = start + timedelta(seconds=seconds)
+        found = utils.find_time(str(timed_log), when, False)
+        assert line_at(found).endswith(f"Message number {min(i for i, t in enumerate(times) if t >= when)}"), seconds
+        found = utils.find_time(str(timed_log), when, False, after=True)
+        assert line_at(found).endswith(f"Message number {min(i for i, t in enumerate(times) if t > when)}"), seconds
+
+    assert utils.find_time(str(timed_log), start - timedelta(days=1), False) == 0
+    assert utils.find_time(str(timed_log), start + timedelta(days=1), False) == len(data)
+
+def test_search(log_app, utils, timed_log):
+    bp = Blueprint("test_search", __name__)
+    utils.generate_log_endpoints(bp, str(timed_log), False)
+    log_app.register_blueprint(bp)
+    client = log_app.test_client()
+    def search(**args):
+        resp = client.get('/logs/search/', query_string=args)
+        assert resp.status_code == 200
+        page = resp.get_data(as_text=True)
+        return [int(n) for n in re.findall(r'Message number (\d+)', page)], page
+
+    # Substring, case insensitive
+    numbers, _ = search(q="NUMBER 12")
+    assert numbers == [129, 128, 127, 126, 125, 124, 123, 122, 121, 120, 12]
+    # Regex
+    numbers, _ = search(q=r"number 5\d$", regex=1)
+    assert numbers == list(range(59, 49, -1))
+    # A time range, and a level
+    numbers, _ = search(q="", **{"from": "2025-01-01T12:10:00", "to": "2025-01-01T12:12:00", "level": "error"})
+    assert numbers == [71, 67, 63]
+    # Times with a timezone get converted to local time, which is what the log is in
+    since, until = (datetime(2025, 1, 1, 12, minute).astimezone().astimezone(timezone(timedelta(hours=-7))) for minute in (10, 12))
+    numbers, _ = search(q="", **{"from": since.isoformat(), "to": until.isoformat(), "level": "error"})
+    assert numbers == [71, 67, 63]
+    # Tracebacks go with the line before them
+    _, page = search(q="ZeroDivisionError", **{"from": "2025-01-01T12:16:40", "to": "2025-01-01T12:16:41"})
+    assert page.count("ZeroDivisionError: division by zero") == 1
+
+    assert client.get('/logs/search/', query_string={"q": "(", "regex": 1}).status_code == 400
+    # Bad input gets a 400 before the page starts streaming, not a page that stops halfway
+    for args in ({"before": "abc"}, {"before": "app.log.gz:abc"}, {"before": ":12"}, {"from": "garbage"}, {"to": "2025-13-01"}):
+        assert client.get('/logs/search/', query_string={"q": "x", **args}).status_code == 400, args
+    assert client.get('/logs/debug/', query_string={"from": "garbage"}).status_code == 400
+    assert client.get('/logs/api/', query_string={"to": "garbage"}).status_code == 400
+    assert client.get('/logs/api/', query_string={"from": "2025-01-01T12:00:10+00:00"}).status_code == 200
+
+def test_search_byte_cap(utils, timed_log):
+    page = {'before': None}
+    pattern = re.compile("Message")
+    size = timed_log.stat().st_size
+    found = list(utils.search_lines(str(timed_log), pattern, max_bytes=2000, page=page))
+    assert page['truncated'] and 0 < len(found) < 600
+    # Carrying on from where it stopped picks up with the very next line
+    more = list(utils.search_lines(str(timed_log), pattern, end=page['before'], max_bytes=size))
+    assert [line for _, line in found + more] == [line for line in timed_log.read_text().splitlines()[::-1] if "Message" in line]
+
+@pytest.fixture
+def merged_logs(tmp_path):
+    """ Three logs in different formats, with their lines interleaved in time. Gives back the sources,
+        and what each line should say, newest first
+    """
+    start = datetime(2025, 1, 1, 12)
+    levels = ["DEBUG", "INFO", "WARNING", "ERROR"]
+    app, system, runner = [], [], []
+    for i in range(300):
+        when = start + timedelta(seconds=i)
+        if i % 3 == 0:
+            app.append(f"{when:%Y-%m-%d %H:%M:%S},000 - {levels[i % 4]} - Message number {i}\n")
+            if i % 30 == 0:
+                app.append("Traceback (most recent call last):\n  ZeroDivisionError: division by zero\n")
+        elif i % 3 == 1:
+            system.append(f"[{when:%Y-%m-%d %H:%M:%S},000] {levels[i % 4]} in app: Message number {i}\n")
+        else:
+            runner.append(f"[{when:%Y-%m-%d %H:%M:%S} -0500] [123] [{levels[i % 4]}] Message number {i}\n")
+    sources = []
+    for name, lines, is_system in (("app", app, False), ("system", system, True), ("runner", runner, True)):
+        (tmp_path / f"{name}.log").write_text("".join(lines))
+        sources.append((name, str(tmp_path / f"{name}.log"), is_system))
+    return sources
+
+def test_merge_logs(utils, merged_logs):
+    entries = list(utils.merge_logs(merged_logs))
+    assert [int(lines[0].split()[-1]) for _, _, _, lines in entries] == list(range(299, -1, -1))
+    assert [name for _, name, _, _ in entries[:3]] == ["runner", "system", "app"]
+    # Tracebacks stay with their line
+    assert entries[-1][3][1:] == ["Traceback (most recent call last):", "  ZeroDivisionError: division by zero"]
+
+    # Carrying on from an offset in each one
+    before = {name: offset for _, name, offset, _ in entries[:10]}
+    assert list(utils.merge_logs(merged_logs, before)) == entries[10:]
+
+def test_merged_endpoint(log_app, utils, merged_logs):
+    bp = Blueprint("test_merged", __name__)
+    utils.generate_merged_log_endpoint(bp, merged_logs)
+    log_app.register_blueprint(bp)
+    client = log_app.test_client()
+
+    # Paging all the way through gets everything, once, in order
+    found = []
+    args = {"limit": 40}
+    while True:
+        page = client.get('/logs/merged/debug/', query_string=args).get_data(as_text=True)
+        found += re.findall(r'\[(\w+)\]</span>.*?Message number (\d+)', page)
+        if not (more := re.search(r'before=([^"&]+)', page)):
+            break
+        args["before"] = more.group(1)
+    assert [int(n) for _, n in found] == list(range(299, -1, -1))
+    assert [name for name, n in found] == [["app", "system", "runner"][int(n) % 3] for _, n in found]
+
+    page = client.get('/logs/merged/error/').get_data(as_text=True)
+    assert [int(n) for n in re.findall(r'Message number (\d+)', page)] == list(range(299, 0, -4))
+    assert client.get('/logs/merged/debug/', query_string={"before": "app"}).status_code == 400
+
+def test_log_records_api(log_client, log_file):
+    lines = list(utils_lines(log_file))
+    inode = log_file.stat().st_ino
+    # Paging through gets all of them, newest first, as records
+    records = []
+    args = {"limit": 15}
+    while True:
+        page = log_client.get('/logs/api/', query_string=args).get_json()
+        records += page['records']
+        if page['before'] is None:
+            break
+        args['before'] = page['before']
+    assert [(r['offset'], r['msg']) for r in records] == [(offset, line.split(' - ')[-1]) for offset, line in reversed(lines)]
+    assert records[0]['level'] == "INFO" and records[0]['levelno'] == 20
+    assert records[0]['ts'] == datetime.strptime(lines[-1][1][:23], "%Y-%m-%d %H:%M:%S,%f").timestamp()
+
+    # Only the first page has a stream, which starts after it, and sends records too
+    first = log_client.get('/logs/api/', query_string={"level": "error"}).get_json()
+    assert {r['level'] for r in first['records']} == {"ERROR"} and len(first['records']) == 12
+    assert first['last_event_id'] == f"{inode}:{lines[-1][0]}"
+    assert "format=json" in first['stream']
+    resp = log_client.get('/logs/stream/', query_string={"format": "json"},
+        headers={'Last-Event-ID': f"{inode}:{lines[-2][0]}"}, buffered=False)
+    chunks = iter(resp.response)
+    next(chunks)
+    event = next(chunks).decode()
+    assert event.startswith(f"id: {inode}:{lines[-1][0]}\ndata: ")
+    assert json.loads(event.split("data: ", 1)[1]) == records[0]
+    resp.close()
+
+    assert log_client.get('/logs/api/', query_string={"level": "loud"}).status_code == 400
+    # The page size has to be at least 1, everywhere that takes one
+    for limit in (0, -5, "lots"):
+        for url in ('/logs/api/', '/logs/debug/', '/logs/search/'):
+            assert log_client.get(url, query_string={"limit": limit}).status_code == 400, (url, limit)
+    # Nothing there is just an empty page
+    assert log_client.get('/logs/api/', query_string={"from": "2099-01-01T00:00:00"}).get_json()['before'] is None
+    assert log_client.get('/logs/viewer/').status_code == 200
+
+def test_stream_endpoint(log_app, utils, log_file, tmp_path, monkeypatch):
+    from rock_server import log_streamer
+    other_log = tmp_path / "other.log"
+    other_log.write_text("".join(make_log_lines(5)))
+    for name, path in (("streamed", log_file), ("other", other_log)):
+        bp = Blueprint(name, __name__)
+        utils.generate_log_endpoints(bp, str(path), False)
+        log_app.register_blueprint(bp, url_prefix=f"/{name}")
+    monkeypatch.setitem(log_app.config, 'LOG_STREAM_URL', "http://pi:5051/")
+    # Only the first one is served by the streamer
+    monkeypatch.setattr(log_streamer, "STREAMS", {"/streamed/logs/stream/": (str(log_file), False)})
+    client = log_app.test_client()
+
+    # It keeps the blueprint's prefix
+    assert client.get('/streamed/logs/api/').get_json()['stream'].startswith("http://pi:5051/streamed/logs/stream/?")
+    # And the one the streamer doesn't know about gets streamed by the app
+    assert client.get('/other/logs/api/').get_json()['stream'].startswith("/other/logs/stream/?")
+    monkeypatch.setitem(log_app.config, 'LOG_STREAM_URL', None)
+    assert client.get('/streamed/logs/api/').get_json()['stream'].startswith("/streamed/logs/stream/?")
@@ -0,0 +1,82 @@
+import logging
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import sleep
+import pytest
+import requests
+
+from rock_server import metrics
+from rock_server.metrics import RequestMetrics, RollingHistogram
+from .test_access_log import logged
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        sleep(.05)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def slow_server():
+    server = HTTPServer(("127.0.0.1", 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_rolling_histogram():
+    histogram = RollingHistogram(window_sec=60, slots=6)
+    for ms in (0.5, 3, 3, 40, 2000):
+        histogram.add(ms, now=100)
+    snapshot = histogram.snapshot(now=100)
+    assert snapshot["count"] == 5
+    assert snapshot["buckets"]["1"] == 1 and snapshot["buckets"]["5"] == 2 and snapshot["buckets"]["2500"] == 1
+    assert (snapshot["p50"], snapshot["p90"], snapshot["p99"]) == (5, 2500, 2500)
+
+    # A bit later it's still there, and then it falls out of the window
+    histogram.add(10, now=130)
+    assert histogram.snapshot(now=155)["count"] == 6
+    assert histogram.snapshot(now=165)["count"] == 1
+    assert histogram.snapshot(now=500)["count"] == 0
+
+def test_request_timing(logged, slow_server, tmp_path):
+    logger, records = logged
+    request_metrics = RequestMetrics(logger, slow_ms=30)
+
+    # Outside of a request, nothing gets timed
+    with metrics.connect(tmp_path / "test.db") as con:
+        con.execute("CREATE TABLE things (n)")
+
+    token = request_metrics.start()
+    with metrics.connect(tmp_path / "test.db") as con:
+        con.executemany("INSERT INTO things VALUES (?)", [(i,) for i in range(100)])
+        assert len(con.execute("SELECT * FROM things").fetchall()) == 100
+    assert metrics.http.get(slow_server).text == "ok"
+    # Only the app's own connections and requests count, nobody else's
+    with sqlite3.connect(tmp_path / "test.db") as con:
+        con.execute("SELECT * FROM things").fetchall()
+    assert requests.get(slow_server).text == "ok"
+    timings = request_metrics.finish(token, "GET", "/things/", 200)
+
+    assert timings.counts == {"db": 3, "http": 1}
+    assert timings.ms["http"] >= 50
+    assert 0 < timings.ms["db"] < timings.ms["http"]
+    snapshot = request_metrics.snapshot()["GET /things/"]
+    assert snapshot["wall"]["count"] == snapshot["db"]["count"] == snapshot["http"]["count"] == 1
+    assert snapshot["wall"]["sum_ms"] >= snapshot["http"]["sum_ms"] >= 50
+
+    # It was slow, so there's a trace of where the time went
+    assert len(records) == 1 and records[0].levelno == logging.WARNING
+    trace = records[0].getMessage()
+    assert "Slow request: GET /things/ -> 200" in trace
+    assert "SELECT * FROM things" in trace and f"GET {slow_server}" in trace
+
+    # Quick ones don't get one
+    request_metrics.finish(request_metrics.start(), "GET", "/quick/", 200)
+    assert len(records) == 1
@@ -0,0 +1,111 @@
+import gc
+import multiprocessing
+import os
+import re
+import pytest
+
+from rock_server import prometheus
+from rock_server.prometheus import Registry
+
+PROCESSES = 4
+
+
+def make_registry(directory):
+    registry = Registry(str(directory))
+    return registry, {
+        "requests": registry.counter("requests_total", "Requests", ("route",)),
+        "busy": registry.gauge("busy", "Busy workers"),
+        "biggest": registry.gauge("biggest", "Biggest thing", multiprocess_mode="max"),
+        "seconds": registry.histogram("seconds", "How long", ("route",), buckets=(.1, 1, float('inf'))),
+    }
+
+def worker(directory, n, started, stop):
+    """ Pretend to be a gunicorn worker """
+    _, metrics = make_registry(directory)
+    for i in range(100):
+        metrics["requests"].labels(route="/info/").inc()
+        metrics["seconds"].labels("/info/").observe(.05 if i % 2 else 2)
+    metrics["busy"].inc()
+    metrics["biggest"].set(n)
+    started.release()
+    stop.wait(10)
+
+def samples(text):
+    return dict(re.findall(r'^(\S+) (\S+)$', text, re.MULTILINE))
+
+
+def test_across_processes(tmp_path):
+    context = multiprocessing.get_context("fork")
+    started, stop = context.Semaphore(0), context.Event()
+    processes = [context.Process(target=worker, args=(str(tmp_path), n, started, stop)) for n in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        assert started.acquire(timeout=10)
+
+    # Whichever process gets asked adds everyone up
+    registry, metrics = make_registry(tmp_path)
+    metrics["requests"].labels(route="/info/").inc()
+    text = registry.render()
+    found = samples(text)
+    assert found['requests_total{route="/info/"}'] == str(PROCESSES * 100 + 1)
+    assert found['busy'] == str(PROCESSES)
+    assert found['biggest'] == str(PROCESSES - 1)
+    assert found['seconds_bucket{le="0.1",route="/info/"}'] == str(PROCESSES * 50)
+    assert found['seconds_bucket{le="+Inf",route="/info/"}'] == found['seconds_count{route="/info/"}'] == str(PROCESSES * 100)
+    assert float(found['seconds_sum{route="/info/"}']) == pytest.approx(PROCESSES * (50 * .05 + 50 * 2))
+    assert "# TYPE requests_total counter" in text and "# HELP seconds How long" in text
+    # Buckets are in order
+    assert text.index('le="0.1"') < text.index('le="1"') < text.index('le="+Inf"')
+
+    # Once they've gone, their counters still count, but their gauges don't
+    stop.set()
+    for process in processes:
+        process.join(10)
+    found = samples(registry.render())
+    assert found['requests_total{route="/info/"}'] == str(PROCESSES * 100 + 1)
+    assert 'busy' not in found
+
+def test_growing(tmp_path, monkeypatch):
+    monkeypatch.setattr(prometheus, "INITIAL_FILE_SIZE", 256)
+    registry = Registry(str(tmp_path))
+    counter = registry.counter("things_total", "Things", ("n",))
+    for n in range(500):
+        counter.labels(n=n).inc(n)
+    found = samples(registry.render())
+    assert len(found) == 500 and found['things_total{n="499"}'] == "499"
+    assert os.path.getsize(tmp_path / f"{os.getpid()}.db") > 256
+
+    # Opening the file again picks up where it was
+    values = prometheus.MmapValues(str(tmp_path / f"{os.getpid()}.db"))
+    values.inc(prometheus._key("things_total", {"n": "1"}), 1)
+    assert samples(registry.render())['things_total{n="1"}'] == "2"
+
+def test_labels():
+    registry = Registry()
+    counter = registry.counter("labelled_total", "Labelled", ("path",))
+    counter.labels(path='a "quoted"\npath').inc()
+    assert 'labelled_total{path="a \\"quoted\\"\\npath"} 1' in registry.render()
+    with pytest.raises(ValueError):
+        counter.labels(other="x")
+
+def test_close(tmp_path):
+    # A temporary directory gets cleaned up
+    registry = Registry()
+    registry.counter("things_total", "Things").inc()
+    assert os.path.isdir(registry.directory)
+    registry.close()
+    assert not os.path.exists(registry.directory)
+
+    # Even if it's never closed
+    registry = Registry()
+    directory = registry.directory
+    del registry
+    gc.collect()
+    assert not os.path.exists(directory)
+
+    # But one it was given is left alone
+    registry = Registry(str(tmp_path))
+    registry.counter("things_total", "Things").inc()
+    registry.close()
+    assert os.path.exists(tmp_path / f"{os.getpid()}.db")
@@ -1,3 +1,4 @@
+from collections import Counter
 from copy import deepcopy
 import uuid
 from datetime import datetime, timedelta, time
@@ -8,7 +9,7 @@ from unittest.mock import patch, MagicMock
 
 def get_reminder(app):
     with app.app_context():
-        from rock_server.projects.irregular_reminders.Reminder import Reminder
+        from rock_server.projects.irregular_reminders.main_server.Reminder import Reminder
         return Reminder
 
 
@@ -243,3 +244,127 @@ class TestReminder:
         # Different ID
         reminder2.id = str(uuid.uuid4())
         assert reminder1 != reminder2
+
+    def test_record_trigger(self, app, examples):
+        """Test that recording a trigger advances repeating reminders and kills one-shot ones"""
+        # Give it enough room to go off again
+        repeating = examples['reminder_objs'][0].get_modified({"max_time": datetime.now() + timedelta(days=7)})
+        one_shot = deepcopy(examples['reminder_objs'][1])
+        fired_at = datetime.now()
+
+        repeating.record_trigger(fired_at)
+        assert repeating.last_trigger_time == fired_at
+        assert repeating.alive
+        assert repeating.next_trigger_time >= fired_at + repeating.spacing_min
+
+        one_shot.record_trigger(fired_at)
+        assert one_shot.last_trigger_time == fired_at
+        assert not one_shot.alive
+
+    def test_record_trigger_past_max_time(self, app, examples):
+        """Test that a repeating reminder dies if it can't go off again before max_time"""
+        reminder = deepcopy(examples['reminder_objs'][0])
+        # spacing_min is an hour, and max_time is only a few seconds away
+        reminder.record_trigger(datetime.now())
+        assert not reminder.alive
+
+    def test_record_trigger_samples_from_when(self, app, examples, monkeypatch):
+        """Test that the next time is sampled from when it went off, not from when we heard about it"""
+        Reminder = get_reminder(app)
+        with app.app_context():
+            from rock_server.projects.irregular_reminders.main_server.Reminder import FakeClock
+        # Always wait exactly the mean
+        monkeypatch.setitem(Reminder.dist_map, Reminder.Distribution.EXPONENTIAL, lambda lambd: lambd)
+        start = datetime.now()
+        monkeypatch.setattr(Reminder, "clock", clock := FakeClock(start))
+        reminder = examples['reminder_objs'][0].get_modified({
+            "dist": "exponential", "dist_params": {"mean": timedelta(hours=2)},
+            "max_time": None, "spacing_min": None, "spacing_max": None,
+            "work_days": [True] * 7,
+        })
+
+        # We only hear about it an hour later, but it's still 2 hours after it went off
+        clock.advance(timedelta(hours=1))
+        reminder.record_trigger(start)
+        assert reminder.next_trigger_time == start + timedelta(hours=2)
+
+        # If that's already gone by, it goes off as soon as it can
+        clock.advance(timedelta(hours=5))
+        reminder.record_trigger(start + timedelta(hours=2))
+        assert reminder.next_trigger_time == clock.time
+        assert reminder.alive
+
+    def test_level_load(self, app, examples, monkeypatch):
+        """Test that samples snapped to the next allowed time get spread out once a minute is crowded"""
+        Reminder = get_reminder(app)
+        monkeypatch.setattr(Reminder, "snap_jitter_sec", 600)
+        monkeypatch.setattr(Reminder, "snap_bucket_limit", 2)
+        monkeypatch.setattr(Reminder, "snap_buckets", Counter())
+
+        reminder = examples['reminder_objs'][1]
+        snapped = datetime.combine(datetime.now().date() + timedelta(days=1), reminder.work_hours_start)
+
+        # The first few are left alone
+        assert reminder._level_load(snapped) == snapped
+        assert reminder._level_load(snapped) == snapped
+
+        leveled = [reminder._level_load(snapped) for _ in range(50)]
+        assert all(snapped <= t <= snapped + timedelta(seconds=600) for t in leveled)
+        assert len(set(leveled)) > 1
+
+        # Samples that weren't snapped are never touched
+        unsnapped = snapped + timedelta(minutes=5, seconds=3)
+        assert all(reminder._level_load(unsnapped) == unsnapped for _ in range(5))
+
+        # Ones without work hours get snapped to midnight on the next work day, so those get spread out too
+        only_days = examples["reminder_objs"][0].get_modified({"max_time": datetime(2030, 2, 1), "spacing_max": None})
+        # A Saturday night, so the next time is Monday
+        midnight = only_days.next_allowed_time(datetime(2030, 1, 12, 23, 30))
+        assert midnight == datetime(2030, 1, 14)
+        leveled = [only_days._level_load(midnight) for _ in range(50)]
+        assert all(midnight <= t <= midnight + timedelta(seconds=600) for t in leveled)
+        assert len(set(leveled)) > 1
+
+    def test_level_load_late(self, app, examples, monkeypatch):
+        """Test that reminders we hear about too late get leveled too"""
+        Reminder = get_reminder(app)
+        with app.app_context():
+            from rock_server.projects.irregular_reminders.main_server.Reminder import FakeClock
+        monkeypatch.setattr(Reminder, "snap_jitter_sec", 600)
+        monkeypatch.setattr(Reminder, "snap_bucket_limit", 2)
+        monkeypatch.setattr(Reminder, "snap_buckets", Counter())
+        monkeypatch.setitem(Reminder.dist_map, Reminder.Distribution.EXPONENTIAL, lambda lambd: lambd)
+        # A Monday evening, after work hours, so the soonest it can go off is 9am the next day
+        start = datetime(2030, 1, 7, 18)
+        monkeypatch.setattr(Reminder, "clock", clock := FakeClock(start))
+        reminder = examples['reminder_objs'][2].get_modified({
+            "alive": True, "min_time": start - timedelta(days=1), "spacing_min": None,
+            "dist_params": {"mean": timedelta(minutes=5)}, "work_days": [True] * 7,
+        })
+        snapped = datetime(2030, 1, 8, 9)
+
+        times = []
+        for _ in range(20):
+            late = reminder.get_modified({})
+            late.record_trigger(start - timedelta(hours=2))
+            times.append(late.next_trigger_time)
+        assert all(snapped <= t <= snapped + timedelta(seconds=600) for t in times)
+        assert times.count(snapped) == 2
+
+    def test_fake_clock(self, app, examples, monkeypatch):
+        """Test that the reminder only knows what time it is through Reminder.clock"""
+        Reminder = get_reminder(app)
+        with app.app_context():
+            from rock_server.projects.irregular_reminders.main_server.Reminder import FakeClock
+        clock = FakeClock(datetime.now() + timedelta(days=30))
+        monkeypatch.setattr(Reminder, "clock", clock)
+
+        reminder = examples['reminder_objs'][1]
+        assert reminder.now() == clock.time
+        # A month from now, it's well past max_time
+        assert not reminder.can_trigger()
+
+        clock.time = reminder.next_trigger_time
+        assert reminder.now() == reminder.next_trigger_time
+        clock.advance(timedelta(seconds=1))
+        assert reminder.now() == reminder.next_trigger_time + timedelta(seconds=1)
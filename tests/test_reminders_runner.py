@@ -0,0 +1,289 @@
+import sqlite3
+from time import sleep, time
+import pytest
+
+
+@pytest.fixture(scope="session")
+def runner_module(tmp_path_factory):
+    """ The reminders runner's app.py, with its own db, and without the scheduler or the workers running """
+    # It only reads these when it's imported, so they don't need to stick around for everything else
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("REMINDERS_DB", str(tmp_path_factory.mktemp("runner") / "reminders.db"))
+        mp.setenv("REMINDERS_RUNNER_START", "0")
+        from rock_server.projects.irregular_reminders.reminders_runner import app as runner
+    # The main app makes this one
+    with sqlite3.connect(runner.DB) as con:
+        con.execute("CREATE TABLE IF NOT EXISTS devices (device_id TEXT PRIMARY KEY, token, platform, app_version, last_updated)")
+    return runner
+
+@pytest.fixture
+def runner(runner_module, monkeypatch):
+    """ The runner, with empty tables, and a device called "phone" """
+    with sqlite3.connect(runner_module.DB) as con:
+        con.executescript("""
+            DELETE FROM push_outbox;
+            DELETE FROM fired_outbox;
+            DELETE FROM devices;
+            INSERT INTO devices (device_id, token) VALUES ('phone', 'ExponentPushToken[phone]');
+            INSERT INTO devices (device_id, token) VALUES ('tablet', 'ExponentPushToken[tablet]');
+        """)
+    monkeypatch.setitem(runner_module.app.config, 'COALESCE_WINDOW_SEC', 0)
+    return runner_module
+
+def outbox(runner):
+    """ [(device_id, title, message, state, attempts), ...], oldest first """
+    with sqlite3.connect(runner.DB) as con:
+        return con.execute("SELECT device_id, title, message, state, attempts FROM push_outbox ORDER BY id").fetchall()
+
+
+def test_merge_notifications(runner):
+    assert runner.merge_notifications([("Water", "the plants")]) == ("Water", "the plants")
+    assert runner.merge_notifications([("Water", "the plants"), ("Stretch", None)]) == ("2 reminders", "Water: the plants\nStretch")
+
+def test_coalescing(runner, monkeypatch):
+    # Without a window, they each get their own push
+    runner.send_push_notification("phone", "One", "1")
+    runner.send_push_notification("phone", "Two", "2")
+    assert [row[1] for row in outbox(runner)] == ["One", "Two"]
+
+    with sqlite3.connect(runner.DB) as con:
+        con.execute("DELETE FROM push_outbox")
+    monkeypatch.setitem(runner.app.config, 'COALESCE_WINDOW_SEC', .2)
+    runner.send_push_notification("phone", "One", "1")
+    runner.send_push_notification("tablet", "Other", "device")
+    runner.send_push_notification("phone", "Two", "2")
+    runner.send_push_notification("phone", "Three", None)
+    # Nothing goes out until the window's up
+    assert outbox(runner) == []
+    sleep(.5)
+    assert sorted(outbox(runner)) == [
+        ("phone", "3 reminders", "One: 1\nTwo: 2\nThree", "pending", 0),
+        ("tablet", "Other", "device", "pending", 0),
+    ]
+    assert runner._pending == {}
+
+    # And the next one starts a new window
+    runner.send_push_notification("phone", "Four", "4")
+    sleep(.5)
+    assert outbox(runner)[-1] == ("phone", "Four", "4", "pending", 0)
+
+
+class FakeExpo:
+    """ Stands in for requests.post to expo. Gives back tickets (or raises error), and remembers what it was sent """
+    def __init__(self, tickets=None, error=None):
+        self.tickets = tickets
+        self.error = error
+        self.sent = []
+
+    def __call__(self, url, json, **kwargs):
+        self.sent.append(json)
+        if self.error:
+            raise self.error
+        tickets = self.tickets if self.tickets is not None else [{"status": "ok"}] * len(json)
+        class Response:
+            def raise_for_status(self):
+                pass
+            def json(self):
+                return {"data": tickets}
+        return Response()
+
+def expo(runner, monkeypatch, **kwargs):
+    monkeypatch.setattr(runner.requests, "post", fake := FakeExpo(**kwargs))
+    return fake
+
+def test_outbox_sent(runner, monkeypatch):
+    runner.enqueue_push("phone", "Hi", "there")
+    runner.enqueue_push("tablet", "Hey", None)
+    fake = expo(runner, monkeypatch)
+    assert runner.drain_outbox() == 2
+    assert [message["to"] for message in fake.sent[0]] == ["ExponentPushToken[phone]", "ExponentPushToken[tablet]"]
+    assert [row[3:] for row in outbox(runner)] == [("sent", 1), ("sent", 1)]
+    # Nothing left to send
+    assert runner.drain_outbox() == 0
+
+def test_outbox_failures(runner, monkeypatch):
+    runner.enqueue_push("phone", "Retry", "me")
+    runner.enqueue_push("phone", "Gone", "device")
+    runner.enqueue_push("nobody", "Unknown", "device")
+    expo(runner, monkeypatch, tickets=[
+        {"status": "error", "message": "Too many requests"},
+        {"status": "error", "message": "Not registered", "details": {"error": "DeviceNotRegistered"}},
+    ])
+    assert runner.drain_outbox() == 3
+    # Errors get retried later, unless there's no point
+    assert [row[1:] for row in outbox(runner)] == [
+        ("Retry", "me", "pending", 1),
+        ("Gone", "device", "failed", 1),
+        ("Unknown", "device", "failed", 1),
+    ]
+    with sqlite3.connect(runner.DB) as con:
+        assert con.execute("SELECT next_attempt_at FROM push_outbox WHERE title = 'Retry'").fetchone()[0] > time()
+    # Not due yet
+    assert runner.drain_outbox() == 0
+
+def test_outbox_gives_up(runner, monkeypatch):
+    monkeypatch.setitem(runner.app.config, 'OUTBOX_RETRY_BACKOFF_SEC', 0)
+    monkeypatch.setitem(runner.app.config, 'OUTBOX_MAX_ATTEMPTS', 3)
+    runner.enqueue_push("phone", "Hi", "there")
+    expo(runner, monkeypatch, error=ConnectionError("expo's down"))
+    for attempts in (1, 2):
+        runner.drain_outbox()
+        assert outbox(runner)[0][3:] == ("pending", attempts)
+    runner.drain_outbox()
+    assert outbox(runner)[0][3:] == ("failed", 3)
+    with sqlite3.connect(runner.DB) as con:
+        assert con.execute("SELECT error FROM push_outbox").fetchone()[0] == "expo's down"
+
+def test_outbox_missing_tickets(runner, monkeypatch):
+    for title in ("One", "Two", "Three"):
+        runner.enqueue_push("phone", title, None)
+    expo(runner, monkeypatch, tickets=[{"status": "ok"}])
+    runner.drain_outbox()
+    # The ones without a ticket get sent again, instead of being stuck sending
+    assert [row[3:] for row in outbox(runner)] == [("sent", 1), ("pending", 1), ("pending", 1)]
+
+def test_outbox_reclaims_stuck_sends(runner, monkeypatch):
+    runner.enqueue_push("phone", "Stuck", None)
+    with sqlite3.connect(runner.DB) as con:
+        assert len(runner.claim_outbox_batch(con, 10)) == 1
+        # Whatever claimed it is still working on it
+        assert runner.claim_outbox_batch(con, 10) == []
+        # Until it's been too long
+        con.execute("UPDATE push_outbox SET next_attempt_at = ?", (time() - 1,))
+        con.commit()
+        assert [row[2] for row in runner.claim_outbox_batch(con, 10)] == ["Stuck"]
+    assert outbox(runner)[0][3] == "sending"
+
+def test_outbox_prune(runner, monkeypatch):
+    for title in ("Sent", "Failed", "Pending", "Sending", "New"):
+        runner.enqueue_push("phone", title, None)
+    week_ago = time() - 8 * 24 * 60 * 60
+    with sqlite3.connect(runner.DB) as con:
+        con.executemany("UPDATE push_outbox SET state = ?, created_at = ? WHERE title = ?", [
+            ("sent", week_ago, "Sent"), ("failed", week_ago, "Failed"),
+            ("pending", week_ago, "Pending"), ("sending", week_ago, "Sending"), ("sent", time(), "New"),
+        ])
+    # Only the old ones that are done with
+    assert runner.prune_outbox() == 2
+    assert [row[1] for row in outbox(runner)] == ["Pending", "Sending", "New"]
+    assert runner.prune_outbox() == 0
+    assert runner.prune_outbox(now=time() + 8 * 24 * 60 * 60) == 1
+
+
+def test_latency_histograms(runner):
+    histograms = runner.LatencyHistograms(keep_hours=2)
+    hour = 1_700_000_000 // 3600 * 3600
+    # On a bucket's edge counts as in it
+    for seconds in (.001, .0015, .05, .05, .3, 1000):
+        histograms.record("expo_rtt", seconds, when=hour + 10)
+    counts = histograms.metrics["expo_rtt"][hour]["counts"]
+    buckets = dict(zip((*runner.LatencyHistograms.BUCKETS, "overflow"), counts))
+    assert buckets[.001] == 1 and buckets[.002] == 1 and buckets[.05] == 2 and buckets[.5] == 1 and buckets["overflow"] == 1
+    assert sum(counts) == 6
+
+    # Percentiles are the top of the bucket they land in, or the biggest value seen, if that's smaller
+    assert runner.LatencyHistograms.percentile(counts, .5, 1000) == .05
+    assert runner.LatencyHistograms.percentile(counts, .8, 1000) == .5
+    assert runner.LatencyHistograms.percentile(counts, .99, 1000) == 1000
+    assert runner.LatencyHistograms.percentile(counts, .5, .03) == .03
+    assert runner.LatencyHistograms.percentile([0] * len(counts), .5, 0) is None
+
+    [summary] = histograms.summary()["expo_rtt"]
+    assert summary["count"] == 6 and summary["p50_ms"] == 50 and summary["p99_ms"] == 1_000_000 and summary["max_ms"] == 1_000_000
+
+    # Hours past keep_hours get dropped
+    histograms.record("expo_rtt", .01, when=hour + 3600 + 10)
+    assert len(histograms.summary()["expo_rtt"]) == 2
+    histograms.record("expo_rtt", .01, when=hour + 2 * 3600 + 10)
+    assert [h["count"] for h in histograms.summary()["expo_rtt"]] == [1, 1]
+
+    # The Prometheus version is cumulative, and keeps everything
+    lines = histograms.prometheus("latency")
+    assert 'latency_bucket{metric="expo_rtt",le="0.001"} 1' in lines
+    assert 'latency_bucket{metric="expo_rtt",le="0.01"} 4' in lines
+    assert 'latency_bucket{metric="expo_rtt",le="0.05"} 6' in lines
+    assert 'latency_bucket{metric="expo_rtt",le="+Inf"} 8' in lines
+    assert 'latency_count{metric="expo_rtt"} 8' in lines
+
+def test_latency_endpoint(runner, monkeypatch):
+    monkeypatch.setattr(runner, "latency", histograms := runner.LatencyHistograms())
+    runner.enqueue_push("phone", "Hi", "there")
+    expo(runner, monkeypatch)
+    runner.drain_outbox()
+    client = runner.app.test_client()
+    summary = client.get("/metrics/latency").get_json()
+    assert {"token_lookup", "expo_rtt", "queue_to_ack"} <= set(summary)
+    assert summary["queue_to_ack"][0]["count"] == 1
+    assert 'runner_latency_seconds_count{metric="queue_to_ack"} 1' in client.get("/metrics").get_data(as_text=True)
+
+
+def test_fake_expo(runner, monkeypatch):
+    from rock_server.projects.irregular_reminders.reminders_runner import fake_expo
+    monkeypatch.setitem(fake_expo.app.config, 'ERROR_RATE', 0.)
+    monkeypatch.setitem(fake_expo.app.config, 'RATE_LIMIT', 0.)
+    fake_expo.stats.clear()
+    expo_client = fake_expo.app.test_client()
+
+    # Single messages, batches, and too big batches
+    ticket = expo_client.post("/--/api/v2/push/send", json={"to": "x"}).get_json()["data"]
+    assert ticket["status"] == "ok"
+    assert len(expo_client.post("/--/api/v2/push/send", json=[{"to": "x"}] * 3).get_json()["data"]) == 3
+    assert expo_client.post("/--/api/v2/push/send", json=[{"to": "x"}] * 101).status_code == 400
+    receipts = expo_client.post("/--/api/v2/push/getReceipts", json={"ids": [ticket["id"], "nope"]}).get_json()["data"]
+    assert receipts == {ticket["id"]: {"status": "ok"}}
+    # It only remembers so many
+    with monkeypatch.context() as mp:
+        mp.setattr(fake_expo, "MAX_RECEIPTS", 3)
+        newest = [t["id"] for t in expo_client.post("/--/api/v2/push/send", json=[{"to": "x"}] * 3).get_json()["data"]]
+        assert list(fake_expo.receipts) == newest
+        assert expo_client.post("/--/api/v2/push/getReceipts", json={"ids": [ticket["id"]]}).get_json()["data"] == {}
+
+    # The runner can send to it like it's expo
+    def post(url, json, **kwargs):
+        assert url == "http://fake-expo/--/api/v2/push/send"
+        data = expo_client.post("/--/api/v2/push/send", json=json).get_json()
+        return FakeExpo(tickets=data["data"])(url, json)
+    monkeypatch.setattr(runner.requests, "post", post)
+    monkeypatch.setitem(runner.app.config, 'EXPO_PUSH_URL', "http://fake-expo/--/api/v2/push/send")
+    for i in range(5):
+        runner.enqueue_push("phone", f"Hi {i}", None)
+    assert runner.drain_outbox() == 5
+    assert {row[3] for row in outbox(runner)} == {"sent"}
+    assert expo_client.get("/stats").get_json()["tickets_ok"] == 1 + 3 + 3 + 5
+
+    # Whole requests getting rate limited
+    monkeypatch.setitem(fake_expo.app.config, 'RATE_LIMIT', 1.)
+    assert expo_client.post("/--/api/v2/push/send", json={"to": "x"}).status_code == 429
+
+
+def test_flush_fired(runner, monkeypatch):
+    monkeypatch.setitem(runner.app.config, 'FIRE_FEEDBACK_BATCH_SIZE', 2)
+    for i in range(3):
+        runner.send_push_notification("phone", "Hi", None, reminder_id=f"reminder-{i}")
+    added = []
+    monkeypatch.setattr(runner.scheduler, "add_job", lambda **job: added.append(job))
+
+    # If the main app's down, they stay where they are for next time
+    expo(runner, monkeypatch, error=ConnectionError("main app's down"))
+    with pytest.raises(ConnectionError):
+        runner.flush_fired()
+    with sqlite3.connect(runner.DB) as con:
+        assert con.execute("SELECT COUNT(*) FROM fired_outbox").fetchone()[0] == 3
+
+    # Then they go oldest first, a batch at a time, and the jobs it sends back get scheduled
+    sent = []
+    class Response:
+        def raise_for_status(self):
+            pass
+        def json(self):
+            return {"jobs": [{"id": f"notify-{f['id']}"} for f in sent[-1]["fired"]]}
+    def post(url, json, **kwargs):
+        assert url.endswith("/runner/fired")
+        sent.append(json)
+        return Response()
+    monkeypatch.setattr(runner.requests, "post", post)
+    assert runner.flush_fired() == 2
+    assert runner.flush_fired() == 1
+    assert runner.flush_fired() == 0
+    assert [[f["id"] for f in batch["fired"]] for batch in sent] == [["reminder-0", "reminder-1"], ["reminder-2"]]
+    assert [job["id"] for job in added] == ["notify-reminder-0", "notify-reminder-1", "notify-reminder-2"]
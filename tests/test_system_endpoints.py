@@ -0,0 +1,169 @@
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep
+import pytest
+from flask import Flask
+
+PROBE_DELAY = .3
+
+
+class FakeRunner(BaseHTTPRequestHandler):
+    """ A reminders runner that takes a while to answer anything """
+    hits = 0
+
+    def do_GET(self):
+        FakeRunner.hits += 1
+        sleep(PROBE_DELAY)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"path": "%s"}' % self.path.encode())
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def fake_runner():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRunner)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    FakeRunner.hits = 0
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def system_app(tmp_path, monkeypatch):
+    """ Gives back (app, rock_server.system_endpoints), with the caches' stamps somewhere of our own """
+    app = Flask("rock_server")
+    app.DEBUG = True
+    app.LOG_FILE = str(tmp_path / "app.log")
+    with app.app_context():
+        from rock_server import system_endpoints
+        app.register_blueprint(system_endpoints.bp)
+        for cached, name in ((system_endpoints.packages, "packages"), (system_endpoints.git_info, "git"),
+                (system_endpoints.runner_info, "runner")):
+            monkeypatch.setattr(cached, "stamp", str(tmp_path / f"{name}.stamp") if cached.stamp else None)
+            monkeypatch.setattr(cached, "computed_at", None)
+        yield app, system_endpoints
+
+
+def test_cached_value(system_app, tmp_path):
+    _, system_endpoints = system_app
+    calls = []
+    def compute():
+        calls.append(1)
+        return len(calls)
+    stamp = str(tmp_path / "test.stamp")
+    # Two workers' worth
+    first = system_endpoints.CachedValue(compute, ttl=.2, stamp=stamp)
+    second = system_endpoints.CachedValue(compute, ttl=60, stamp=stamp)
+
+    assert first.get() == first.get() == 1
+    assert second.get() == 2
+    sleep(.25)
+    assert first.get() == 3
+    # Invalidating it in one worker invalidates it in the other too
+    first.invalidate()
+    assert second.get() == 4
+    assert first.get() == 5
+    assert second.get() == 4
+
+def test_info(system_app, fake_runner, monkeypatch):
+    app, system_endpoints = system_app
+    monkeypatch.setattr(system_endpoints, "RUNNER_URL", fake_runner)
+    client = app.test_client()
+
+    assert client.get('/healthz/').get_json() == {"status": "ok"}
+    assert client.get('/healthz').get_json() == {"status": "ok"}
+
+    # The runner gets asked everything at once
+    start = perf_counter()
+    info = client.get('/info/').get_json()
+    assert perf_counter() - start < PROBE_DELAY * 2
+    assert info["irregular_reminders"]["currently_running_jobs"] == {"path": "/scheduler/jobs"}
+    assert info["last_commit_msg"] == system_endpoints.repo.head.commit.message
+    assert FakeRunner.hits == 3
+
+    # And then not again for a bit
+    client.get('/info/')
+    assert FakeRunner.hits == 3
+
+def test_info_without_runner(system_app, monkeypatch):
+    app, system_endpoints = system_app
+    monkeypatch.setattr(system_endpoints, "RUNNER_URL", "http://127.0.0.1:1")
+    assert app.test_client().get('/info/').get_json()["irregular_reminders"] == {"status": "Not running"}
+
+def test_deploy_plan(system_app):
+    _, system_endpoints = system_app
+    plan = system_endpoints.deploy_plan
+    nothing = {"restart": False, "restart_runner": False, "daemon_reload": False}
+
+    # Most changes just need a reload
+    assert plan({"rock_server/utils.py", "README.md"}) == nothing
+    assert plan(set()) == nothing
+    # The runner only gets restarted if it changed
+    assert plan({"rock_server/projects/irregular_reminders/reminders_runner/app.py"}) == {**nothing, "restart_runner": True}
+    # Things only the master or the log writer load need a real restart
+    assert plan({"rock_server/log_writer.py", "rock_server/app.py"}) == {**nothing, "restart": True}
+    # And so do the service files, once systemd's reloaded them
+    assert plan({"rock-server.service"}) == {**nothing, "restart": True, "daemon_reload": True}
+    assert plan({"reminders-runner.service"}) == {**nothing, "restart_runner": True, "daemon_reload": True}
+
+
+class FakeSystemctl:
+    """ Stands in for subprocess.run, failing whichever systemctl commands it's told to """
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.calls = []
+
+    def __call__(self, args, **kwargs):
+        command = " ".join(args[2:])
+        self.calls.append(command)
+        return subprocess.CompletedProcess(args, 1 if command in self.failing else 0, "", "nope")
+
+@pytest.fixture
+def systemctl(system_app, monkeypatch):
+    """ Gives back a function that makes a FakeSystemctl, and a list of the times the server got restarted """
+    _, system_endpoints = system_app
+    restarts = []
+    monkeypatch.setattr(system_endpoints, "restart_server", lambda: restarts.append(True))
+    def fake(*failing):
+        monkeypatch.setattr(system_endpoints.subprocess, "run", fake_run := FakeSystemctl(failing))
+        return fake_run
+    return fake, restarts
+
+def test_deploy(system_app, systemctl):
+    _, system_endpoints = system_app
+    fake, restarts = systemctl
+    plan = system_endpoints.deploy_plan
+
+    run = fake()
+    assert system_endpoints.deploy(plan({"rock_server/utils.py"})) == {"status": "reloaded", "errors": []}
+    assert run.calls == ["reload rock-server"]
+    assert restarts == []
+
+    run = fake()
+    assert system_endpoints.deploy(plan({"rock-server.service"})) == {"status": "restarting", "errors": []}
+    sleep(.1)
+    assert run.calls == ["daemon-reload"]
+    assert restarts == [True]
+
+def test_deploy_failures(system_app, systemctl):
+    _, system_endpoints = system_app
+    fake, restarts = systemctl
+    plan = system_endpoints.deploy_plan
+
+    # If the reload doesn't work, it restarts instead, and says what went wrong
+    run = fake("reload rock-server")
+    result = system_endpoints.deploy(plan({"rock_server/utils.py"}))
+    sleep(.1)
+    assert result["status"] == "restarting"
+    assert result["errors"] == ["systemctl reload rock-server failed (1): nope"]
+    assert run.calls == ["reload rock-server"]
+    assert restarts == [True]
+
+    run = fake("restart reminders-runner")
+    result = system_endpoints.deploy(plan({"rock_server/projects/irregular_reminders/reminders_runner/app.py"}))
+    assert result == {"status": "reloaded", "errors": ["systemctl restart reminders-runner failed (1): nope"]}
+    assert run.calls == ["restart reminders-runner", "reload rock-server"]